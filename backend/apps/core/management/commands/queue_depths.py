@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from nudge.celery import queue_depths
+
+
+class Command(BaseCommand):
+    help = "Prints how many messages wait in each Celery queue, to size workers per queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print one JSON object (for monitoring scripts).")
+
+    def handle(self, *args, **options):
+        depths = queue_depths()
+        if options["json"]:
+            self.stdout.write(json.dumps(depths))
+            return
+        for queue, depth in depths.items():
+            self.stdout.write(f"{queue:<12} {depth}")
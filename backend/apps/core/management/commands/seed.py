@@ -299,6 +299,8 @@ class Command(BaseCommand):
                 ),
             ]
         )
+        # bulk_create skips the lot receivers that keep the stock counters.
+        stocks["glucose_sensors"].refresh_counters()
 
         # ── Cibran — Medicine cabinet ───────────────────────────────────────
 
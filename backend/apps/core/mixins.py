@@ -1,11 +1,15 @@
 from datetime import timezone as _dt_timezone
 from email.utils import parsedate_to_datetime
 
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from rest_flex_fields import WILDCARD_ALL
 from rest_flex_fields.serializers import FlexFieldsSerializerMixin
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
+from .versioning import cached_payload, data_etag, etag_matches
+
 HEADER_NAME = "If-Unmodified-Since"
 
 # Sentinel passed to FlexFieldsModelSerializer's `omit` kwarg to neutralise
@@ -36,6 +40,27 @@ def parse_http_date(value):
     return dt
 
 
+def conditional_get(request, make_etag, respond):
+    """Answer with 304 when the client already holds the ETag `make_etag()`
+    returns, else `respond()`.
+
+    The ETag is per user, so the response is marked private and must be
+    revalidated before every reuse. Without a shared cache
+    (``API_CACHE_SHARED``) no ETag is computed or sent.
+    """
+    if not settings.API_CACHE_SHARED:
+        return respond()
+    etag = make_etag()
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = respond()
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
 class OptimisticLockingMixin:
     """
     DRF ViewSet mixin that enforces If-Unmodified-Since on PATCH/PUT/DELETE.
@@ -137,3 +162,49 @@ class SharedWithMixin:
             }
             for u in obj.shared_with.all()
         ]
+
+
+class CachedListMixin:
+    """DRF ViewSet mixin serving ``list`` from the per-user response cache.
+
+    The payload is keyed on the user's data version (see
+    ``apps.core.versioning``), so writes invalidate it without touching the
+    cache. ``cache_scope`` names the endpoint in the key; override
+    ``refresh_cached_list`` to recompute time-dependent fields on a hit.
+    """
+
+    cache_scope = None
+
+    def list(self, request, *args, **kwargs):
+        payload = cached_payload(
+            request,
+            self.cache_scope or self.basename,
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs).data,
+            refresh=self.refresh_cached_list,
+        )
+        return Response(payload)
+
+    def refresh_cached_list(self, payload):
+        pass
+
+
+class ConditionalListMixin:
+    """DRF ViewSet mixin answering ``If-None-Match`` on ``list``.
+
+    The read-side counterpart of ``OptimisticLockingMixin``: the ETag comes
+    from the user's data version (see ``apps.core.versioning``) before any
+    serialization, so an unchanged list costs a cache read and a 304. Views
+    whose payload changes with the clock override ``list_etag_state`` to
+    return the time-dependent part of it.
+    """
+
+    def list(self, request, *args, **kwargs):
+        scope = getattr(self, "cache_scope", None) or self.basename
+        return conditional_get(
+            request,
+            lambda: data_etag(request, scope, self.list_etag_state()),
+            lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs),
+        )
+
+    def list_etag_state(self):
+        return ()
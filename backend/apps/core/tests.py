@@ -5,12 +5,14 @@ from unittest import mock
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import transaction
 from django.test import RequestFactory, TestCase, override_settings
 from rest_framework import serializers as drf_serializers
 from rest_framework.test import APITestCase
 
 from apps.core.mixins import SharedWithMixin, parse_http_date
 from apps.core.permissions import IsOwner
+from apps.core.transactions import transaction_state
 from apps.idempotency.models import IdempotencyRecord
 from apps.notifications.models import PushSubscription
 from apps.routines.models import (
@@ -677,6 +679,275 @@ class SeedEndpointTest(APITestCase):
             )
 
 
+# ── Celery queues and queue_depths command ─────────────────────────────────
+
+
+class CeleryRoutingTest(TestCase):
+    def route(self, task_name):
+        from nudge.celery import app
+
+        options = app.amqp.router.route({}, task_name)
+        return options["queue"].name, options.get("priority")
+
+    def test_push_work_is_routed_to_push_queue_first(self):
+        self.assertEqual(self.route("apps.notifications.tasks.drain_push_outbox"), ("push", 0))
+        self.assertEqual(self.route("apps.notifications.tasks.notify_routine"), ("push", 0))
+        self.assertEqual(self.route("apps.notifications.tasks.check_notifications_shard"), ("push", 3))
+
+    def test_email_and_maintenance_have_their_own_queues(self):
+        self.assertEqual(self.route("apps.users.tasks.send_login_email")[0], "email")
+        self.assertEqual(self.route("apps.users.tasks.cleanup_login_codes")[0], "maintenance")
+        self.assertEqual(self.route("apps.idempotency.tasks.cleanup_idempotency_records")[0], "maintenance")
+
+    def test_every_routed_queue_is_consumed(self):
+        from django.conf import settings
+
+        from nudge.celery import QUEUES
+
+        self.assertLessEqual({route["queue"] for route in settings.CELERY_TASK_ROUTES.values()}, set(QUEUES))
+        self.assertIn(settings.CELERY_TASK_DEFAULT_QUEUE, QUEUES)
+
+    def test_every_scheduled_task_is_routed(self):
+        from django.conf import settings
+
+        for entry in settings.CELERY_BEAT_SCHEDULE.values():
+            self.assertIn(entry["task"], settings.CELERY_TASK_ROUTES)
+
+    def test_results_are_not_stored(self):
+        from apps.notifications.tasks import drain_push_outbox
+        from apps.users.tasks import send_login_email
+
+        self.assertTrue(drain_push_outbox.ignore_result)
+        self.assertTrue(send_login_email.ignore_result)
+
+
+class QueueDepthsCommandTest(TestCase):
+    def setUp(self):
+        from nudge.celery import app
+
+        # Redis keeps one list per priority step: "push", "push:3", ...
+        lengths = {"push": 2, "push:3": 5, "email": 1}
+        client = mock.Mock()
+        client.llen.side_effect = lambda key: lengths.get(key, 0)
+        conn = mock.MagicMock()
+        conn.__enter__.return_value.default_channel.client = client
+        patcher = mock.patch.object(app, "connection_for_read", return_value=conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sums_priority_steps_per_queue(self):
+        from nudge.celery import queue_depths
+
+        self.assertEqual(queue_depths(), {"push": 7, "email": 1, "maintenance": 0, "default": 0})
+
+    def test_json_output(self):
+        import json
+        from io import StringIO
+
+        out = StringIO()
+        call_command("queue_depths", "--json", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["push"], 7)
+
+
+# ── Beat leader election ────────────────────────────────────────────────────
+
+
+class _FakeLeaseRedis:
+    """Just enough of redis-py for the beat lease scripts (no expiry clock)."""
+
+    def __init__(self):
+        self.store = {}
+
+    def eval(self, script, numkeys, key, token, *args):
+        from nudge import beat
+
+        holder = self.store.get(key)
+        if script == beat._ACQUIRE:
+            if holder in (None, token):
+                self.store[key] = token
+                return 1
+            return 0
+        if holder == token:
+            del self.store[key]
+            return 1
+        return 0
+
+
+class LeaderElectedSchedulerTest(TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.redis = _FakeLeaseRedis()
+
+    def scheduler(self, name):
+        from nudge.beat import LeaderElectedScheduler
+        from nudge.celery import app
+
+        scheduler = LeaderElectedScheduler(app, schedule_filename=os.path.join(self.tmp.name, name))
+        scheduler._redis = self.redis
+        scheduler.producer = mock.Mock()  # no broker connection in tests
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def test_scheduler_is_configured(self):
+        from django.conf import settings
+
+        self.assertEqual(settings.CELERY_BEAT_SCHEDULER, "nudge.beat:LeaderElectedScheduler")
+
+    @staticmethod
+    def make_all_due(scheduler):
+        from datetime import timedelta
+
+        for entry in scheduler.schedule.values():
+            entry.last_run_at = scheduler.app.now() - timedelta(days=2)
+        scheduler._heap = None
+
+    def test_only_the_leader_sends(self):
+        first, second = self.scheduler("a"), self.scheduler("b")
+        self.make_all_due(first)
+        self.make_all_due(second)
+        with (
+            mock.patch.object(first, "apply_async") as first_send,
+            mock.patch.object(second, "apply_async") as second_send,
+        ):
+            for _ in range(10):
+                first.tick()
+                second.tick()
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+        self.assertTrue(first_send.called)
+        second_send.assert_not_called()
+
+    def test_follower_takes_over_when_lease_is_gone(self):
+        first, second = self.scheduler("a"), self.scheduler("b")
+        first.tick()
+        second.tick()
+        self.redis.store.clear()  # the leader died and its lease expired
+        second.tick()
+        self.assertTrue(second.is_leader)
+        first.tick()
+        self.assertFalse(first.is_leader)
+
+    def test_close_releases_lease(self):
+        first, second = self.scheduler("a"), self.scheduler("b")
+        first.tick()
+        first.close()
+        second.tick()
+        self.assertTrue(second.is_leader)
+
+    def test_tick_wakes_up_before_lease_expires(self):
+        scheduler = self.scheduler("a")
+        with mock.patch.object(scheduler, "apply_async"):
+            delays = [scheduler.tick() for _ in range(10)]
+        self.assertLessEqual(max(delays), scheduler.lease_seconds / 3)
+
+    def test_redis_failure_steps_down(self):
+        from redis import RedisError
+
+        scheduler = self.scheduler("a")
+        scheduler.tick()
+        with mock.patch.object(self.redis, "eval", side_effect=RedisError), self.assertLogs("nudge.beat", "ERROR"):
+            scheduler.tick()
+        self.assertFalse(scheduler.is_leader)
+
+
+class EmbeddedSchedulerTest(TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.lock_path = os.path.join(self.tmp.name, "scheduler.lock")
+
+    def scheduler(self, schedule=None):
+        from nudge.embedded import EmbeddedScheduler
+
+        scheduler = EmbeddedScheduler(schedule or {}, self.lock_path)
+        self.addCleanup(scheduler.release)
+        return scheduler
+
+    def test_enqueue_goes_through_celery_by_default(self):
+        from nudge import embedded
+
+        task = mock.Mock()
+        embedded.enqueue(task, 1, "x", countdown=300)
+        task.apply_async.assert_called_once_with((1, "x"), countdown=300)
+
+    @override_settings(EMBEDDED_SCHEDULER=True)
+    def test_enqueue_runs_job_on_worker_thread(self):
+        import threading
+
+        from nudge import embedded
+
+        ran = threading.Event()
+        task = mock.Mock(side_effect=lambda *args: ran.set())
+        embedded.enqueue(task, 1, "x")
+        self.assertTrue(ran.wait(5))
+        task.assert_called_once_with(1, "x")
+        task.apply_async.assert_not_called()
+
+    @override_settings(EMBEDDED_SCHEDULER=True)
+    def test_full_queue_drops_job(self):
+        import queue
+
+        from nudge import embedded
+
+        jobs = queue.Queue(maxsize=1)
+        jobs.put_nowait((mock.Mock(), ()))
+        with (
+            mock.patch.object(embedded, "_worker", mock.Mock()),
+            mock.patch.object(embedded, "_work_queue", jobs),
+            self.assertLogs("nudge.embedded", "ERROR"),
+        ):
+            embedded.enqueue(mock.Mock(name="send_login_email"), 1)
+        self.assertEqual(jobs.qsize(), 1)
+
+    def test_only_one_process_holds_the_lock(self):
+        first, second = self.scheduler(), self.scheduler()
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+
+    def test_tick_runs_entries_at_start_then_at_their_interval(self):
+        tasks = {"fast": mock.Mock(), "slow": mock.Mock()}
+        scheduler = self.scheduler(
+            {
+                "fast": {"task": "fast", "schedule": 60},
+                "slow": {"task": "slow", "schedule": 300},
+            }
+        )
+        clock = mock.Mock(return_value=1000.0)
+        with (
+            mock.patch("nudge.embedded.import_string", side_effect=tasks.get),
+            mock.patch("nudge.embedded.time.monotonic", clock),
+        ):
+            self.assertEqual(scheduler.tick(), 60)
+            clock.return_value = 1060.0
+            self.assertEqual(scheduler.tick(), 60)
+        self.assertEqual(tasks["fast"].call_count, 2)
+        self.assertEqual(tasks["slow"].call_count, 1)
+
+    def test_failing_task_does_not_stop_the_schedule(self):
+        tasks = {"broken": mock.Mock(side_effect=RuntimeError), "ok": mock.Mock()}
+        scheduler = self.scheduler({name: {"task": name, "schedule": 60} for name in tasks})
+        with (
+            mock.patch("nudge.embedded.import_string", side_effect=tasks.get),
+            self.assertLogs("nudge.embedded", "ERROR"),
+        ):
+            scheduler.tick()
+        tasks["ok"].assert_called_once_with()
+
+    def test_schedule_covers_every_periodic_task(self):
+        from django.conf import settings
+        from django.utils.module_loading import import_string
+
+        for entry in settings.CELERY_BEAT_SCHEDULE.values():
+            self.assertEqual(import_string(entry["task"]).name, entry["task"])
+
+
 # ── IsOwner permission ──────────────────────────────────────────────────────
 
 
@@ -793,3 +1064,27 @@ class SharedWithMixinTest(TestCase):
         obj = _MockObj([])
         details = _MockSerializer().get_shared_with_details(obj)
         self.assertEqual(details, [])
+
+
+class TransactionStateTest(TestCase):
+    def test_state_lives_until_commit_and_is_flushed_once(self):
+        flushed = []
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            state = transaction_state("test", list, flush=flushed.append)
+            state.append(1)
+            transaction_state("test", list, flush=flushed.append).append(2)
+        self.assertEqual(flushed, [[1, 2]])
+        self.assertEqual(transaction_state("test", list), [])
+
+    def test_rolled_back_block_drops_its_state(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            transaction_state("test", list).append(1)
+            raise RuntimeError
+        self.assertEqual(transaction_state("test", list), [])
+
+    def test_lookup_without_factory_makes_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(transaction_state("test"))
+        self.assertEqual(callbacks, [])
+        transaction_state("test", list).append(1)
+        self.assertEqual(transaction_state("test"), [1])
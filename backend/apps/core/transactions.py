@@ -0,0 +1,43 @@
+"""State scoped to the running database transaction.
+
+Receivers fire once per saved row, but much of what they do only needs
+doing once per transaction: resolving who can see an object, queuing
+after-commit work. `transaction_state` gives them somewhere to keep that
+between calls.
+"""
+
+from django.db import transaction
+
+
+def transaction_state(key, factory=None, flush=None):
+    """The `key` state of the running transaction, made by `factory()` on first use.
+
+    `flush(state)`, when given, runs once after the transaction commits.
+    The state is dropped when the transaction ends — on commit, or on a
+    rollback of the transaction or of the savepoint it was made in — and
+    the next call starts afresh. Outside a transaction every statement
+    commits on its own, so there is nothing to keep: returns None, and the
+    caller acts right away. Without `factory` the call only looks, and
+    returns None as well when the state has not been made yet.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    states = connection.__dict__.setdefault("transaction_states", {})
+    entry = states.get(key)
+    # A rollback discards the on-commit callbacks registered under it, ours
+    # included: its absence tells a state left over from a rolled-back block.
+    if entry is None or not any(func is entry[1] for _, func, _ in connection.run_on_commit):
+        if factory is None:
+            return None
+        state = factory()
+
+        def committed():
+            if states.get(key) is entry:
+                del states[key]
+            if flush is not None:
+                flush(state)
+
+        entry = states[key] = (state, committed)
+        transaction.on_commit(committed)
+    return entry[0]
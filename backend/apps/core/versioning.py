@@ -0,0 +1,138 @@
+"""Per-user data version and the response cache keyed on it.
+
+Each user has an opaque version token in the shared cache that changes
+whenever anything that user can read through the API changes: their own
+routines, entries and stock, and everything shared with them. Write paths
+call `bump_data_version` for every affected member (the receivers at the
+bottom of `apps.routines.models`), so a cached payload never has to be
+found and deleted — it is simply never looked up again.
+
+A bump happens twice: right away, and again once the transaction commits.
+The second one discards anything a concurrent reader cached from the
+pre-commit state under the first new token.
+
+The same inputs give each payload a strong ETag (`data_etag`) without
+building it, for conditional GETs.
+"""
+
+import hashlib
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+
+from .transactions import transaction_state
+
+# Lifetime of a version token. When one expires the user just gets a new
+# token, and their cached payloads miss once.
+VERSION_SECONDS = 7 * 24 * 60 * 60
+
+# Query parameters that reshape a payload per request. Such requests bypass
+# the cache: a cached hit must be able to recompute its time fields, which
+# `?omit=` could have dropped the inputs of.
+UNCACHED_PARAMS = ("fields", "omit", "expand")
+
+
+def _version_key(user_id):
+    return f"data-version:{user_id}"
+
+
+def data_version(user_id):
+    """The user's current version token, created on first use."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=VERSION_SECONDS):
+            version = cache.get(key) or version
+    return version
+
+
+def bump_data_version(user_ids):
+    """Give every user in `user_ids` a new version token, now and on commit.
+
+    The on-commit bump is queued once per transaction, for every user any
+    of its writes bumped.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    _bump(user_ids)
+    pending = transaction_state("data-version", set, flush=_bump)
+    if pending is not None:
+        pending |= user_ids
+
+
+def _bump(user_ids):
+    cache.set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=VERSION_SECONDS)
+
+
+def cached_payload(request, scope, build, refresh=None):
+    """Return `build()`'s payload for this request, from the cache when possible.
+
+    The key covers the user's data version, the full request URI (filters,
+    pagination) and today's date (date-based severities). A hit is passed
+    through `refresh` so time-dependent fields are recomputed. Disabled when
+    ``API_CACHE_SECONDS`` is 0.
+    """
+    seconds = settings.API_CACHE_SECONDS
+    if not seconds or any(param in request.query_params for param in UNCACHED_PARAMS):
+        return build()
+    user_id = request.user.pk
+    uri = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()[:32]
+    key = f"api-cache:{scope}:{user_id}:{data_version(user_id)}:{date.today().isoformat()}:{uri}"
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        cache.set(key, payload, timeout=seconds)
+    elif refresh is not None:
+        refresh(payload)
+    return payload
+
+
+def versioned(user_id, name, compute):
+    """`compute()`, cached until the user's data version changes.
+
+    For values derived from stored data only, such as the inputs of an
+    ETag's time-dependent state. Not cached when ``API_CACHE_SECONDS`` is 0.
+    """
+    seconds = settings.API_CACHE_SECONDS
+    if not seconds:
+        return compute()
+    key = f"api-state:{name}:{user_id}:{data_version(user_id)}"
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=seconds)
+    return value
+
+
+def data_etag(request, scope, state=()):
+    """Strong ETag of this request's `scope` payload, computed without building it.
+
+    Covers what the cache key covers, plus the response format and `state`:
+    whatever the payload shows that changes with the clock rather than with
+    a write (due flags, sliding consumption windows).
+    """
+    user_id = request.user.pk
+    parts = [
+        scope,
+        str(user_id),
+        data_version(user_id),
+        date.today().isoformat(),
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        *map(repr, state),
+    ]
+    return '"%s"' % hashlib.sha256("\n".join(parts).encode()).hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    """True when the request's ``If-None-Match`` names `etag` (or is ``*``)."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = {tag.removeprefix("W/") for tag in parse_etags(header)}
+    return "*" in tags or etag in tags
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import NotificationState, PushSubscription
+from .models import NotificationState, PushOutbox, PushSubscription
 
 
 @admin.register(NotificationState)
@@ -17,3 +17,11 @@ class PushSubscriptionAdmin(admin.ModelAdmin):
     list_filter = ["user"]
     search_fields = ["user__username"]
     readonly_fields = ["created_at", "last_used"]
+
+
+@admin.register(PushOutbox)
+class PushOutboxAdmin(admin.ModelAdmin):
+    list_display = ["subscription", "type", "status", "attempts", "available_at", "created_at"]
+    list_filter = ["status", "type"]
+    search_fields = ["subscription__user__username"]
+    readonly_fields = ["created_at", "last_error"]
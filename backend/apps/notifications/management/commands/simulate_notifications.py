@@ -0,0 +1,342 @@
+"""Benchmark the notification pass against generated data and a local push sink.
+
+Generates `--users` users with routines, backdated entries and push
+subscriptions, all pointing at a bundled HTTP push sink on 127.0.0.1 that
+accepts every push and records when it arrived. It then steps a simulated
+clock through `--hours` in `--beat-seconds` increments and, at every step,
+runs what the beat would run: `check_notifications` (its shards and outbox
+drains inline, as Celery runs eagerly here) and `drain_push_outbox`.
+
+Per beat it reports wall time, SQL queries, pushes the sink received, peak
+Python memory (tracemalloc) and lock wait (time spent in `SELECT ... FOR
+UPDATE` queries; always zero on SQLite, which has no row locks).
+
+Only the generated users are touched. The pass looks at users with a push
+subscription, so the command refuses to run while any other user has one;
+and every delivery is checked against the sink, so a subscription that
+appears mid-run is never sent to. Same gate as `seed` besides: refuses to
+run unless DEBUG is True OR `E2E_SEED_ALLOWED=true`. Generated users are
+deleted at the end unless `--keep`.
+"""
+
+import base64
+import json
+import logging
+import os
+import random
+import secrets
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+from datetime import timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.notifications import push
+from apps.notifications.models import PushSubscription
+from apps.notifications.tasks import check_notifications, drain_push_outbox
+from apps.routines.models import Routine, RoutineEntry
+from apps.users.models import daily_utc_minute
+from nudge.celery import app as celery_app
+
+User = get_user_model()
+
+USERNAME_PREFIX = "loadsim-"
+TIMEZONES = ("UTC", "Europe/Madrid", "America/New_York", "Asia/Tokyo", "Australia/Sydney")
+INTERVAL_HOURS = (8, 12, 24, 48, 168)
+# Per-push and per-task INFO lines, silenced unless --verbosity 2.
+QUIET_LOGGERS = ("apps.notifications", "celery.app.trace")
+
+
+class PushSink:
+    """A local HTTP server standing in for a push service.
+
+    Answers every POST with 201 after `latency` seconds and records the
+    arrival time of each request (``time.perf_counter()``).
+    """
+
+    def __init__(self, latency=0.0):
+        self.arrivals = []
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if latency:
+                    time.sleep(latency)
+                with sink._lock:
+                    sink.arrivals.append(time.perf_counter())
+                self.send_response(201)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="push-sink", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def received(self):
+        with self._lock:
+            return len(self.arrivals)
+
+
+class Command(BaseCommand):
+    help = "Runs the notification pass over a simulated day against generated users and a local push sink."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Users to generate (default 100).")
+        parser.add_argument("--routines", type=int, default=5, help="Routines per user (default 5).")
+        parser.add_argument("--devices", type=int, default=1, help="Push subscriptions per user (default 1).")
+        parser.add_argument("--hours", type=float, default=24, help="Simulated hours (default 24).")
+        parser.add_argument("--beat-seconds", type=int, default=300, help="Simulated time per beat (default 300).")
+        parser.add_argument(
+            "--start",
+            help="Simulated start, ISO 8601 in UTC (default: the next midnight UTC).",
+        )
+        parser.add_argument("--sink-latency-ms", type=int, default=0, help="Delay of every push-sink response.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated users afterwards.")
+        parser.add_argument("--json", action="store_true", help="Print one JSON object (for regression scripts).")
+
+    def handle(self, *args, **options):
+        self._guard()
+        start = self._start(options["start"])
+        beats = int(options["hours"] * 3600 // options["beat_seconds"])
+        if options["users"] < 1 or beats < 1:
+            raise CommandError("Nothing to simulate: need at least one user and one beat.")
+
+        with ExitStack() as stack:
+            sink = stack.enter_context(PushSink(latency=options["sink_latency_ms"] / 1000))
+            if not settings.VAPID_PRIVATE_KEY or not settings.VAPID_PUBLIC_KEY:
+                stack.enter_context(override_settings(**_vapid_keys()))
+            stack.enter_context(mock.patch.object(push, "_deliver", new=_sink_only(push._deliver, sink.url)))
+            self._delete_generated()
+            if not options["keep"]:
+                stack.callback(self._delete_generated)
+            self._generate(options, start, sink.url)
+            rows = self._simulate(start, beats, options["beat_seconds"], sink, quiet=options["verbosity"] < 2)
+
+        summary = _summarise(rows)
+        if options["json"]:
+            self.stdout.write(json.dumps({"beats": rows, "summary": summary}))
+            return
+        self.stdout.write(
+            f"{'beat (UTC)':<17} {'wall ms':>9} {'queries':>8} {'pushes':>7} {'peak KiB':>9} {'lock ms':>8}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['at'][:16]:<17} {row['wall_ms']:>9.1f} {row['queries']:>8} {row['pushes']:>7}"
+                f" {row['peak_kib']:>9.0f} {row['lock_wait_ms']:>8.1f}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{summary['beats']} beats, {summary['pushes']} pushes. Wall ms p50 {summary['wall_ms_p50']:.1f}, "
+                f"p95 {summary['wall_ms_p95']:.1f}, max {summary['wall_ms_max']:.1f}; "
+                f"max {summary['queries_max']} queries, peak {summary['peak_kib_max']:.0f} KiB, "
+                f"lock wait {summary['lock_wait_ms']:.1f} ms."
+            )
+        )
+
+    def _guard(self):
+        if not settings.DEBUG and os.environ.get("E2E_SEED_ALLOWED", "").lower() != "true":
+            raise CommandError(
+                "simulate_notifications refused to run: DEBUG is False and E2E_SEED_ALLOWED is not 'true'."
+            )
+        if PushSubscription.objects.exclude(user__username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(
+                "simulate_notifications refused to run: users outside the simulation have push subscriptions, "
+                "and the pass would notify them."
+            )
+
+    @staticmethod
+    def _start(value):
+        if value is None:
+            today = timezone.now().astimezone(dt_timezone.utc).date()
+            return datetime.combine(today + timedelta(days=1), dt_time.min, tzinfo=dt_timezone.utc)
+        try:
+            start = datetime.fromisoformat(value)
+        except ValueError as exc:
+            raise CommandError(f"--start: {exc}") from exc
+        return start if start.tzinfo else start.replace(tzinfo=dt_timezone.utc)
+
+    # ── Data ────────────────────────────────────────────────────────────────
+
+    def _delete_generated(self):
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def _generate(self, options, start, sink_url):
+        """Bulk-insert the fixture; no signals fire, so nothing is scheduled."""
+        rng = random.Random(options["seed"])
+        users = []
+        for i in range(options["users"]):
+            tz = TIMEZONES[i % len(TIMEZONES)]
+            daily = dt_time(rng.randrange(6, 10), rng.choice((0, 15, 30, 45)))
+            users.append(
+                User(
+                    username=f"{USERNAME_PREFIX}{i}",
+                    email=f"{USERNAME_PREFIX}{i}@example.invalid",
+                    password="!",
+                    timezone=tz,
+                    daily_notification_time=daily,
+                    daily_notification_utc_minute=daily_utc_minute(tz, daily, now=start),
+                )
+            )
+        users = User.objects.bulk_create(users)
+
+        routines, logged_at = [], []
+        for user in users:
+            for j in range(options["routines"]):
+                interval = rng.choice(INTERVAL_HOURS)
+                # Spread the due times over the simulated day and a little before.
+                due = start + timedelta(minutes=rng.randrange(-6 * 60, 24 * 60))
+                logged_at.append(due - timedelta(hours=interval))
+                routines.append(Routine(user=user, name=f"Routine {j}", interval_hours=interval, scheduled_due_at=due))
+        routines = Routine.objects.bulk_create(routines)
+        RoutineEntry.objects.bulk_create(
+            RoutineEntry(routine=routine, created_at=at, client_created_at=at)
+            for routine, at in zip(routines, logged_at, strict=True)
+        )
+
+        PushSubscription.objects.bulk_create(
+            PushSubscription(user=user, endpoint=f"{sink_url}/push/{user.pk}/{d}", **_subscription_keys())
+            for user in users
+            for d in range(options["devices"])
+        )
+
+    # ── Simulation ──────────────────────────────────────────────────────────
+
+    def _simulate(self, start, beats, beat_seconds, sink, *, quiet):
+        clock = {"now": start}
+        stats = {"queries": 0, "lock_wait": 0.0}
+
+        def measured(execute, sql, params, many, context):
+            # Counted here rather than with CaptureQueriesContext, whose log is
+            # capped and would itself show up in the memory peak.
+            stats["queries"] += 1
+            if "FOR UPDATE" not in sql:
+                return execute(sql, params, many, context)
+            began = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats["lock_wait"] += time.perf_counter() - began
+
+        rows = []
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        loggers = [logging.getLogger(name) for name in QUIET_LOGGERS] if quiet else []
+        levels = [logger.level for logger in loggers]
+        for logger in loggers:
+            logger.setLevel(logging.WARNING)
+        tracemalloc.start()
+        try:
+            with (
+                # `new` rather than a Mock, which would keep every call in memory.
+                mock.patch("django.utils.timezone.now", new=lambda: clock["now"]),
+                connection.execute_wrapper(measured),
+            ):
+                for beat in range(beats):
+                    clock["now"] = start + timedelta(seconds=beat * beat_seconds)
+                    received = sink.received
+                    stats.update(queries=0, lock_wait=0.0)
+                    reset_queries()  # DEBUG keeps a log of every query
+                    tracemalloc.reset_peak()
+                    began = time.perf_counter()
+                    check_notifications()
+                    drain_push_outbox()
+                    wall = time.perf_counter() - began
+                    rows.append(
+                        {
+                            "at": clock["now"].isoformat(),
+                            "wall_ms": round(wall * 1000, 1),
+                            "queries": stats["queries"],
+                            "pushes": sink.received - received,
+                            "peak_kib": round(tracemalloc.get_traced_memory()[1] / 1024, 1),
+                            "lock_wait_ms": round(stats["lock_wait"] * 1000, 1),
+                        }
+                    )
+        finally:
+            tracemalloc.stop()
+            for logger, level in zip(loggers, levels, strict=True):
+                logger.setLevel(level)
+            celery_app.conf.task_always_eager = eager
+        return rows
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _subscription_keys():
+    """A browser-shaped key pair, so pywebpush can encrypt for the sink."""
+    public = ec.generate_private_key(ec.SECP256R1()).public_key()
+    point = public.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return {"p256dh": _b64(point), "auth": _b64(secrets.token_bytes(16))}
+
+
+def _sink_only(deliver, sink_url):
+    """Wrap `deliver` so nothing but the sink is ever contacted."""
+
+    def deliver_to_sink(delivery):
+        if not delivery.subscription.endpoint.startswith(f"{sink_url}/"):
+            return push.PushResult(delivery, error="outside the simulation: not sent", attempted=False)
+        return deliver(delivery)
+
+    return deliver_to_sink
+
+
+def _vapid_keys():
+    """A throwaway VAPID pair for installs that have none configured."""
+    private = ec.generate_private_key(ec.SECP256R1())
+    public = private.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    return {
+        "VAPID_PRIVATE_KEY": _b64(private.private_numbers().private_value.to_bytes(32, "big")),
+        "VAPID_PUBLIC_KEY": _b64(public),
+    }
+
+
+def _summarise(rows):
+    walls = sorted(row["wall_ms"] for row in rows)
+    return {
+        "beats": len(rows),
+        "pushes": sum(row["pushes"] for row in rows),
+        "wall_ms_p50": statistics.median(walls),
+        "wall_ms_p95": walls[min(len(walls) - 1, int(len(walls) * 0.95))],
+        "wall_ms_max": walls[-1],
+        "queries_max": max(row["queries"] for row in rows),
+        "peak_kib_max": max(row["peak_kib"] for row in rows),
+        "lock_wait_ms": round(sum(row["lock_wait_ms"] for row in rows), 1),
+    }
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notifications", "0002_push_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pushoutbox",
+            name="topic",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notifications", "0003_push_outbox_topic"),
+        ("routines", "0018_routine_scheduled_due_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationstate",
+            name="next_reminder_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="notificationstate",
+            index=models.Index(fields=["next_reminder_at"], name="notif_next_reminder_idx"),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.routines.models import schedule_changed
 
 
 class NotificationState(models.Model):
@@ -17,6 +22,14 @@ class NotificationState(models.Model):
     last_reminder = models.DateTimeField(null=True, blank=True)
     # Date (not datetime) — only one daily heads-up per calendar day
     last_daily_notification = models.DateField(null=True, blank=True)
+    # Earliest moment the next reminder may fire: the routine's reminder
+    # interval after the last push, pushed out to when the first recipient
+    # leaves quiet hours. Until then the worker skips the routine without
+    # evaluating it. NULL means "evaluate on the next beat".
+    next_reminder_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["next_reminder_at"], name="notif_next_reminder_idx")]
 
     def __str__(self):
         return f"NotificationState for {self.routine.name}"
@@ -41,3 +54,81 @@ class PushSubscription(models.Model):
 
     def __str__(self):
         return f"{self.user.username} — {self.endpoint[:60]}..."
+
+
+class PushOutbox(models.Model):
+    """
+    A push waiting to be delivered to one subscription.
+
+    The notification worker writes rows inside the transaction that holds its
+    NotificationState locks; `drain_push_outbox` delivers them after commit,
+    so no lock is held across a push-service round trip. Delivered rows are
+    deleted. Failed rows are retried with exponential backoff and, once they
+    run out of attempts, kept as STATUS_DEAD for inspection.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_DEAD = "dead"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_DEAD, "Dead"),
+    ]
+
+    subscription = models.ForeignKey(
+        PushSubscription,
+        on_delete=models.CASCADE,
+        related_name="outbox",
+    )
+    type = models.CharField(max_length=30)
+    # Web Push `Topic` header; blank when the push has none.
+    topic = models.CharField(max_length=32, blank=True)
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest time the drain may pick the row up: creation, next retry, or
+    # the end of a claim while a drain is delivering it.
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"], name="push_outbox_ready_idx")]
+
+    def __str__(self):
+        return f"{self.type} → subscription {self.subscription_id} ({self.status})"
+
+
+@receiver(schedule_changed)
+def schedule_routine_notifications(sender, routine, **kwargs):
+    """Re-plan the routine's timed notification once the write that moved its
+    due time has committed — the task must not read the old schedule."""
+    from .tasks import schedule_routine  # tasks imports this module
+
+    routine_id = routine.pk
+    transaction.on_commit(lambda: schedule_routine(routine_id))
+
+
+@receiver(post_save, sender="routines.Routine")
+def reset_next_reminder_on_routine_save(sender, instance, created, raw, **kwargs):
+    """The reminder interval or quiet-hours opt-out may have changed: let the
+    next beat re-derive when the routine's next reminder is allowed."""
+    if created or raw:
+        return
+    NotificationState.objects.filter(routine=instance, next_reminder_at__isnull=False).update(next_reminder_at=None)
+
+
+_QUIET_HOURS_FIELDS = {"timezone", "quiet_hours_enabled", "quiet_hours_start", "quiet_hours_end"}
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reset_next_reminders_on_quiet_hours_change(sender, instance, created, raw, update_fields, **kwargs):
+    """A user's quiet hours decide when their routines' reminders resume;
+    drop the precomputed instants when those settings may have changed."""
+    if created or raw:
+        return
+    if update_fields is not None and not _QUIET_HOURS_FIELDS & set(update_fields):
+        return
+    NotificationState.objects.filter(
+        models.Q(routine__user=instance) | models.Q(routine__shared_with=instance),
+        next_reminder_at__isnull=False,
+    ).update(next_reminder_at=None)
@@ -1,12 +1,25 @@
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from py_vapid import Vapid02
 from pywebpush import WebPushException, webpush
+from requests.adapters import HTTPAdapter
 
-from .models import PushSubscription
+from .models import PushOutbox, PushSubscription
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +31,23 @@ TYPE_TEST = "test"
 TYPE_CONTACT_ADDED = "contact_added"
 TYPE_ROUTINE_SHARED = "routine_shared"
 TYPE_STOCK_SHARED = "stock_shared"
+TYPE_DIGEST = "digest"
+
+# How long a push service keeps an undelivered message (the `TTL` header, in
+# seconds). A reminder is stale once the next one is due, a heads-up once the
+# day is over; share and contact notices stay interesting for longer.
+PUSH_TTL_SECONDS = {
+    TYPE_DAILY: 12 * 60 * 60,
+    TYPE_DUE: 6 * 60 * 60,
+    TYPE_REMINDER: 60 * 60,
+    TYPE_DIGEST: 60 * 60,
+    TYPE_TEST: 10 * 60,
+}
+DEFAULT_PUSH_TTL_SECONDS = 24 * 60 * 60
+
+# Types merged into a single TYPE_DIGEST push when several are waiting for
+# the same device (see `outbox_deliveries`).
+COALESCED_TYPES = (TYPE_DUE, TYPE_REMINDER)
 
 _MSGS = {
     "en": {
@@ -39,6 +69,7 @@ _MSGS = {
         "routine_shared_body": "{owner} shared this routine with you",
         "stock_shared_title": "{name}",
         "stock_shared_body": "{owner} shared this item with you",
+        "digest_title": "{n} tasks need attention",
     },
     "es": {
         "daily_one": "1 tarea hoy",
@@ -59,6 +90,7 @@ _MSGS = {
         "routine_shared_body": "{owner} ha compartido esta rutina contigo",
         "stock_shared_title": "{name}",
         "stock_shared_body": "{owner} ha compartido este artículo contigo",
+        "digest_title": "{n} tareas pendientes",
     },
     "gl": {
         "daily_one": "1 tarefa hoxe",
@@ -79,6 +111,7 @@ _MSGS = {
         "routine_shared_body": "{owner} compartiu esta rutina contigo",
         "stock_shared_title": "{name}",
         "stock_shared_body": "{owner} compartiu este artigo contigo",
+        "digest_title": "{n} tarefas pendentes",
     },
 }
 
@@ -90,7 +123,17 @@ def _m(user, key, **kwargs):
     return text.format(**kwargs) if kwargs else text
 
 
-def send_push_notification(user, *, title: str, body: str, type: str, data: dict = None, actions: list = None):
+def send_push_notification(
+    user,
+    *,
+    title: str,
+    body: str,
+    type: str,
+    data: dict = None,
+    actions: list = None,
+    topic: str = "",
+    subscriptions: list = None,
+):
     """
     Send a Web Push notification to all registered devices for a user.
 
@@ -103,13 +146,19 @@ def send_push_notification(user, *, title: str, body: str, type: str, data: dict
         body:  Notification body text.
         type:  One of TYPE_DAILY, TYPE_DUE, TYPE_REMINDER — used by the SW.
         data:  Optional extra payload passed to the service worker.
+        topic: Optional Web Push `Topic`; an undelivered message is replaced
+               by a newer one with the same topic. See `_topic`.
+        subscriptions: The user's PushSubscriptions, when already loaded.
+               Defaults to the prefetched `user.push_subscriptions`, or one
+               query.
     """
     if not settings.VAPID_PRIVATE_KEY or not settings.VAPID_PUBLIC_KEY:
         logger.warning("VAPID keys not configured — push skipped (user=%s, type=%s).", user.username, type)
         return
 
-    subscriptions = PushSubscription.objects.filter(user=user)
-    if not subscriptions.exists():
+    if subscriptions is None:
+        subscriptions = _subscriptions_for(user)
+    if not subscriptions:
         logger.debug("No push subscriptions for user %s — skipped.", user.username)
         return
 
@@ -123,59 +172,477 @@ def send_push_notification(user, *, title: str, body: str, type: str, data: dict
         }
     )
 
-    to_delete = []
+    outbox = getattr(_outbox, "rows", None)
+    if outbox is not None:
+        available_at = timezone.now()
+        if type in COALESCED_TYPES and user.notification_digest:
+            available_at = _next_digest_at(available_at)
+        outbox.extend(
+            PushOutbox(subscription=subscription, type=type, topic=topic, payload=payload, available_at=available_at)
+            for subscription in subscriptions
+        )
+        return
 
-    for subscription in subscriptions:
-        try:
-            webpush(
-                subscription_info={
-                    "endpoint": subscription.endpoint,
-                    "keys": {
-                        "p256dh": subscription.p256dh,
-                        "auth": subscription.auth,
-                    },
-                },
-                data=payload,
-                vapid_private_key=settings.VAPID_PRIVATE_KEY,
-                vapid_claims={
-                    "sub": f"mailto:{settings.VAPID_CLAIMS_EMAIL}",
+    deliveries = [
+        PushDelivery(subscription=subscription, user=user, payload=payload, type=type, topic=topic)
+        for subscription in subscriptions
+    ]
+    failed = apply_push_results(dispatch_pushes(deliveries))
+    # A throttled push service is retried from the outbox once it allows it.
+    PushOutbox.objects.bulk_create(
+        PushOutbox(
+            subscription=result.delivery.subscription,
+            type=type,
+            topic=topic,
+            payload=payload,
+            available_at=result.retry_at,
+            last_error=result.error,
+        )
+        for result in failed
+        if result.throttled
+    )
+
+
+def _subscriptions_for(user):
+    prefetched = getattr(user, "_prefetched_objects_cache", {}).get("push_subscriptions")
+    if prefetched is not None:
+        return list(prefetched)
+    return list(PushSubscription.objects.filter(user=user))
+
+
+# ── Concurrent dispatch ──────────────────────────────────────────────────────
+#
+# Push services are slow compared with everything else in a beat, so sends run
+# on a bounded thread pool (PUSH_MAX_CONCURRENCY) over one keep-alive session
+# per push-service origin. Workers only touch the network; every database
+# write (last_used, 404/410 cleanup) happens afterwards on the calling thread.
+
+
+@dataclass(frozen=True)
+class PushDelivery:
+    """One payload addressed to one subscription."""
+
+    subscription: PushSubscription
+    user: object
+    payload: str
+    type: str
+    topic: str = ""
+    outbox_ids: tuple = ()
+
+
+@dataclass(frozen=True)
+class PushResult:
+    """Outcome of a single delivery; `status_code` is None on network errors."""
+
+    delivery: PushDelivery
+    status_code: int | None = None
+    error: str = ""
+    # Set when the push service asked us to back off (429 + Retry-After) or
+    # the origin was already in backoff: retry no earlier than this.
+    retry_at: datetime | None = None
+    # False when the delivery was deferred without contacting the origin.
+    attempted: bool = True
+
+    @property
+    def delivered(self):
+        return not self.error
+
+    @property
+    def gone(self):
+        return self.status_code in (404, 410)
+
+    @property
+    def throttled(self):
+        return self.retry_at is not None
+
+
+# Per-origin backoff, kept in the shared cache (Redis) so every worker process
+# backs off together. A 429 blocks the origin for its Retry-After (or
+# BACKOFF_BASE_SECONDS); BREAKER_THRESHOLD 5xx/network failures with no
+# success in between open the breaker for an exponentially growing period.
+# Every failure in a batch counts, and a success restarts the count. Deliveries to a blocked origin are not attempted.
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 60 * 60
+BREAKER_THRESHOLD = 5
+_BACKOFF_KEY = "push:backoff:{origin}"
+_FAILURES_KEY = "push:failures:{origin}"
+
+# Signed VAPID headers are reused per push-service origin (the JWT audience).
+# A token is valid for VAPID_TOKEN_SECONDS but only handed out for the first
+# VAPID_REUSE_SECONDS of its life, so every request still carries hours of
+# validity — ample margin for clock skew on the push service side.
+VAPID_TOKEN_SECONDS = 12 * 60 * 60
+VAPID_REUSE_SECONDS = 6 * 60 * 60
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_vapid_headers = {}
+_vapid_lock = threading.Lock()
+_outbox = threading.local()
+
+
+def _origin(endpoint):
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+@lru_cache(maxsize=1)
+def _vapid_key(private_key):
+    """Parse the VAPID private key once per process (per configured value)."""
+    return Vapid02.from_string(private_key=private_key)
+
+
+def _vapid_headers_for(endpoint):
+    """Return the VAPID Authorization header for the endpoint's origin.
+
+    Signing is an ECDSA operation; with subscriptions spread over a handful of
+    push services, caching per audience turns one signature per push into one
+    per origin every VAPID_REUSE_SECONDS.
+    """
+    audience = _origin(endpoint)
+    key = (audience, settings.VAPID_PRIVATE_KEY, settings.VAPID_CLAIMS_EMAIL)
+    now = time.time()
+    with _vapid_lock:
+        cached = _vapid_headers.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+    headers = _vapid_key(settings.VAPID_PRIVATE_KEY).sign(
+        {
+            "sub": f"mailto:{settings.VAPID_CLAIMS_EMAIL}",
+            "aud": audience,
+            "exp": int(now) + VAPID_TOKEN_SECONDS,
+        }
+    )
+    with _vapid_lock:
+        _vapid_headers[key] = (now + VAPID_REUSE_SECONDS, headers)
+    return headers
+
+
+def _session_for(endpoint):
+    """Return the shared keep-alive session for the endpoint's origin."""
+    parts = urlsplit(endpoint)
+    origin = _origin(endpoint)
+    with _sessions_lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.PUSH_MAX_CONCURRENCY)
+            session.mount(f"{parts.scheme}://", adapter)
+            _sessions[origin] = session
+    return session
+
+
+def _headers_for(delivery):
+    headers = {"Urgency": "high", **_vapid_headers_for(delivery.subscription.endpoint)}
+    if delivery.topic:
+        headers["Topic"] = delivery.topic
+    return headers
+
+
+def _deliver(delivery):
+    subscription = delivery.subscription
+    try:
+        webpush(
+            subscription_info={
+                "endpoint": subscription.endpoint,
+                "keys": {
+                    "p256dh": subscription.p256dh,
+                    "auth": subscription.auth,
                 },
-                headers={"Urgency": "high"},
+            },
+            data=delivery.payload,
+            # Pre-signed: with no vapid_claims, pywebpush skips its own signing.
+            headers=_headers_for(delivery),
+            ttl=PUSH_TTL_SECONDS.get(delivery.type, DEFAULT_PUSH_TTL_SECONDS),
+            timeout=settings.PUSH_TIMEOUT_SECONDS,
+            requests_session=_session_for(subscription.endpoint),
+        )
+    except WebPushException as exc:
+        response = getattr(exc, "response", None)
+        status_code = getattr(response, "status_code", None)
+        retry_at = None
+        if status_code == 429:
+            retry_at = timezone.now() + timedelta(seconds=_retry_after_seconds(response))
+        return PushResult(delivery, status_code=status_code, error=str(exc), retry_at=retry_at)
+    except requests.RequestException as exc:
+        return PushResult(delivery, error=str(exc))
+    return PushResult(delivery)
+
+
+def _retry_after_seconds(response):
+    """Seconds asked for by a `Retry-After` header (delta or HTTP date).
+
+    Falls back to BACKOFF_BASE_SECONDS when absent or unparsable and is
+    capped at BACKOFF_MAX_SECONDS.
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    seconds = BACKOFF_BASE_SECONDS
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            seconds = int(value)
+        else:
+            try:
+                seconds = (parsedate_to_datetime(value) - timezone.now()).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    return min(max(seconds, 1), BACKOFF_MAX_SECONDS)
+
+
+def _blocked_origins(deliveries):
+    """Return ``{origin: retry_at}`` for the origins currently in backoff."""
+    keys = {_BACKOFF_KEY.format(origin=_origin(d.subscription.endpoint)) for d in deliveries}
+    blocked = cache.get_many(keys)
+    return {key.removeprefix(_BACKOFF_KEY.format(origin="")): until for key, until in blocked.items()}
+
+
+def _block_origin(origin, seconds):
+    until = timezone.now() + timedelta(seconds=seconds)
+    cache.set(_BACKOFF_KEY.format(origin=origin), until, timeout=int(seconds) + 1)
+    logger.warning("Push origin %s in backoff for %ds.", origin, seconds)
+    return until
+
+
+def _record_outcomes(results):
+    """Update the shared per-origin backoff state from a batch of results.
+
+    Every attempted result counts: an origin's failures in the batch are
+    added up before the breaker threshold is applied, and a success in the
+    batch restarts the count from them rather than clearing it.
+    """
+    outcomes = {}  # origin → [succeeded, failed, latest retry_at]
+    for result in results:
+        if not result.attempted:
+            continue
+        outcome = outcomes.setdefault(_origin(result.delivery.subscription.endpoint), [False, 0, None])
+        if result.delivered or result.gone:
+            outcome[0] = True
+        elif result.status_code == 429:
+            outcome[2] = max(outcome[2] or result.retry_at, result.retry_at)
+        elif result.status_code is None or result.status_code >= 500:
+            outcome[1] += 1
+    for origin, (succeeded, failed, retry_at) in outcomes.items():
+        failures_key = _FAILURES_KEY.format(origin=origin)
+        if retry_at is not None:
+            _block_origin(origin, (retry_at - timezone.now()).total_seconds())
+        if succeeded:
+            cache.delete(failures_key)
+        if not failed:
+            continue
+        cache.add(failures_key, 0, timeout=BACKOFF_MAX_SECONDS)
+        failures = cache.incr(failures_key, failed)
+        if failures >= BREAKER_THRESHOLD:
+            exponent = failures - BREAKER_THRESHOLD
+            _block_origin(origin, min(BACKOFF_BASE_SECONDS * 2**exponent, BACKOFF_MAX_SECONDS))
+
+
+def dispatch_pushes(deliveries):
+    """Send `deliveries` concurrently and return one PushResult per delivery.
+
+    Deliveries to an origin in backoff are not sent; their result carries
+    `retry_at` instead. Results come back in input order. No database access
+    happens here; pass the results to `apply_push_results` to record them.
+    """
+    deliveries = list(deliveries)
+    if not deliveries:
+        return []
+    blocked = _blocked_origins(deliveries)
+    results = [None] * len(deliveries)
+    pending = []
+    for index, delivery in enumerate(deliveries):
+        until = blocked.get(_origin(delivery.subscription.endpoint))
+        if until is not None:
+            results[index] = PushResult(delivery, error="push origin in backoff", retry_at=until, attempted=False)
+        else:
+            pending.append(index)
+
+    if len(pending) <= 1:
+        sent = [_deliver(deliveries[i]) for i in pending]
+    else:
+        workers = min(settings.PUSH_MAX_CONCURRENCY, len(pending))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="push") as pool:
+            sent = list(pool.map(_deliver, [deliveries[i] for i in pending]))
+    for index, result in zip(pending, sent):
+        results[index] = result
+
+    _record_outcomes(sent)
+    return results
+
+
+class SubscriptionWrites:
+    """`last_used` stamps and 404/410 deletions, flushed in two queries.
+
+    Lets a caller that dispatches several batches (the outbox drain) write
+    the subscription bookkeeping once for the whole run.
+    """
+
+    def __init__(self):
+        self.used = set()
+        self.gone = set()
+
+    def flush(self):
+        used = self.used - self.gone
+        if used:
+            PushSubscription.objects.filter(id__in=used).update(last_used=timezone.now())
+        if self.gone:
+            PushSubscription.objects.filter(id__in=self.gone).delete()
+        self.used.clear()
+        self.gone.clear()
+
+
+def apply_push_results(results, writes=None):
+    """Log a batch of results and record them in `writes`.
+
+    Without `writes` the bookkeeping is flushed right away: one UPDATE for
+    `last_used`, one DELETE for subscriptions the push service reported gone
+    (404/410). Returns the results that failed for any other reason
+    (throttled ones included), for callers that retry them.
+    """
+    flush = writes is None
+    if flush:
+        writes = SubscriptionWrites()
+    failed = []
+    for result in results:
+        subscription = result.delivery.subscription
+        username = result.delivery.user.username
+        if result.delivered:
+            writes.used.add(subscription.id)
+            logger.info(
+                "Push delivered to subscription %s (user=%s, type=%s).", subscription.id, username, result.delivery.type
             )
-            subscription.last_used = timezone.now()
-            subscription.save(update_fields=["last_used"])
-            logger.info("Push delivered to subscription %s (user=%s, type=%s).", subscription.id, user.username, type)
-
-        except WebPushException as exc:
-            response = getattr(exc, "response", None)
-            if response is not None and response.status_code in (404, 410):
-                logger.warning(
-                    "Removing expired subscription %s (user=%s, status=%s).",
-                    subscription.id,
-                    user.username,
-                    response.status_code,
-                )
-                to_delete.append(subscription.id)
-            else:
-                logger.error(
-                    "Push failed for subscription %s (user=%s): %s",
-                    subscription.id,
-                    user.username,
-                    exc,
-                )
-
-    if to_delete:
-        PushSubscription.objects.filter(id__in=to_delete).delete()
+        elif result.throttled:
+            logger.warning(
+                "Push to subscription %s deferred until %s (user=%s, push service throttling).",
+                subscription.id,
+                result.retry_at.isoformat(),
+                username,
+            )
+            failed.append(result)
+        elif result.gone:
+            logger.warning(
+                "Removing expired subscription %s (user=%s, status=%s).",
+                subscription.id,
+                username,
+                result.status_code,
+            )
+            writes.gone.add(subscription.id)
+        else:
+            logger.error(
+                "Push failed for subscription %s (user=%s): %s",
+                subscription.id,
+                username,
+                result.error,
+            )
+            failed.append(result)
+
+    if flush:
+        writes.flush()
+    return failed
+
+
+@contextmanager
+def queue_pushes():
+    """Write every `send_push_notification` in the block to the push outbox.
+
+    Nothing is sent: the rows are bulk-inserted when the block exits, so open
+    it inside the transaction whose locks must not wait on the network and
+    let `drain_push_outbox` deliver after commit. Nested blocks join the
+    outermost one; an exception discards the queued pushes.
+    """
+    if getattr(_outbox, "rows", None) is not None:
+        yield
+        return
+    _outbox.rows = []
+    try:
+        yield
+        rows = _outbox.rows
+    finally:
+        _outbox.rows = None
+    if rows:
+        PushOutbox.objects.bulk_create(rows)
+
+
+def _next_digest_at(now):
+    """Top of the next UTC hour — when a digest user's held pushes go out."""
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
+def outbox_deliveries(rows):
+    """Turn claimed PushOutbox rows into deliveries, one push per device.
+
+    Rows of COALESCED_TYPES waiting for the same subscription are merged into
+    a single TYPE_DIGEST push listing every routine, so a beat (or a digest
+    hour) with several due routines costs one encrypted payload per device
+    rather than one per routine. A routine with both a due and a reminder
+    row is listed once, and a lone routine keeps its original payload.
+    Other types are delivered as they are. Each digest gets a topic (and
+    notification tag) of its own, so it never replaces an earlier one still
+    unread. Merging covers the rows passed in; `_claim_outbox_batch` keeps
+    a device's rows in one batch. Rows need
+    `select_related("subscription__user")`.
+    """
+    deliveries = []
+    coalesced = {}
+    for row in rows:
+        if row.type in COALESCED_TYPES:
+            coalesced.setdefault(row.subscription_id, []).append(row)
+            continue
+        deliveries.append(_outbox_delivery(row.subscription, [row], row.payload, row.type, row.topic))
+
+    for group in coalesced.values():
+        subscription = group[0].subscription
+        latest = {}  # routine_id → payload; later rows supersede earlier ones
+        for row in group:
+            payload = json.loads(row.payload)
+            latest[payload.get("data", {}).get("routine_id")] = payload
+        if len(latest) == 1:
+            last = group[-1]
+            deliveries.append(_outbox_delivery(subscription, group, last.payload, last.type, last.topic))
+            continue
+        user = subscription.user
+        # Outbox ids are unique, and a digest's first row is in no other one.
+        topic = f"{TYPE_DIGEST}-{group[0].id}"
+        payload = json.dumps(
+            {
+                "title": _m(user, "digest_title", n=len(latest)),
+                "body": ", ".join(p["title"] for p in latest.values()),
+                "type": TYPE_DIGEST,
+                "tag": topic,
+                "data": {"routine_ids": [routine_id for routine_id in latest if routine_id is not None]},
+                # No mark-done: a digest stands for several routines.
+                "actions": _actions(user, mark_done=False),
+            }
+        )
+        deliveries.append(_outbox_delivery(subscription, group, payload, TYPE_DIGEST, topic))
+    return deliveries
+
+
+def _outbox_delivery(subscription, rows, payload, type, topic):
+    return PushDelivery(
+        subscription=subscription,
+        user=subscription.user,
+        payload=payload,
+        type=type,
+        topic=topic,
+        outbox_ids=tuple(row.id for row in rows),
+    )
 
 
 # ── Convenience helpers used by the Celery worker ────────────────────────────
 
 
-def _actions(user):
-    return [
-        {"action": "mark-done", "title": _m(user, "action_done")},
-        {"action": "dismiss", "title": _m(user, "action_dismiss")},
-    ]
+def _topic(type, routine_id=None):
+    """Web Push `Topic` for a notification: the type, scoped to the routine.
+
+    Topics are limited to 32 URL-safe base64 characters, which type names
+    and numeric ids satisfy.
+    """
+    return f"{type}-{routine_id}" if routine_id is not None else type
+
+
+def _actions(user, *, mark_done=True):
+    actions = [{"action": "mark-done", "title": _m(user, "action_done")}] if mark_done else []
+    return [*actions, {"action": "dismiss", "title": _m(user, "action_dismiss")}]
 
 
 def notify_daily_heads_up(user, due_count: int, names: list = None):
@@ -187,6 +654,7 @@ def notify_daily_heads_up(user, due_count: int, names: list = None):
         body=body,
         type=TYPE_DAILY,
         actions=_actions(user),
+        topic=_topic(TYPE_DAILY),
     )
 
 
@@ -209,6 +677,7 @@ def notify_due(routine, *, target_user=None):
         type=TYPE_DUE,
         data={"routine_id": routine.id},
         actions=_actions(user),
+        topic=_topic(TYPE_DUE, routine.id),
     )
 
 
@@ -229,6 +698,7 @@ def notify_reminder(routine, hours_overdue: float, *, target_user=None):
         type=TYPE_REMINDER,
         data={"routine_id": routine.id},
         actions=_actions(user),
+        topic=_topic(TYPE_REMINDER, routine.id),
     )
 
 
@@ -1,32 +1,75 @@
 import logging
 import time
+import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Prefetch
+from django.db.models import F, Prefetch, Q
+from django.db.models.functions import Mod
 from django.utils import timezone
 
-from apps.routines.models import Routine, RoutineEntry
-
-from .models import NotificationState
-from .push import notify_daily_heads_up, notify_due, notify_reminder, notify_test
+from apps.routines.models import Routine
+
+from .models import NotificationState, PushOutbox
+from .push import (
+    COALESCED_TYPES,
+    SubscriptionWrites,
+    apply_push_results,
+    dispatch_pushes,
+    notify_daily_heads_up,
+    notify_due,
+    notify_reminder,
+    notify_test,
+    outbox_deliveries,
+    queue_pushes,
+)
 
 logger = logging.getLogger(__name__)
 
 DAILY_WINDOW_MINUTES = 5  # tolerance around the user's configured time
+DAILY_CATCHUP_MINUTES = 60  # how late a heads-up missed by the beat may still go out
+HEADS_UP_MARK_SECONDS = 2 * 24 * 60 * 60  # keeps "evaluated today" past any local midnight
+STATE_BATCH_SIZE = 200  # routines whose NotificationState rows are locked together
+OUTBOX_BATCH_SIZE = 200  # outbox rows claimed and delivered together
+OUTBOX_CLAIM_SECONDS = 5 * 60  # how long a claimed row stays invisible to other drains
+OUTBOX_RETRY_BASE_SECONDS = 60
+SHARD_TIME_LIMIT = 300  # hard limit per shard run; also how long its lease lasts
+# How early a planned notify_routine may run and still count as on time.
+ETA_EARLY_TOLERANCE = timedelta(seconds=5)
 
 
 @shared_task(
     name="apps.notifications.tasks.check_notifications",
-    time_limit=300,
-    soft_time_limit=250,
+    time_limit=60,
+    soft_time_limit=50,
 )
 def check_notifications():
     """
-    Runs every 5 minutes. For each active user:
+    Runs every 5 minutes and fans out into NOTIFICATION_SHARDS
+    `check_notifications_shard` tasks, partitioned by user id, so the pass
+    spreads over every worker instead of one core.
+    """
+    shards = max(1, settings.NOTIFICATION_SHARDS)
+    for shard in range(shards):
+        check_notifications_shard.delay(shard, shards)
+
+
+@shared_task(
+    name="apps.notifications.tasks.check_notifications_shard",
+    time_limit=SHARD_TIME_LIMIT,
+    soft_time_limit=SHARD_TIME_LIMIT - 50,
+)
+def check_notifications_shard(shard, shards):
+    """
+    One shard of the notification pass. For the active users whose id falls
+    in this shard:
       1. Daily heads-up  — once per day at the user's configured local time.
       2. Due notification — when a routine becomes overdue, once per cycle.
       3. Reminder        — every routine.reminder_interval_minutes while overdue,
@@ -34,72 +77,102 @@ def check_notifications():
                            and per-recipient quiet hours when
                            routine.respect_quiet_hours is True.
 
-    Shared routines are included: due/reminder notifications are sent to all
-    members (owner + shared_with). A processed_routines set prevents duplicate
-    processing when the same routine appears for multiple users.
+    Routines belong to their owner's shard. Shared routines are included:
+    due/reminder notifications are sent to all members (owner +
+    shared_with), wherever those members' own shards are.
+
+    Only routines whose materialized `scheduled_due_at` has passed (or that
+    were never logged) are loaded for steps 2 and 3 — one indexed range
+    query, so the beat scales with what is due rather than with every
+    routine on the instance. Likewise step 1 only loads the users whose
+    `daily_notification_utc_minute` puts their window open right now, or
+    closed within the last DAILY_CATCHUP_MINUTES without having been
+    evaluated (a late or skipped beat).
+
+    Notification states are handled per batch of STATE_BATCH_SIZE routines:
+    missing rows are created with one bulk insert, the batch is locked with
+    one `SELECT ... FOR UPDATE SKIP LOCKED` and changes are written back with
+    one `bulk_update`. Pushes are written to the PushOutbox inside that same
+    transaction and delivered by `drain_push_outbox`, so no lock is held
+    while a push service answers.
+
+    Single-flight: a shard holds a lease in the shared cache while it runs,
+    and a copy started while the previous one is still going (an overrun
+    beat) does nothing. Each committed batch is a checkpoint — when the soft
+    time limit interrupts a run, the next run of the shard resumes after
+    the last committed routine and wraps around to the ones before it.
     """
+    lease_key = _shard_key("lease", shard, shards)
+    lease = _acquire_lease(lease_key, SHARD_TIME_LIMIT)
+    if lease is None:
+        logger.info("check_notifications: shard %d/%d still running — skipped.", shard, shards)
+        return
+    try:
+        checked = _check_shard(shard, shards)
+    finally:
+        _release_lease(lease_key, lease)
+
+    # Everything this shard queued is in the outbox now; deliver it right
+    # away rather than waiting for the drain's own schedule.
+    if checked:
+        drain_push_outbox.delay()
+
+
+def _check_shard(shard, shards):
+    """Run one shard's pass; returns how many users and routines it checked."""
     User = get_user_model()
     now_utc = timezone.now()
     start_time = time.monotonic()
-
-    entry_prefetch = Prefetch(
-        "entries",
-        queryset=RoutineEntry.objects.order_by("-client_created_at"),
-        to_attr="_prefetched_entries",
-    )
-    active_routines_qs = (
-        Routine.objects.filter(is_active=True)
-        .select_related("stock", "user")
-        .prefetch_related(entry_prefetch, "shared_with")
-    )
-
-    users = (
-        User.objects.filter(
-            is_active=True,
-            push_subscriptions__isnull=False,
-        )
+    checkpoint_key = _shard_key("checkpoint", shard, shards)
+
+    recipients = User.objects.filter(is_active=True, push_subscriptions__isnull=False)
+    due_routines = (
+        _in_shard(_notifiable_routines(), "user_id", shard, shards)
+        .filter(Q(scheduled_due_at__isnull=True) | Q(scheduled_due_at__lte=now_utc))
+        .filter(Q(user__in=recipients) | Q(shared_with__in=recipients))
+        .filter(_reminder_may_fire(now_utc))
         .distinct()
-        .prefetch_related(
-            Prefetch("routines", queryset=active_routines_qs),
-            Prefetch("shared_routines", queryset=active_routines_qs),
-        )
+        .order_by("id")
     )
 
-    processed_routines = set()
-
-    for user in users:
-        try:
-            user_tz = ZoneInfo(user.timezone)
-        except (ZoneInfoNotFoundError, ValueError):
-            logger.warning("Invalid timezone %r for user %s — skipping.", user.timezone, user.id)
-            continue
-
-        now_local = now_utc.astimezone(user_tz)
-
-        # Combine owned + shared routines, deduplicate
-        all_routines = _unique_routines(user)
-
-        logger.debug("Checking user %s (%d active routines).", user.username, len(all_routines))
-
-        _check_daily_heads_up(user, now_utc, now_local, user_tz, all_routines)
-
-        for routine in all_routines:
-            if routine.id in processed_routines:
-                continue
-            processed_routines.add(routine.id)
-            try:
-                _check_due_notification(routine, now_utc)
-                _check_reminder(routine, now_utc)
-            except Exception:
-                logger.exception("Error processing routine %s for user %s.", routine.id, user.id)
+    heads_up_users = processed = 0
+    resumed = cursor = cache.get(checkpoint_key, 0)
+    # A resumed run goes on to the tail, then round to the ids below the
+    # checkpoint, so none of them waits for another beat.
+    passes = [(resumed, due_routines), (0, due_routines.filter(id__lte=resumed))] if resumed else [(0, due_routines)]
+    try:
+        heads_up_users = _check_daily_heads_ups(_in_shard(recipients, "id", shard, shards), now_utc)
+        for cursor, routines in passes:
+            while True:
+                batch = list(routines.filter(id__gt=cursor)[:STATE_BATCH_SIZE])
+                if batch:
+                    processed += _process_due_batch(batch, now_utc)
+                    cursor = batch[-1].id
+                if len(batch) < STATE_BATCH_SIZE:
+                    break
+    except SoftTimeLimitExceeded:
+        # The interrupted batch rolled back; everything up to `cursor` is
+        # committed. Heads-ups need no checkpoint: evaluated users are marked.
+        cache.set(checkpoint_key, cursor, timeout=SHARD_TIME_LIMIT * 4)
+        logger.warning(
+            "check_notifications: shard %d/%d hit its time limit after routine %s — resuming there next run.",
+            shard,
+            shards,
+            cursor,
+        )
+        return heads_up_users + processed
+    cache.delete(checkpoint_key)
 
     elapsed_ms = round((time.monotonic() - start_time) * 1000)
     logger.info(
-        "check_notifications completed: %d users, %d routines in %dms.",
-        len(users),
-        len(processed_routines),
+        "check_notifications shard %d/%d completed: %d heads-up users, %d due routines in %dms.",
+        shard,
+        shards,
+        heads_up_users,
+        processed,
         elapsed_ms,
     )
+    return heads_up_users + processed
 
 
 @shared_task(
@@ -119,18 +192,308 @@ def send_scheduled_test(user_id):
     logger.info("Scheduled test notification sent to user %s.", user.username)
 
 
+@shared_task(
+    name="apps.notifications.tasks.drain_push_outbox",
+    time_limit=300,
+    soft_time_limit=250,
+)
+def drain_push_outbox():
+    """
+    Deliver pending PushOutbox rows. Triggered at the end of every
+    check_notifications run and by its own beat entry, which picks up retries.
+
+    Rows are claimed in batches of OUTBOX_BATCH_SIZE in a short transaction
+    (SKIP LOCKED, so concurrent drains split the work) and delivered after it
+    commits, with the due/reminder rows of each device coalesced into one
+    push. Delivered rows are deleted; failures are retried with
+    exponential backoff and marked dead after PUSH_OUTBOX_MAX_ATTEMPTS.
+    Rows for a throttled push service wait until it accepts traffic again.
+    """
+    now = timezone.now()
+    writes = SubscriptionWrites()
+    delivered = retried = dead = 0
+    while rows := _claim_outbox_batch(now):
+        attempts = {row.id: row.attempts + 1 for row in rows}
+        failed = apply_push_results(dispatch_pushes(outbox_deliveries(rows)), writes)
+
+        failed_ids = {outbox_id for result in failed for outbox_id in result.delivery.outbox_ids}
+        # Rows of gone subscriptions count as done: the subscription goes below.
+        sent, _ = PushOutbox.objects.filter(id__in=[r.id for r in rows if r.id not in failed_ids]).delete()
+        delivered += sent
+        for result in failed:
+            outbox_ids = result.delivery.outbox_ids
+            tries = max(attempts[outbox_id] for outbox_id in outbox_ids)
+            if result.attempted and tries >= settings.PUSH_OUTBOX_MAX_ATTEMPTS:
+                PushOutbox.objects.filter(id__in=outbox_ids).update(
+                    status=PushOutbox.STATUS_DEAD, last_error=result.error
+                )
+                dead += len(outbox_ids)
+            elif result.throttled:
+                # The push service set the pace: wait for it, and don't charge
+                # an attempt that never reached it.
+                PushOutbox.objects.filter(id__in=outbox_ids).update(
+                    available_at=result.retry_at,
+                    last_error=result.error,
+                    **({} if result.attempted else {"attempts": F("attempts") - 1}),
+                )
+                retried += len(outbox_ids)
+            else:
+                PushOutbox.objects.filter(id__in=outbox_ids).update(
+                    available_at=now + _outbox_backoff(tries),
+                    last_error=result.error,
+                )
+                retried += len(outbox_ids)
+
+    # One UPDATE of last_used and one DELETE of gone subscriptions per run.
+    writes.flush()
+
+    if delivered or retried or dead:
+        logger.info("drain_push_outbox: %d delivered, %d retried, %d dead.", delivered, retried, dead)
+
+
+@shared_task(
+    name="apps.notifications.tasks.notify_routine",
+    time_limit=60,
+    soft_time_limit=50,
+)
+def notify_routine(routine_id, token, eta):
+    """
+    Run the due and reminder checks for one routine at its planned moment
+    (see `schedule_routine`), then plan its next reminder.
+
+    A no-op when superseded (the routine's token moved on), when run early
+    (eager mode, clock skew) or when the routine is gone or inactive; the
+    check_notifications beat stays as the safety net for all of those.
+    """
+    if (cache.get(_eta_key(routine_id)) or {}).get("token") != token:
+        logger.debug("notify_routine: routine %s superseded — skipped.", routine_id)
+        return
+    now_utc = timezone.now()
+    if now_utc < datetime.fromisoformat(eta) - ETA_EARLY_TOLERANCE:
+        logger.debug("notify_routine: routine %s run before %s — skipped.", routine_id, eta)
+        return
+    routine = _notifiable_routines().filter(pk=routine_id).first()
+    if routine is None:
+        return
+
+    _process_due_batch([routine], now_utc)
+    drain_push_outbox.delay()
+
+    next_reminder = _next_reminder_at(routine, now_utc)
+    if next_reminder is not None:
+        _plan_notify_routine(routine_id, next_reminder)
+
+
+def schedule_routine(routine_id):
+    """Plan `notify_routine` for the routine's due moment, superseding any
+    earlier plan. Called after a commit that moved the routine's due time.
+
+    Superseding works by token rather than by revoking the queued task: the
+    routine's current token lives in the shared cache and tasks carrying an
+    older one do nothing when they fire.
+    """
+    if settings.EMBEDDED_SCHEDULER:
+        # No broker to hold an eta in embedded mode; the 5-minute pass covers it.
+        return
+    routine = Routine.objects.filter(pk=routine_id).values("is_active", "scheduled_due_at").first()
+    if routine is None or not routine["is_active"]:
+        cache.delete(_eta_key(routine_id))
+        return
+    # Never-logged routines (no due time) are due right away.
+    _plan_notify_routine(routine_id, routine["scheduled_due_at"] or timezone.now())
+
+
+@shared_task(
+    name="apps.notifications.tasks.plan_notifications",
+    time_limit=120,
+    soft_time_limit=100,
+)
+def plan_notifications():
+    """
+    Plan `notify_routine` for the routines whose due time or next reminder
+    has come within NOTIFY_ETA_HORIZON_SECONDS and that carry no plan for
+    it yet — the moments `_plan_notify_routine` left for later. Runs more
+    often than the horizon is long, so each moment is planned ahead of time.
+    """
+    if settings.EMBEDDED_SCHEDULER:
+        return 0
+    now_utc = timezone.now()
+    until = now_utc + timedelta(seconds=settings.NOTIFY_ETA_HORIZON_SECONDS)
+    moments = {}
+    for routine_id, due, reminder in (
+        Routine.objects.filter(is_active=True)
+        .filter(
+            Q(scheduled_due_at__gt=now_utc, scheduled_due_at__lte=until)
+            | Q(notification_state__next_reminder_at__gt=now_utc, notification_state__next_reminder_at__lte=until)
+        )
+        .values_list("id", "scheduled_due_at", "notification_state__next_reminder_at")
+    ):
+        moments[routine_id] = min(m for m in (due, reminder) if m is not None and now_utc < m <= until)
+
+    plans = cache.get_many([_eta_key(routine_id) for routine_id in moments])
+    planned = 0
+    for routine_id, eta in moments.items():
+        plan = plans.get(_eta_key(routine_id))
+        if plan is None or plan["eta"] != eta.isoformat():
+            _plan_notify_routine(routine_id, eta)
+            planned += 1
+    if planned:
+        logger.info("plan_notifications: %d routine(s) planned.", planned)
+    return planned
+
+
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
 
-def _unique_routines(user):
-    """Return deduplicated list of owned + shared routines from prefetch cache."""
-    seen = set()
-    result = []
-    for r in list(user.routines.all()) + list(user.shared_routines.all()):
-        if r.id not in seen:
-            seen.add(r.id)
-            result.append(r)
-    return result
+def _eta_key(routine_id):
+    return f"notifications:routine-eta:{routine_id}"
+
+
+def _plan_notify_routine(routine_id, eta):
+    """Queue `notify_routine` for `eta` under a fresh token, superseding any
+    earlier plan for the routine.
+
+    Only an `eta` within NOTIFY_ETA_HORIZON_SECONDS is queued. The Redis
+    broker hands an unacknowledged message to another worker once the
+    visibility timeout passes, and a worker holds an eta message unacked
+    until it runs, so a further one would run several times. Later moments
+    drop the plan and are left to `plan_notifications`.
+    """
+    if eta > timezone.now() + timedelta(seconds=settings.NOTIFY_ETA_HORIZON_SECONDS):
+        cache.delete(_eta_key(routine_id))
+        return
+    token = uuid.uuid4().hex
+    cache.set(_eta_key(routine_id), {"token": token, "eta": eta.isoformat()}, timeout=None)
+    _enqueue_notify_routine(routine_id, token, eta)
+
+
+def _enqueue_notify_routine(routine_id, token, eta):
+    try:
+        notify_routine.apply_async((routine_id, token, eta.isoformat()), eta=eta)
+    except Exception:
+        # The broker being briefly unavailable must not fail the request that
+        # moved the due time; the beat picks the routine up on its next pass.
+        logger.exception("Could not schedule notifications for routine %s.", routine_id)
+
+
+def _next_reminder_at(routine, now_utc):
+    """When the next reminder for an overdue routine may fire, if one will."""
+    if routine.reminder_mode == "daily":
+        return None
+    state = NotificationState.objects.filter(routine_id=routine.id).first()
+    if state is None or state.last_due_notification is None:
+        return None
+    next_at = state.next_reminder_at
+    if next_at is None:
+        last = state.last_reminder or state.last_due_notification
+        next_at = last + timedelta(minutes=routine.reminder_interval_minutes)
+    return next_at if next_at > now_utc else None
+
+
+def _notifiable_routines():
+    """Active routines with everything the due and reminder checks touch."""
+    return (
+        Routine.objects.filter(is_active=True)
+        .select_related("stock", "user", "notification_state")
+        .with_entry_stats()
+        # Members' subscriptions come along so queuing a push costs no query.
+        .prefetch_related(
+            "user__push_subscriptions",
+            Prefetch("shared_with", queryset=get_user_model().objects.prefetch_related("push_subscriptions")),
+        )
+    )
+
+
+def _claim_outbox_batch(now):
+    """Claim up to OUTBOX_BATCH_SIZE ready rows and return them.
+
+    A full batch also takes every other ready row of COALESCED_TYPES for
+    the devices it holds such rows for, so the limit never splits what
+    `outbox_deliveries` merges into one digest.
+
+    Claiming bumps `attempts` and pushes `available_at` past `now` by
+    OUTBOX_CLAIM_SECONDS: other drains skip the rows meanwhile, and a drain
+    that dies mid-delivery just lets the claim lapse into a retry.
+    """
+    with transaction.atomic():
+        rows = list(
+            PushOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(status=PushOutbox.STATUS_PENDING, available_at__lte=now)
+            .select_related("subscription__user")
+            .order_by("available_at", "id")[:OUTBOX_BATCH_SIZE]
+        )
+        coalesced = {row.subscription_id for row in rows if row.type in COALESCED_TYPES}
+        if len(rows) == OUTBOX_BATCH_SIZE and coalesced:
+            rows += (
+                PushOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(
+                    status=PushOutbox.STATUS_PENDING,
+                    available_at__lte=now,
+                    type__in=COALESCED_TYPES,
+                    subscription_id__in=coalesced,
+                )
+                .exclude(id__in=[row.id for row in rows])
+                .select_related("subscription__user")
+                .order_by("available_at", "id")
+            )
+        if rows:
+            PushOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+                attempts=F("attempts") + 1,
+                available_at=now + timedelta(seconds=OUTBOX_CLAIM_SECONDS),
+            )
+    return rows
+
+
+def _outbox_backoff(attempts):
+    """Delay before retry number `attempts`: 1, 2, 4, ... minutes, capped at an hour."""
+    return timedelta(seconds=min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 60 * 60))
+
+
+def _reminder_may_fire(now_utc):
+    """Q for routines worth evaluating: not waiting on `next_reminder_at`,
+    or starting a new due cycle (due again after their last due push)."""
+    return (
+        Q(notification_state__next_reminder_at__isnull=True)
+        | Q(notification_state__next_reminder_at__lte=now_utc)
+        | Q(notification_state__last_due_notification__lt=F("scheduled_due_at"))
+    )
+
+
+def _shard_key(kind, shard, shards):
+    return f"notifications:shard-{kind}:{shard}/{shards}"
+
+
+def _in_shard(queryset, field, shard, shards):
+    """Restrict `queryset` to the rows whose `field` falls in `shard`."""
+    if shards == 1:
+        return queryset
+    return queryset.alias(_shard=Mod(field, shards)).filter(_shard=shard)
+
+
+def _acquire_lease(key, seconds):
+    """Take a single-flight lease in the shared cache; returns its token, or
+    None when someone else holds it. The lease expires on its own after
+    `seconds`, so a killed worker cannot hold it forever."""
+    token = uuid.uuid4().hex
+    return token if cache.add(key, token, timeout=seconds) else None
+
+
+def _release_lease(key, token):
+    # Only drop our own lease: after an expiry another run may hold the key.
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def _unique_routines(user, *, due_before=None):
+    """Return the user's active routines, owned and shared, without duplicates.
+
+    `due_before` narrows the set on the materialized due time; never-logged
+    routines are always included since they count as due.
+    """
+    routines = Routine.objects.filter(Q(user=user) | Q(shared_with=user), is_active=True)
+    if due_before is not None:
+        routines = routines.filter(Q(scheduled_due_at__isnull=True) | Q(scheduled_due_at__lt=due_before))
+    return list(routines.distinct().select_related("user", "notification_state").with_entry_stats())
 
 
 def _get_routine_members(routine):
@@ -140,11 +503,132 @@ def _get_routine_members(routine):
     return members
 
 
-def _get_or_create_state(routine, *, lock=False):
-    state, _ = NotificationState.objects.get_or_create(routine=routine)
-    if lock:
-        state = NotificationState.objects.select_for_update().get(pk=state.pk)
-    return state
+def _ensure_states(routines):
+    """Create the missing NotificationState rows for `routines` in one insert.
+
+    Expects `notification_state` to be select_related on the routines, so
+    finding the missing rows costs no query. `ignore_conflicts` covers a
+    concurrent worker (or `RoutineViewSet.log`) creating the same row first.
+    """
+    missing = [r for r in routines if not hasattr(r, "notification_state")]
+    if missing:
+        NotificationState.objects.bulk_create(
+            [NotificationState(routine=r) for r in missing],
+            ignore_conflicts=True,
+        )
+
+
+def _lock_states(routines, *, skip_locked=False):
+    """Lock the NotificationState rows of `routines` in one query.
+
+    Returns ``{routine_id: state}``. With `skip_locked`, rows another worker
+    holds are left out rather than waited for — that routine is simply
+    somebody else's this beat. Must run inside a transaction.
+    """
+    states = NotificationState.objects.select_for_update(skip_locked=skip_locked).filter(
+        routine_id__in=[r.id for r in routines]
+    )
+    return {state.routine_id: state for state in states}
+
+
+def _process_due_batch(routines, now_utc):
+    """Run the due and reminder checks for one batch under a single lock.
+
+    Returns the number of routines processed (those whose state was locked).
+    """
+    _ensure_states(routines)
+    with transaction.atomic(), queue_pushes():
+        states = _lock_states(routines, skip_locked=True)
+        changed = []
+        for routine in routines:
+            state = states.get(routine.id)
+            if state is None:
+                logger.debug("Routine %s state locked by another worker — skipped.", routine.id)
+                continue
+            try:
+                due_sent = _check_due_notification(routine, now_utc, state)
+                reminder_sent = _check_reminder(routine, now_utc, state)
+            except Exception:
+                logger.exception("Error processing routine %s for user %s.", routine.id, routine.user_id)
+                continue
+            if due_sent or reminder_sent:
+                changed.append(state)
+        if changed:
+            NotificationState.objects.bulk_update(
+                changed, ["last_due_notification", "last_reminder", "next_reminder_at"]
+            )
+    return len(states)
+
+
+def _check_daily_heads_ups(recipients, now_utc):
+    """Run the daily heads-up for every recipient whose window is open.
+
+    Candidates come from the indexed `daily_notification_utc_minute` and are
+    grouped by timezone, so the local time is computed once per zone. A
+    user whose window was evaluated is marked in the cache for the local day
+    it belongs to; one whose window passed unevaluated is caught up for
+    DAILY_CATCHUP_MINUTES, past local midnight if need be. Returns the
+    number of users evaluated.
+    """
+    minute = now_utc.hour * 60 + now_utc.minute
+    candidates = (
+        recipients.filter(_utc_minute_between(minute - DAILY_CATCHUP_MINUTES, minute + DAILY_WINDOW_MINUTES))
+        .distinct()
+        .prefetch_related("push_subscriptions")
+    )
+    by_zone = defaultdict(list)
+    for user in candidates:
+        by_zone[user.timezone].append(user)
+
+    evaluated = 0
+    for tz_name, users in by_zone.items():
+        try:
+            user_tz = ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Invalid timezone %r for users %s — skipping.", tz_name, [u.id for u in users])
+            continue
+        now_local = now_utc.astimezone(user_tz)
+        keys = {}
+        for user in users:
+            day = _heads_up_window(user.daily_notification_time, now_local, DAILY_CATCHUP_MINUTES)
+            if day is not None:
+                keys[user.id] = _heads_up_key(user.id, day)
+        done = cache.get_many(keys.values())
+        for user in users:
+            if user.id not in keys or keys[user.id] in done:
+                continue
+            if _check_daily_heads_up(user, now_utc, now_local, user_tz, catch_up_minutes=DAILY_CATCHUP_MINUTES):
+                cache.set(keys[user.id], True, timeout=HEADS_UP_MARK_SECONDS)
+                evaluated += 1
+    return evaluated
+
+
+def _utc_minute_between(low, high):
+    """Q for `daily_notification_utc_minute` in [low, high], wrapping at midnight."""
+    day = 24 * 60
+    if low < 0:
+        return Q(daily_notification_utc_minute__gte=low + day) | Q(daily_notification_utc_minute__lte=high)
+    if high >= day:
+        return Q(daily_notification_utc_minute__gte=low) | Q(daily_notification_utc_minute__lte=high - day)
+    return Q(daily_notification_utc_minute__range=(low, high))
+
+
+def _heads_up_window(target, now_local, catch_up_minutes=0):
+    """Local day whose heads-up window `now_local` falls in, or None.
+
+    The window runs from DAILY_WINDOW_MINUTES before the `target` time to
+    as long after it, plus `catch_up_minutes`. Yesterday's window is checked
+    too: one missed just before local midnight is caught up just after it.
+    """
+    for day in (now_local.date(), now_local.date() - timedelta(days=1)):
+        late_seconds = (now_local - datetime.combine(day, target, tzinfo=now_local.tzinfo)).total_seconds()
+        if -DAILY_WINDOW_MINUTES * 60 <= late_seconds <= (DAILY_WINDOW_MINUTES + catch_up_minutes) * 60:
+            return day
+    return None
+
+
+def _heads_up_key(user_id, local_date):
+    return f"notifications:heads-up:{user_id}:{local_date.isoformat()}"
 
 
 def _is_due_today(routine, now_local, user_tz):
@@ -156,45 +640,52 @@ def _is_due_today(routine, now_local, user_tz):
     return next_due_local.date() <= now_local.date()
 
 
-def _check_daily_heads_up(user, now_utc, now_local, user_tz, all_routines=None):
+def _check_daily_heads_up(user, now_utc, now_local, user_tz, all_routines=None, catch_up_minutes=0):
     """
     Send the daily heads-up if:
-      - The current local time matches the user's configured time (±DAILY_WINDOW_MINUTES).
+      - The current local time matches the user's configured time (±DAILY_WINDOW_MINUTES,
+        or up to `catch_up_minutes` later for a window the beat missed).
       - At least one routine is due today.
       - It hasn't been sent yet today for those routines.
+
+    "Today" is the local day the window belongs to (see `_heads_up_window`).
+    Returns True when the window was open, whether or not a push went out.
     """
     target = user.daily_notification_time
-    target_dt = datetime.combine(now_local.date(), target, tzinfo=now_local.tzinfo)
-    diff_seconds = abs((now_local - target_dt).total_seconds())
+    day = _heads_up_window(target, now_local, catch_up_minutes)
 
-    if diff_seconds > DAILY_WINDOW_MINUTES * 60:
+    if day is None:
         logger.debug(
             "Daily heads-up: not in time window for user %s (now=%s, target=%s).",
             user.username,
             now_local.strftime("%H:%M"),
             target.strftime("%H:%M"),
         )
-        return
+        return False
 
     if all_routines is None:
-        all_routines = _unique_routines(user)
+        end_of_day = datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=user_tz)
+        all_routines = _unique_routines(user, due_before=end_of_day)
 
-    due_routines = [r for r in all_routines if _is_due_today(r, now_local, user_tz)]
+    target_dt = datetime.combine(day, target, tzinfo=user_tz)
+    due_routines = [r for r in all_routines if _is_due_today(r, target_dt, user_tz)]
     if not due_routines:
         logger.debug("Daily heads-up: no routines due today for user %s.", user.username)
-        return
+        return True
 
-    today_local = now_local.date()
+    today_local = day
 
-    with transaction.atomic():
-        # Lock all notification states for due routines
-        states = {r.id: _get_or_create_state(r, lock=True) for r in due_routines}
+    _ensure_states(due_routines)
+    with transaction.atomic(), queue_pushes():
+        # Lock all notification states for due routines. No SKIP LOCKED here:
+        # the "already sent today" check needs every one of them.
+        states = _lock_states(due_routines)
 
         # Skip if we already sent the daily notification for any due routine today
         already_sent = any(states[r.id].last_daily_notification == today_local for r in due_routines)
         if already_sent:
             logger.debug("Daily heads-up: already sent today for user %s.", user.username)
-            return
+            return True
 
         notify_daily_heads_up(user, due_count=len(due_routines), names=[r.name for r in due_routines])
         logger.info(
@@ -205,49 +696,51 @@ def _check_daily_heads_up(user, now_utc, now_local, user_tz, all_routines=None):
         )
 
         # Mark all due routines as notified today
-        for routine in due_routines:
-            state = states[routine.id]
+        for state in states.values():
             state.last_daily_notification = today_local
-            state.save(update_fields=["last_daily_notification"])
+        NotificationState.objects.bulk_update(states.values(), ["last_daily_notification"])
+    return True
 
 
-def _check_due_notification(routine, now_utc):
+def _check_due_notification(routine, now_utc, state):
     """
     Send a 'due' notification when the routine first becomes overdue.
     Does not repeat within the same cycle (i.e. until the next RoutineEntry).
     Sends to all members (owner + shared_with).
+
+    The caller (`_process_due_batch`) holds the row lock on `state` and
+    persists it; returns True when `state` was changed.
     """
     if not routine.is_overdue():
         logger.debug("Due: routine %r not overdue — skipped.", routine.name)
-        return
+        return False
 
-    with transaction.atomic():
-        state = _get_or_create_state(routine, lock=True)
-        last_entry = routine.last_entry()
-
-        if state.last_due_notification:
-            if last_entry is None:
-                logger.debug("Due: routine %r never logged, already notified — skipped.", routine.name)
-                return
-            if state.last_due_notification > last_entry.created_at:
-                logger.debug(
-                    "Due: routine %r already notified this cycle (last_due=%s, last_entry=%s) — skipped.",
-                    routine.name,
-                    state.last_due_notification.isoformat(),
-                    last_entry.created_at.isoformat(),
-                )
-                return
+    last_entry = routine.last_entry()
+
+    if state.last_due_notification:
+        if last_entry is None:
+            logger.debug("Due: routine %r never logged, already notified — skipped.", routine.name)
+            return False
+        if state.last_due_notification > last_entry.created_at:
+            logger.debug(
+                "Due: routine %r already notified this cycle (last_due=%s, last_entry=%s) — skipped.",
+                routine.name,
+                state.last_due_notification.isoformat(),
+                last_entry.created_at.isoformat(),
+            )
+            return False
 
-        members = _get_routine_members(routine)
-        for member in members:
-            notify_due(routine, target_user=member)
-        logger.info("Due notification sent for routine %r (user %s).", routine.name, routine.user.username)
+    members = _get_routine_members(routine)
+    for member in members:
+        notify_due(routine, target_user=member)
+    logger.info("Due notification sent for routine %r (user %s).", routine.name, routine.user.username)
 
-        state.last_due_notification = now_utc
-        state.save(update_fields=["last_due_notification"])
+    state.last_due_notification = now_utc
+    state.next_reminder_at = now_utc + timedelta(minutes=routine.reminder_interval_minutes)
+    return True
 
 
-def _check_reminder(routine, now_utc):
+def _check_reminder(routine, now_utc, state):
     """Send a recurring reminder while the routine remains overdue.
 
     Three gates layered on top of the previous behavior:
@@ -260,88 +753,97 @@ def _check_reminder(routine, now_utc):
         the resulting recipient list is empty, the cycle is NOT sealed —
         the next 5-min beat retries until at least one recipient emerges.
 
-    Only fires after the initial 'due' notification has been sent.
+    Only fires after the initial 'due' notification has been sent. `state`
+    and the return value work as in `_check_due_notification`.
     """
     if not routine.is_overdue():
         logger.debug("Reminder: routine %r not overdue — skipped.", routine.name)
-        return
+        return False
 
     if routine.reminder_mode == "daily":
         logger.debug(
             "Reminder: routine %r is daily-mode — heads-up will cover it.",
             routine.name,
         )
-        return
-
-    with transaction.atomic():
-        state = _get_or_create_state(routine, lock=True)
+        return False
 
-        if not state.last_due_notification:
-            logger.debug("Reminder: routine %r waiting for due notification first — skipped.", routine.name)
-            return
+    if not state.last_due_notification:
+        logger.debug("Reminder: routine %r waiting for due notification first — skipped.", routine.name)
+        return False
 
-        last_notif = state.last_reminder or state.last_due_notification
-        interval = timedelta(minutes=routine.reminder_interval_minutes)
+    last_notif = state.last_reminder or state.last_due_notification
+    interval = timedelta(minutes=routine.reminder_interval_minutes)
 
-        if (now_utc - last_notif) < interval:
-            remaining = interval - (now_utc - last_notif)
-            logger.debug(
-                "Reminder: routine %r too soon (last_notif=%s, remaining=%s) — skipped.",
-                routine.name,
-                last_notif.isoformat(),
-                remaining,
-            )
-            return
-
-        # Per-recipient quiet-hours gate.
-        members = _get_routine_members(routine)
-        recipients = []
-        for member in members:
-            if routine.respect_quiet_hours:
-                try:
-                    member_tz = ZoneInfo(member.timezone)
-                except (ZoneInfoNotFoundError, ValueError):
-                    logger.warning(
-                        "Reminder: invalid timezone %r for user %s — skipping recipient.",
-                        member.timezone,
-                        member.id,
-                    )
-                    continue
-                member_local = now_utc.astimezone(member_tz).time()
-                if member.is_in_quiet_hours(member_local):
-                    logger.debug(
-                        "Reminder: user %s is in quiet hours — skipping recipient.",
-                        member.username,
-                    )
-                    continue
-            recipients.append(member)
-
-        if not recipients:
-            # All recipients in silence. Don't seal `last_reminder` —
-            # the next beat retries (5 min later) until someone emerges.
-            logger.debug(
-                "Reminder: routine %r — all recipients in quiet hours, cycle not sealed.",
-                routine.name,
-            )
-            return
-
-        next_due = routine.next_due_at()
-        if next_due:
-            hours_overdue = (now_utc - next_due).total_seconds() / 3600
-        else:
-            hours_overdue = (now_utc - state.last_due_notification).total_seconds() / 3600
-
-        for member in recipients:
-            notify_reminder(routine, hours_overdue=hours_overdue, target_user=member)
-        logger.info(
-            "Reminder sent for routine %r (%d/%d recipients, interval=%dmin, %.1fh overdue, last_notif=%s).",
+    if (now_utc - last_notif) < interval:
+        remaining = interval - (now_utc - last_notif)
+        logger.debug(
+            "Reminder: routine %r too soon (last_notif=%s, remaining=%s) — skipped.",
             routine.name,
-            len(recipients),
-            len(members),
-            routine.reminder_interval_minutes,
-            hours_overdue,
             last_notif.isoformat(),
+            remaining,
         )
+        if state.next_reminder_at is None:
+            # Rows from before `next_reminder_at` existed, or reset by a
+            # settings change: record the cadence so later beats skip it.
+            state.next_reminder_at = last_notif + interval
+            return True
+        return False
+
+    # Per-recipient quiet-hours gate.
+    members = _get_routine_members(routine)
+    recipients = []
+    wake_times = []
+    for member in members:
+        if routine.respect_quiet_hours:
+            try:
+                member_tz = ZoneInfo(member.timezone)
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.warning(
+                    "Reminder: invalid timezone %r for user %s — skipping recipient.",
+                    member.timezone,
+                    member.id,
+                )
+                continue
+            member_local = now_utc.astimezone(member_tz)
+            if member.is_in_quiet_hours(member_local.time()):
+                logger.debug(
+                    "Reminder: user %s is in quiet hours — skipping recipient.",
+                    member.username,
+                )
+                wake_times.append(member.quiet_hours_end_after(member_local))
+                continue
+        recipients.append(member)
+
+    if not recipients:
+        # All recipients in silence. Don't seal `last_reminder`; the
+        # routine is skipped until the first recipient's quiet hours end.
+        logger.debug(
+            "Reminder: routine %r — all recipients in quiet hours, cycle not sealed.",
+            routine.name,
+        )
+        if not wake_times:
+            return False
+        state.next_reminder_at = min(wake_times)
+        return True
+
+    next_due = routine.next_due_at()
+    if next_due:
+        hours_overdue = (now_utc - next_due).total_seconds() / 3600
+    else:
+        hours_overdue = (now_utc - state.last_due_notification).total_seconds() / 3600
+
+    for member in recipients:
+        notify_reminder(routine, hours_overdue=hours_overdue, target_user=member)
+    logger.info(
+        "Reminder sent for routine %r (%d/%d recipients, interval=%dmin, %.1fh overdue, last_notif=%s).",
+        routine.name,
+        len(recipients),
+        len(members),
+        routine.reminder_interval_minutes,
+        hours_overdue,
+        last_notif.isoformat(),
+    )
 
-        state.last_reminder = now_utc
-        state.save(update_fields=["last_reminder"])
+    state.last_reminder = now_utc
+    state.next_reminder_at = now_utc + interval
+    return True
@@ -1,23 +1,34 @@
+import json
+import threading
+import time
 from datetime import datetime, timedelta
 from unittest.mock import MagicMock, patch
 from zoneinfo import ZoneInfo
 
+from celery.exceptions import SoftTimeLimitExceeded
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from py_vapid import Vapid02
 from rest_framework.test import APITestCase
 
 from apps.routines.models import Routine, RoutineEntry, Stock
 
-from .models import NotificationState, PushSubscription
+from . import push
+from .models import NotificationState, PushOutbox, PushSubscription
 from .push import (
     TYPE_CONTACT_ADDED,
     TYPE_DAILY,
+    TYPE_DIGEST,
     TYPE_DUE,
     TYPE_REMINDER,
     TYPE_ROUTINE_SHARED,
     TYPE_STOCK_SHARED,
     TYPE_TEST,
+    dispatch_pushes,
     notify_contact_added,
     notify_daily_heads_up,
     notify_due,
@@ -25,19 +36,30 @@ from .push import (
     notify_routine_shared,
     notify_stock_shared,
     notify_test,
+    queue_pushes,
     send_push_notification,
 )
 from .tasks import (
     _check_daily_heads_up,
     _check_due_notification,
     _check_reminder,
-    _get_or_create_state,
+    _eta_key,
     _is_due_today,
+    _process_due_batch,
+    _shard_key,
     check_notifications,
+    check_notifications_shard,
+    drain_push_outbox,
+    notify_routine,
+    plan_notifications,
 )
 
 User = get_user_model()
 
+# A real (throwaway) P-256 key: pushes are signed before `webpush` is called,
+# so the key must parse even though `webpush` itself is mocked.
+TEST_VAPID_PRIVATE_KEY = "e1-PuRZLEnQeRUWqiSSdVzrMF_1N4s6L2GrxQ21GHWA"
+
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
@@ -69,6 +91,10 @@ def make_entry(routine, offset_hours=0):
     Both `created_at` and `client_created_at` are anchored to the same
     relative offset — post-T151 the functional time is never NULL and
     must track the user's action time, not the wall-clock at creation.
+
+    The backdating `update()` skips the post_save receiver, so the routine's
+    materialized `scheduled_due_at` is refreshed by hand — the worker selects
+    on it.
     """
     entry = RoutineEntry.objects.create(routine=routine)
     if offset_hours:
@@ -78,6 +104,7 @@ def make_entry(routine, offset_hours=0):
             client_created_at=target,
         )
         entry.refresh_from_db()
+        routine.refresh_schedule()
     return entry
 
 
@@ -268,7 +295,9 @@ class TestPushViewTest(APITestCase):
         response = self.client.post("/api/push/test/")
         self.assertEqual(response.status_code, 404)
 
-    @override_settings(VAPID_PRIVATE_KEY="priv", VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com")
+    @override_settings(
+        VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com"
+    )
     def test_sends_test_notification(self):
         make_subscription(self.user)
         with patch("apps.notifications.views.notify_test") as mock_notify:
@@ -297,10 +326,7 @@ class TestPushScheduledViewTest(APITestCase):
             mock_task.apply_async = MagicMock()
             response = self.client.post("/api/push/test/scheduled/")
         self.assertEqual(response.status_code, 202)
-        mock_task.apply_async.assert_called_once_with(
-            args=[self.user.id],
-            countdown=300,
-        )
+        mock_task.apply_async.assert_called_once_with((self.user.id,), countdown=300)
 
     def test_unauthenticated_returns_401(self):
         self.client.force_authenticate(user=None)
@@ -309,7 +335,9 @@ class TestPushScheduledViewTest(APITestCase):
 
 
 class SendScheduledTestTaskTest(TestCase):
-    @override_settings(VAPID_PRIVATE_KEY="priv", VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com")
+    @override_settings(
+        VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com"
+    )
     def test_calls_notify_test_for_existing_user(self):
         from .tasks import send_scheduled_test
 
@@ -340,9 +368,10 @@ class SendPushNoVapidTest(TestCase):
             mock_wp.assert_not_called()
 
 
-@override_settings(VAPID_PRIVATE_KEY="priv", VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com")
+@override_settings(VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", VAPID_CLAIMS_EMAIL="test@x.com")
 class SendPushNotificationTest(TestCase):
     def setUp(self):
+        cache.clear()  # per-origin backoff state
         self.user = make_user()
 
     def test_no_op_when_no_subscriptions(self):
@@ -408,6 +437,487 @@ class SendPushNotificationTest(TestCase):
         self.assertIsNotNone(sub.last_used)
 
 
+@override_settings(VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", PUSH_MAX_CONCURRENCY=4)
+class PushDispatchTest(TestCase):
+    def setUp(self):
+        cache.clear()  # per-origin backoff state
+        self.user = make_user()
+
+    def test_sends_concurrently(self):
+        for i in range(4):
+            make_subscription(self.user, endpoint=f"https://push.a.com/{i}")
+        barrier = threading.Barrier(4, timeout=5)
+        # Every call waits for the other three: only passes if all four are in flight at once.
+        with patch("apps.notifications.push.webpush", side_effect=lambda **kw: barrier.wait()):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        self.assertEqual(PushSubscription.objects.filter(last_used__isnull=False).count(), 4)
+
+    def test_reuses_one_session_per_origin(self):
+        make_subscription(self.user, endpoint="https://push.a.com/1")
+        make_subscription(self.user, endpoint="https://push.a.com/2")
+        make_subscription(self.user, endpoint="https://push.b.com/1")
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        sessions = {
+            c.kwargs["subscription_info"]["endpoint"]: c.kwargs["requests_session"] for c in mock_wp.call_args_list
+        }
+        self.assertIs(sessions["https://push.a.com/1"], sessions["https://push.a.com/2"])
+        self.assertIsNot(sessions["https://push.a.com/1"], sessions["https://push.b.com/1"])
+
+    def test_reports_per_delivery_results(self):
+        from pywebpush import WebPushException
+
+        from .push import PushDelivery
+
+        ok = make_subscription(self.user, endpoint="https://push.a.com/ok")
+        gone = make_subscription(self.user, endpoint="https://push.a.com/gone")
+
+        def fake_webpush(subscription_info, **kwargs):
+            if subscription_info["endpoint"].endswith("gone"):
+                raise WebPushException("gone", response=MagicMock(status_code=410))
+
+        deliveries = [PushDelivery(subscription=sub, user=self.user, payload="{}", type=TYPE_DUE) for sub in (ok, gone)]
+        with patch("apps.notifications.push.webpush", side_effect=fake_webpush):
+            ok_result, gone_result = dispatch_pushes(deliveries)
+        self.assertTrue(ok_result.delivered)
+        self.assertFalse(gone_result.delivered)
+        self.assertTrue(gone_result.gone)
+
+    def test_network_error_keeps_subscription(self):
+        import requests
+
+        sub = make_subscription(self.user)
+        with patch("apps.notifications.push.webpush", side_effect=requests.ConnectionError("refused")):
+            with self.assertLogs("apps.notifications.push", level="ERROR"):
+                send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        self.assertTrue(PushSubscription.objects.filter(pk=sub.pk).exists())
+
+    def test_vapid_header_signed_once_per_origin(self):
+        make_subscription(self.user, endpoint="https://push.a.com/1")
+        make_subscription(self.user, endpoint="https://push.a.com/2")
+        make_subscription(self.user, endpoint="https://push.b.com/1")
+        push._vapid_headers.clear()
+        with (
+            patch("apps.notifications.push.webpush") as mock_wp,
+            patch.object(
+                Vapid02, "sign", autospec=True, side_effect=lambda key, claims: {"Authorization": claims["aud"]}
+            ) as mock_sign,
+        ):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        self.assertEqual(
+            sorted(c.args[1]["aud"] for c in mock_sign.call_args_list), ["https://push.a.com", "https://push.b.com"]
+        )
+        for c in mock_wp.call_args_list:
+            endpoint = c.kwargs["subscription_info"]["endpoint"]
+            self.assertTrue(endpoint.startswith(c.kwargs["headers"]["Authorization"]))
+            self.assertNotIn("vapid_private_key", c.kwargs)
+
+    def test_vapid_header_resigned_after_reuse_window(self):
+        make_subscription(self.user)
+        push._vapid_headers.clear()
+        with patch("apps.notifications.push.webpush"), patch.object(Vapid02, "sign", return_value={}) as mock_sign:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+            with patch("apps.notifications.push.time.time", return_value=time.time() + push.VAPID_REUSE_SECONDS + 1):
+                send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        self.assertEqual(mock_sign.call_count, 2)
+
+    def test_vapid_token_outlives_reuse_window(self):
+        push._vapid_headers.clear()
+        with patch.object(Vapid02, "sign", return_value={}) as mock_sign:
+            push._vapid_headers_for("https://push.a.com/1")
+        exp = mock_sign.call_args.args[0]["exp"]
+        self.assertGreater(exp - time.time(), push.VAPID_REUSE_SECONDS)
+
+    def test_reminder_carries_routine_topic_and_ttl(self):
+        make_subscription(self.user)
+        routine = make_routine(self.user)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            notify_reminder(routine, hours_overdue=2)
+        kwargs = mock_wp.call_args.kwargs
+        self.assertEqual(kwargs["headers"]["Topic"], f"reminder-{routine.id}")
+        self.assertEqual(kwargs["ttl"], push.PUSH_TTL_SECONDS[TYPE_REMINDER])
+
+    def test_due_topic_differs_from_reminder_topic(self):
+        make_subscription(self.user)
+        routine = make_routine(self.user)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            notify_due(routine)
+        self.assertEqual(mock_wp.call_args.kwargs["headers"]["Topic"], f"due-{routine.id}")
+        self.assertEqual(mock_wp.call_args.kwargs["ttl"], push.PUSH_TTL_SECONDS[TYPE_DUE])
+
+    def test_untyped_push_has_no_topic_and_default_ttl(self):
+        make_subscription(self.user)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_CONTACT_ADDED)
+        self.assertNotIn("Topic", mock_wp.call_args.kwargs["headers"])
+        self.assertEqual(mock_wp.call_args.kwargs["ttl"], push.DEFAULT_PUSH_TTL_SECONDS)
+
+    def test_topics_fit_web_push_limit(self):
+        for topic in (push._topic(TYPE_DUE, 2**63 - 1), push._topic(TYPE_REMINDER, 2**63 - 1), push._topic(TYPE_DAILY)):
+            self.assertLessEqual(len(topic), 32)
+            self.assertRegex(topic, r"^[A-Za-z0-9_-]+$")
+
+    def _throttle(self, retry_after="120"):
+        from pywebpush import WebPushException
+
+        response = MagicMock(status_code=429, headers={"Retry-After": retry_after})
+        return WebPushException("slow down", response=response)
+
+    def test_429_blocks_origin_for_retry_after(self):
+        make_subscription(self.user, endpoint="https://push.a.com/1")
+        other = make_subscription(make_user(username="other"), endpoint="https://push.b.com/1")
+        with patch("apps.notifications.push.webpush", side_effect=self._throttle()):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+            send_push_notification(other.user, title="T", body="B", type=TYPE_DUE)
+        # Only the unthrottled origin was contacted.
+        mock_wp.assert_called_once()
+        self.assertEqual(mock_wp.call_args.kwargs["subscription_info"]["endpoint"], "https://push.b.com/1")
+
+    def test_throttled_direct_push_deferred_to_outbox(self):
+        sub = make_subscription(self.user, endpoint="https://push.a.com/1")
+        with patch("apps.notifications.push.webpush", side_effect=self._throttle("120")):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        row = PushOutbox.objects.get(subscription=sub)
+        wait = (row.available_at - timezone.now()).total_seconds()
+        self.assertTrue(110 < wait <= 120, wait)
+        self.assertTrue(PushSubscription.objects.filter(pk=sub.pk).exists())
+
+    def test_retry_after_http_date(self):
+        when = timezone.now() + timedelta(minutes=10)
+        response = MagicMock(headers={"Retry-After": when.strftime("%a, %d %b %Y %H:%M:%S GMT")})
+        self.assertAlmostEqual(push._retry_after_seconds(response), 600, delta=2)
+        self.assertEqual(push._retry_after_seconds(MagicMock(headers={})), push.BACKOFF_BASE_SECONDS)
+        self.assertEqual(
+            push._retry_after_seconds(MagicMock(headers={"Retry-After": "999999"})), push.BACKOFF_MAX_SECONDS
+        )
+
+    def test_consecutive_server_errors_open_breaker(self):
+        make_subscription(self.user, endpoint="https://push.a.com/1")
+        from pywebpush import WebPushException
+
+        error = WebPushException("boom", response=MagicMock(status_code=503, headers={}))
+        with (
+            patch("apps.notifications.push.webpush", side_effect=error),
+            self.assertLogs("apps.notifications.push", level="ERROR"),
+        ):
+            for _ in range(push.BREAKER_THRESHOLD):
+                send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        mock_wp.assert_not_called()
+
+    def test_every_failure_in_a_batch_counts_toward_breaker(self):
+        from .push import PushDelivery, PushResult
+
+        subs = [make_subscription(self.user, endpoint=f"https://push.a.com/{i}") for i in range(6)]
+        deliveries = [PushDelivery(subscription=sub, user=self.user, payload="{}", type=TYPE_DUE) for sub in subs]
+
+        def deliver(delivery):
+            # One success among BREAKER_THRESHOLD failures to the same origin.
+            if delivery.subscription == subs[0]:
+                return PushResult(delivery)
+            return PushResult(delivery, status_code=503, error="boom")
+
+        with patch("apps.notifications.push._deliver", side_effect=deliver):
+            dispatch_pushes(deliveries)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            dispatch_pushes(deliveries[:1])
+        mock_wp.assert_not_called()
+
+    def test_success_resets_failure_count(self):
+        make_subscription(self.user, endpoint="https://push.a.com/1")
+        from pywebpush import WebPushException
+
+        error = WebPushException("boom", response=MagicMock(status_code=503, headers={}))
+        with self.assertLogs("apps.notifications.push", level="ERROR"):
+            for _ in range(push.BREAKER_THRESHOLD - 1):
+                with patch("apps.notifications.push.webpush", side_effect=error):
+                    send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        with patch("apps.notifications.push.webpush"):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        with (
+            patch("apps.notifications.push.webpush", side_effect=error),
+            self.assertLogs("apps.notifications.push", level="ERROR"),
+        ):
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+        mock_wp.assert_called_once()
+
+    def test_uses_preloaded_subscriptions(self):
+        sub = make_subscription(self.user)
+        with patch("apps.notifications.push.webpush") as mock_wp, self.assertNumQueries(1):
+            # Only the last_used UPDATE: no subscription lookup.
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE, subscriptions=[sub])
+        mock_wp.assert_called_once()
+
+    def test_uses_prefetched_subscriptions(self):
+        make_subscription(self.user)
+        user = User.objects.prefetch_related("push_subscriptions").get(pk=self.user.pk)
+        with patch("apps.notifications.push.webpush") as mock_wp, self.assertNumQueries(1):
+            send_push_notification(user, title="T", body="B", type=TYPE_DUE)
+        mock_wp.assert_called_once()
+
+    def test_queue_pushes_writes_outbox_instead_of_sending(self):
+        make_subscription(self.user)
+        other = make_user(username="other")
+        make_subscription(other, endpoint="https://push.a.com/other")
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            with queue_pushes():
+                send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+                send_push_notification(other, title="T", body="B", type=TYPE_DUE)
+                self.assertFalse(PushOutbox.objects.exists())
+        mock_wp.assert_not_called()
+        self.assertEqual(PushOutbox.objects.filter(status=PushOutbox.STATUS_PENDING, type=TYPE_DUE).count(), 2)
+
+    def test_queue_pushes_discards_batch_on_error(self):
+        make_subscription(self.user)
+        with self.assertRaises(RuntimeError), queue_pushes():
+            send_push_notification(self.user, title="T", body="B", type=TYPE_DUE)
+            raise RuntimeError
+        self.assertFalse(PushOutbox.objects.exists())
+
+
+@override_settings(VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", PUSH_OUTBOX_MAX_ATTEMPTS=3)
+class DrainPushOutboxTest(TestCase):
+    def setUp(self):
+        cache.clear()  # per-origin backoff state
+        self.user = make_user()
+        self.sub = make_subscription(self.user)
+
+    def _queue(self, **kwargs):
+        return PushOutbox.objects.create(subscription=self.sub, type=TYPE_DUE, payload="{}", **kwargs)
+
+    def _failure(self, status_code):
+        from pywebpush import WebPushException
+
+        return WebPushException("failed", response=MagicMock(status_code=status_code))
+
+    def test_delivers_and_deletes_rows(self):
+        self._queue()
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_called_once()
+        self.assertEqual(mock_wp.call_args.kwargs["data"], "{}")
+        self.assertFalse(PushOutbox.objects.exists())
+
+    def test_skips_rows_not_yet_available(self):
+        self._queue(available_at=timezone.now() + timedelta(minutes=5))
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_not_called()
+        self.assertTrue(PushOutbox.objects.exists())
+
+    def test_failure_schedules_retry_with_backoff(self):
+        row = self._queue()
+        with (
+            patch("apps.notifications.push.webpush", side_effect=self._failure(500)),
+            self.assertLogs("apps.notifications.push", level="ERROR"),
+        ):
+            drain_push_outbox()
+        row.refresh_from_db()
+        self.assertEqual(row.status, PushOutbox.STATUS_PENDING)
+        self.assertEqual(row.attempts, 1)
+        self.assertGreater(row.available_at, timezone.now() + timedelta(seconds=30))
+        self.assertIn("failed", row.last_error)
+
+    def test_throttled_origin_defers_rows_without_charging_attempts(self):
+        row = self._queue()
+        cache.set("push:backoff:https://example.com", timezone.now() + timedelta(minutes=3), timeout=180)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_not_called()
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, 0)
+        self.assertEqual(row.status, PushOutbox.STATUS_PENDING)
+        self.assertGreater(row.available_at, timezone.now() + timedelta(minutes=2))
+
+    def test_429_reschedules_row_at_retry_after(self):
+        from pywebpush import WebPushException
+
+        row = self._queue()
+        error = WebPushException("slow", response=MagicMock(status_code=429, headers={"Retry-After": "600"}))
+        with patch("apps.notifications.push.webpush", side_effect=error):
+            drain_push_outbox()
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, 1)
+        self.assertGreater(row.available_at, timezone.now() + timedelta(minutes=9))
+
+    def test_subscription_writes_flushed_once_per_run(self):
+        from pywebpush import WebPushException
+
+        gone = make_subscription(self.user, endpoint="https://push.b.com/gone")
+        for i in range(3):
+            self._queue()
+        PushOutbox.objects.create(subscription=gone, type=TYPE_TEST, payload="{}")
+
+        def fake_webpush(subscription_info, **kwargs):
+            if subscription_info["endpoint"].endswith("gone"):
+                raise WebPushException("gone", response=MagicMock(status_code=410))
+
+        with (
+            patch("apps.notifications.tasks.OUTBOX_BATCH_SIZE", 2),
+            patch("apps.notifications.push.webpush", side_effect=fake_webpush),
+            CaptureQueriesContext(connection) as queries,
+        ):
+            drain_push_outbox()
+        writes = [q["sql"] for q in queries if 'UPDATE "notifications_pushsubscription"' in q["sql"]]
+        self.assertEqual(len(writes), 1)
+        self.assertFalse(PushSubscription.objects.filter(pk=gone.pk).exists())
+        self.assertFalse(PushOutbox.objects.exists())
+        self.sub.refresh_from_db()
+        self.assertIsNotNone(self.sub.last_used)
+
+    def test_backoff_doubles_per_attempt(self):
+        from .tasks import _outbox_backoff
+
+        self.assertEqual(_outbox_backoff(1), timedelta(minutes=1))
+        self.assertEqual(_outbox_backoff(3), timedelta(minutes=4))
+        self.assertEqual(_outbox_backoff(20), timedelta(hours=1))
+
+    def test_marks_row_dead_after_max_attempts(self):
+        row = self._queue(attempts=2)
+        with (
+            patch("apps.notifications.push.webpush", side_effect=self._failure(500)),
+            self.assertLogs("apps.notifications.push", level="ERROR"),
+        ):
+            drain_push_outbox()
+        row.refresh_from_db()
+        self.assertEqual(row.status, PushOutbox.STATUS_DEAD)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_not_called()
+
+    def test_gone_subscription_removed_with_its_rows(self):
+        self._queue()
+        with patch("apps.notifications.push.webpush", side_effect=self._failure(410)):
+            drain_push_outbox()
+        self.assertFalse(PushSubscription.objects.filter(pk=self.sub.pk).exists())
+        self.assertFalse(PushOutbox.objects.exists())
+
+    def test_coalesces_due_and_reminder_rows_per_device(self):
+        first = make_routine(self.user, name="Pills")
+        second = make_routine(self.user, name="Plants")
+        with queue_pushes():
+            notify_due(first)
+            notify_reminder(second, hours_overdue=3)
+            notify_reminder(first, hours_overdue=2)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_called_once()
+        payload = json.loads(mock_wp.call_args.kwargs["data"])
+        self.assertEqual(payload["type"], TYPE_DIGEST)
+        self.assertEqual(payload["title"], "2 tasks need attention")
+        self.assertEqual(payload["body"], "Pills, Plants")
+        self.assertEqual(payload["data"]["routine_ids"], [first.id, second.id])
+        self.assertFalse(PushOutbox.objects.exists())
+
+    def test_outbox_keeps_topic_and_digest_uses_its_own(self):
+        first = make_routine(self.user, name="A")
+        with queue_pushes():
+            notify_reminder(first, hours_overdue=2)
+        row = PushOutbox.objects.get()
+        self.assertEqual(row.topic, f"reminder-{first.id}")
+        with queue_pushes():
+            notify_due(make_routine(self.user, name="B"))
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        topic = mock_wp.call_args.kwargs["headers"]["Topic"]
+        self.assertEqual(topic, f"{TYPE_DIGEST}-{row.id}")
+        self.assertEqual(mock_wp.call_args.kwargs["ttl"], push.PUSH_TTL_SECONDS[TYPE_DIGEST])
+        payload = json.loads(mock_wp.call_args.kwargs["data"])
+        self.assertEqual(payload["tag"], topic)
+        self.assertEqual([action["action"] for action in payload["actions"]], ["dismiss"])
+
+    def test_each_digest_gets_its_own_topic(self):
+        topics = []
+        for names in (("A", "B"), ("C", "D")):
+            with queue_pushes():
+                for name in names:
+                    notify_due(make_routine(self.user, name=name))
+            with patch("apps.notifications.push.webpush") as mock_wp:
+                drain_push_outbox()
+            topics.append(mock_wp.call_args.kwargs["headers"]["Topic"])
+        self.assertNotEqual(topics[0], topics[1])
+
+    def test_batch_limit_does_not_split_a_digest(self):
+        with queue_pushes():
+            notify_due(make_routine(self.user, name="Pills"))
+            notify_daily_heads_up(self.user, due_count=2, names=["Pills", "Plants"])
+            notify_due(make_routine(self.user, name="Plants"))
+        with (
+            patch("apps.notifications.tasks.OUTBOX_BATCH_SIZE", 2),
+            patch("apps.notifications.push.webpush") as mock_wp,
+        ):
+            drain_push_outbox()
+        types = [json.loads(call.kwargs["data"])["type"] for call in mock_wp.call_args_list]
+        self.assertCountEqual(types, [TYPE_DIGEST, TYPE_DAILY])
+        self.assertFalse(PushOutbox.objects.exists())
+
+    def test_single_routine_keeps_its_own_payload(self):
+        routine = make_routine(self.user, name="Pills")
+        with queue_pushes():
+            notify_due(routine)
+            notify_reminder(routine, hours_overdue=2)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_called_once()
+        self.assertEqual(json.loads(mock_wp.call_args.kwargs["data"])["type"], TYPE_REMINDER)
+
+    def test_other_types_are_not_coalesced(self):
+        with queue_pushes():
+            notify_daily_heads_up(self.user, due_count=2, names=["A", "B"])
+            notify_due(make_routine(self.user, name="Pills"))
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        self.assertEqual(mock_wp.call_count, 2)
+
+    def test_coalesced_failure_retries_every_row(self):
+        with queue_pushes():
+            notify_due(make_routine(self.user, name="A"))
+            notify_due(make_routine(self.user, name="B"))
+        with (
+            patch("apps.notifications.push.webpush", side_effect=self._failure(500)),
+            self.assertLogs("apps.notifications.push", level="ERROR"),
+        ):
+            drain_push_outbox()
+        self.assertEqual(PushOutbox.objects.filter(status=PushOutbox.STATUS_PENDING, attempts=1).count(), 2)
+
+    def test_digest_user_pushes_held_until_next_hour(self):
+        User.objects.filter(pk=self.user.pk).update(notification_digest=True)
+        self.user.refresh_from_db()
+        routine = make_routine(self.user, name="Pills")
+        with queue_pushes():
+            notify_due(routine)
+            notify_daily_heads_up(self.user, due_count=1, names=["Pills"])
+        held = PushOutbox.objects.get(type=TYPE_DUE)
+        self.assertEqual((held.available_at.minute, held.available_at.second), (0, 0))
+        self.assertGreater(held.available_at, timezone.now())
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        # Only the heads-up goes out now; the due push waits for the digest.
+        mock_wp.assert_called_once()
+        self.assertEqual(json.loads(mock_wp.call_args.kwargs["data"])["type"], TYPE_DAILY)
+        self.assertTrue(PushOutbox.objects.filter(pk=held.pk).exists())
+
+    def test_worker_queues_inside_transaction_and_drains_after(self):
+        # Keep the heads-up window shut so only the due push is queued.
+        self.user.daily_notification_time = (timezone.now() + timedelta(hours=12)).time()
+        self.user.save()
+        routine = make_routine(self.user, interval_hours=1)
+        make_entry(routine, offset_hours=-2)
+        with patch("apps.notifications.tasks.drain_push_outbox.delay") as mock_drain:
+            check_notifications()
+        mock_drain.assert_called_once()
+        self.assertEqual(PushOutbox.objects.filter(type=TYPE_DUE).count(), 1)
+        with patch("apps.notifications.push.webpush") as mock_wp:
+            drain_push_outbox()
+        mock_wp.assert_called_once()
+
+
 # ── push helpers ──────────────────────────────────────────────────────────────
 
 
@@ -514,20 +1024,12 @@ class PushHelperTest(TestCase):
 # ── tasks helpers ─────────────────────────────────────────────────────────────
 
 
-class GetOrCreateStateTest(TestCase):
-    def test_creates_state_if_not_exists(self):
-        user = make_user()
-        routine = make_routine(user)
-        state = _get_or_create_state(routine)
-        self.assertIsNotNone(state)
-        self.assertEqual(state.routine, routine)
-
-    def test_returns_existing_state(self):
-        user = make_user()
-        routine = make_routine(user)
-        existing = NotificationState.objects.create(routine=routine)
-        state = _get_or_create_state(routine)
-        self.assertEqual(state.pk, existing.pk)
+def run_check(check, routine, now):
+    """Run `_check_due_notification` or `_check_reminder` on one routine the
+    way `_process_due_batch` does: on its state row, saved if it changed."""
+    state, _ = NotificationState.objects.get_or_create(routine=routine)
+    if check(routine, now, state):
+        state.save()
 
 
 class IsDueTodayTest(TestCase):
@@ -712,7 +1214,7 @@ class CheckDueNotificationTest(TestCase):
         make_entry(routine)  # just now → not due yet
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
             mock_notify.assert_not_called()
 
     def test_sends_when_overdue_and_never_notified(self):
@@ -720,7 +1222,7 @@ class CheckDueNotificationTest(TestCase):
         make_entry(routine, offset_hours=-2)  # overdue
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
             mock_notify.assert_called_once_with(routine, target_user=self.user)
 
     def test_does_not_repeat_for_same_cycle(self):
@@ -733,7 +1235,7 @@ class CheckDueNotificationTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
             mock_notify.assert_not_called()
 
     def test_resends_after_new_entry(self):
@@ -748,7 +1250,7 @@ class CheckDueNotificationTest(TestCase):
         make_entry(routine, offset_hours=-2)
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
             mock_notify.assert_called_once()
 
     def test_does_not_repeat_when_never_logged_and_already_notified(self):
@@ -761,7 +1263,7 @@ class CheckDueNotificationTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
             mock_notify.assert_not_called()
 
     def test_updates_state_after_sending(self):
@@ -769,7 +1271,7 @@ class CheckDueNotificationTest(TestCase):
         make_entry(routine, offset_hours=-2)
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due"):
-            _check_due_notification(routine, now)
+            run_check(_check_due_notification, routine, now)
         state = NotificationState.objects.get(routine=routine)
         self.assertIsNotNone(state.last_due_notification)
 
@@ -783,7 +1285,7 @@ class CheckReminderTest(TestCase):
         make_entry(routine)
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             mock_notify.assert_not_called()
 
     def test_does_not_send_when_no_due_notification_yet(self):
@@ -792,7 +1294,7 @@ class CheckReminderTest(TestCase):
         # No NotificationState → no last_due_notification
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             mock_notify.assert_not_called()
 
     def test_does_not_send_when_interval_not_elapsed(self):
@@ -805,7 +1307,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             mock_notify.assert_not_called()
 
     def test_sends_when_8h_elapsed_since_due_notification(self):
@@ -817,7 +1319,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             mock_notify.assert_called_once()
 
     def test_uses_last_reminder_for_interval_if_set(self):
@@ -831,7 +1333,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             mock_notify.assert_not_called()
 
     def test_updates_last_reminder_after_sending(self):
@@ -843,7 +1345,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder"):
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
         state = NotificationState.objects.get(routine=routine)
         self.assertIsNotNone(state.last_reminder)
 
@@ -857,7 +1359,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             _, kwargs = mock_notify.call_args
             self.assertAlmostEqual(kwargs["hours_overdue"], 4, delta=0.1)
 
@@ -872,7 +1374,7 @@ class CheckReminderTest(TestCase):
         )
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, now)
+            run_check(_check_reminder, routine, now)
             _, kwargs = mock_notify.call_args
             self.assertGreater(kwargs["hours_overdue"], 0)
 
@@ -938,7 +1440,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
         user = make_user()
         routine = self._make_overdue_routine(user, mode="daily")
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, timezone.now())
+            run_check(_check_reminder, routine, timezone.now())
             mock_notify.assert_not_called()
 
     # ── 2 & 3 & 4: interval_minutes drives cadence ──
@@ -951,7 +1453,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
             last_reminder_offset_hours=-0.5,  # 30 min ago
         )
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, timezone.now())
+            run_check(_check_reminder, routine, timezone.now())
             mock_notify.assert_not_called()
 
     def test_60min_cadence_fires_after_70_minutes(self):
@@ -962,7 +1464,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
             last_reminder_offset_hours=-(70 / 60),  # 70 min ago
         )
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, timezone.now())
+            run_check(_check_reminder, routine, timezone.now())
             mock_notify.assert_called_once()
         state = NotificationState.objects.get(routine=routine)
         self.assertIsNotNone(state.last_reminder)
@@ -975,7 +1477,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
             last_reminder_offset_hours=-9,
         )
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(routine, timezone.now())
+            run_check(_check_reminder, routine, timezone.now())
             mock_notify.assert_called_once()
 
     # ── 5: respect=True + owner in quiet hours → no fire, no seal ──
@@ -993,7 +1495,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
                 last_reminder_offset_hours=-2,
             )
             with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-                _check_reminder(routine, timezone.now())
+                run_check(_check_reminder, routine, timezone.now())
                 mock_notify.assert_not_called()
             state = NotificationState.objects.get(routine=routine)
             # last_reminder unchanged: still 2h before FROZEN_NOW, not sealed.
@@ -1014,7 +1516,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
                 last_reminder_offset_hours=-2,
             )
             with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-                _check_reminder(routine, timezone.now())
+                run_check(_check_reminder, routine, timezone.now())
                 mock_notify.assert_called_once()
 
     # ── 7: shared routine, owner silent, shared user outside silence ──
@@ -1037,7 +1539,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
             routine.shared_with.add(shared)
 
             with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-                _check_reminder(routine, timezone.now())
+                run_check(_check_reminder, routine, timezone.now())
                 self.assertEqual(mock_notify.call_count, 1)
                 _, kwargs = mock_notify.call_args
                 self.assertEqual(kwargs["target_user"], shared)
@@ -1067,7 +1569,7 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
             original_last_reminder = NotificationState.objects.get(routine=routine).last_reminder
 
             with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-                _check_reminder(routine, timezone.now())
+                run_check(_check_reminder, routine, timezone.now())
                 mock_notify.assert_not_called()
             state = NotificationState.objects.get(routine=routine)
             self.assertEqual(
@@ -1082,13 +1584,88 @@ class CheckReminderCadenceAndQuietHoursTest(TestCase):
         shared.save()
         with patch("django.utils.timezone.now", return_value=beat2):
             with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-                _check_reminder(routine, timezone.now())
+                run_check(_check_reminder, routine, timezone.now())
                 self.assertEqual(mock_notify.call_count, 1)
                 _, kwargs = mock_notify.call_args
                 self.assertEqual(kwargs["target_user"], shared)
             state.refresh_from_db()
             self.assertGreaterEqual(state.last_reminder, beat2 - timedelta(seconds=1))
 
+    # ── next_reminder_at: skip routines until a reminder may fire ──
+
+    def test_all_silent_sets_next_reminder_at_to_first_wake_up(self):
+        with patch("django.utils.timezone.now", return_value=self.FROZEN_NOW):
+            owner = make_user(username="night-owner", tz="Europe/Madrid")
+            owner.quiet_hours_enabled = True
+            owner.save()
+            shared = make_user(username="night-shared", tz="Europe/Madrid")
+            shared.quiet_hours_enabled = True
+            shared.quiet_hours_end = datetime(2026, 1, 15, 6, 0).time()
+            shared.save()
+            routine = self._make_overdue_routine(owner, interval_minutes=60, last_reminder_offset_hours=-2)
+            routine.shared_with.add(shared)
+            with patch("apps.notifications.tasks.notify_reminder"):
+                run_check(_check_reminder, routine, timezone.now())
+        state = NotificationState.objects.get(routine=routine)
+        # 06:00 Madrid (UTC+1) = 05:00 UTC, the earlier of the two wake-ups.
+        self.assertEqual(state.next_reminder_at, datetime(2026, 1, 15, 5, 0, tzinfo=ZoneInfo("UTC")))
+
+    def test_sent_reminder_sets_next_reminder_at_to_interval(self):
+        with patch("django.utils.timezone.now", return_value=self.FROZEN_NOW):
+            routine = self._make_overdue_routine(make_user(), interval_minutes=60, last_reminder_offset_hours=-2)
+            with patch("apps.notifications.tasks.notify_reminder"):
+                run_check(_check_reminder, routine, timezone.now())
+        state = NotificationState.objects.get(routine=routine)
+        self.assertEqual(state.next_reminder_at, self.FROZEN_NOW + timedelta(minutes=60))
+
+    def test_too_soon_records_cadence(self):
+        with patch("django.utils.timezone.now", return_value=self.FROZEN_NOW):
+            routine = self._make_overdue_routine(make_user(), interval_minutes=60, last_reminder_offset_hours=-0.5)
+            with patch("apps.notifications.tasks.notify_reminder"):
+                run_check(_check_reminder, routine, timezone.now())
+        state = NotificationState.objects.get(routine=routine)
+        self.assertEqual(state.next_reminder_at, state.last_reminder + timedelta(minutes=60))
+
+    def test_beat_skips_routine_until_next_reminder_at(self):
+        with patch("django.utils.timezone.now", return_value=self.FROZEN_NOW):
+            owner = make_user(username="skipped")
+            make_subscription(owner)
+            routine = self._make_overdue_routine(owner, last_due_offset_hours=-0.5)
+            NotificationState.objects.filter(routine=routine).update(
+                next_reminder_at=self.FROZEN_NOW + timedelta(hours=4)
+            )
+            with patch("apps.notifications.tasks._check_reminder") as mock_check:
+                check_notifications_shard(0, 1)
+            mock_check.assert_not_called()
+
+    def test_beat_evaluates_skipped_routine_in_new_due_cycle(self):
+        with patch("django.utils.timezone.now", return_value=self.FROZEN_NOW):
+            owner = make_user(username="new-cycle")
+            make_subscription(owner)
+            routine = self._make_overdue_routine(owner, last_due_offset_hours=-3)
+            NotificationState.objects.filter(routine=routine).update(
+                next_reminder_at=self.FROZEN_NOW + timedelta(hours=4)
+            )
+            with patch("apps.notifications.tasks.notify_due") as mock_due:
+                check_notifications_shard(0, 1)
+            mock_due.assert_called_once()
+
+    def test_settings_changes_reset_next_reminder_at(self):
+        owner = make_user(username="reset")
+        routine = self._make_overdue_routine(owner)
+        later = timezone.now() + timedelta(hours=4)
+        NotificationState.objects.filter(routine=routine).update(next_reminder_at=later)
+        owner.save(update_fields=["last_login"])
+        self.assertEqual(NotificationState.objects.get(routine=routine).next_reminder_at, later)
+        owner.quiet_hours_enabled = True
+        owner.save()
+        self.assertIsNone(NotificationState.objects.get(routine=routine).next_reminder_at)
+
+        NotificationState.objects.filter(routine=routine).update(next_reminder_at=later)
+        routine.reminder_interval_minutes = 60
+        routine.save()
+        self.assertIsNone(NotificationState.objects.get(routine=routine).next_reminder_at)
+
 
 # ── check_notifications Celery task ──────────────────────────────────────────
 
@@ -1144,6 +1721,434 @@ class CheckNotificationsTaskTest(TestCase):
             check_notifications()
             mock_due.assert_called_once()
 
+    def test_only_loads_routines_whose_due_time_has_passed(self):
+        user = make_user(username="scoped")
+        make_subscription(user)
+        overdue = make_routine(user, name="Overdue", interval_hours=1)
+        make_entry(overdue, offset_hours=-2)
+        later = make_routine(user, name="Later", interval_hours=100)
+        make_entry(later, offset_hours=-1)
+        with (
+            patch("apps.notifications.tasks._check_due_notification") as mock_due,
+            patch("apps.notifications.tasks._check_reminder"),
+        ):
+            check_notifications()
+        self.assertEqual([c.args[0].pk for c in mock_due.call_args_list], [overdue.pk])
+
+    def test_phased_routine_due_time_uses_entry_count(self):
+        """The worker's bounded entry stats still drive phase-based schedules."""
+        user = make_user(username="phased")
+        make_subscription(user)
+        routine = make_routine(user, interval_hours=1)
+        routine.interval_phases = [{"count": 1, "interval_hours": 1}, {"interval_hours": 100}]
+        routine.save()
+        make_entry(routine, offset_hours=-5)
+        make_entry(routine, offset_hours=-3)
+        # Two entries → second phase (100h): due far in the future, not overdue.
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            check_notifications()
+        mock_due.assert_not_called()
+
+    def test_shared_routine_processed_once(self):
+        owner = make_user(username="owner_once")
+        member = make_user(username="member_once")
+        make_subscription(owner, endpoint="https://example.com/push/o")
+        make_subscription(member, endpoint="https://example.com/push/m")
+        routine = make_routine(owner, interval_hours=1)
+        routine.shared_with.add(member)
+        with (
+            patch("apps.notifications.tasks._check_due_notification") as mock_due,
+            patch("apps.notifications.tasks._check_reminder"),
+        ):
+            check_notifications()
+        self.assertEqual(mock_due.call_count, 1)
+
+    def test_creates_missing_states_and_records_due(self):
+        user = make_user(username="bulk_state")
+        make_subscription(user)
+        routines = [make_routine(user, name=f"R{i}", interval_hours=1) for i in range(3)]
+        with patch("apps.notifications.tasks.notify_due"):
+            check_notifications()
+        states = NotificationState.objects.filter(routine__in=routines)
+        self.assertEqual(states.count(), 3)
+        self.assertTrue(all(s.last_due_notification for s in states))
+
+    @override_settings(NOTIFICATION_SHARDS=1)
+    def test_batch_state_handling_uses_constant_queries(self):
+        """Loading, locking and writing states must not grow with the batch."""
+        user = make_user(username="bulk_queries", daily_time=(timezone.now() + timedelta(hours=12)).strftime("%H:%M"))
+        make_subscription(user)
+        for i in range(2):
+            make_routine(user, name=f"A{i}", interval_hours=1)
+        with patch("apps.notifications.tasks.notify_due"), CaptureQueriesContext(connection) as small:
+            check_notifications()
+        for i in range(6):
+            make_routine(user, name=f"B{i}", interval_hours=1)
+        NotificationState.objects.all().delete()
+        with patch("apps.notifications.tasks.notify_due"), CaptureQueriesContext(connection) as large:
+            check_notifications()
+        self.assertEqual(len(small), len(large))
+
+    @override_settings(VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY="pub", NOTIFICATION_SHARDS=1)
+    def test_push_path_queries_do_not_grow_with_recipients(self):
+        """Subscriptions are prefetched; last_used is written once per drain.
+
+        One shard: each shard's queries are constant, and households would
+        otherwise land in different shards."""
+        cache.clear()
+        far_from_now = (timezone.now() + timedelta(hours=12)).strftime("%H:%M")
+
+        def household(name):
+            owner = make_user(username=f"{name}_owner", daily_time=far_from_now)
+            member = make_user(username=f"{name}_member", daily_time=far_from_now)
+            make_subscription(owner, endpoint=f"https://example.com/push/{name}/o")
+            make_subscription(member, endpoint=f"https://example.com/push/{name}/m")
+            routine = make_routine(owner, name=name, interval_hours=1)
+            routine.shared_with.add(member)
+
+        household("a")
+        with patch("apps.notifications.push.webpush") as mock_wp, CaptureQueriesContext(connection) as small:
+            check_notifications()
+        self.assertEqual(mock_wp.call_count, 2)
+        for name in ("b", "c", "d"):
+            household(name)
+        NotificationState.objects.all().delete()
+        with patch("apps.notifications.push.webpush") as mock_wp, CaptureQueriesContext(connection) as large:
+            check_notifications()
+        self.assertEqual(mock_wp.call_count, 8)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(PushSubscription.objects.filter(last_used__isnull=False).count(), 8)
+
+    def test_routines_locked_elsewhere_are_skipped(self):
+        user = make_user(username="bulk_skip", daily_time=(timezone.now() + timedelta(hours=12)).strftime("%H:%M"))
+        make_subscription(user)
+        routine = make_routine(user, interval_hours=1)
+        with (
+            patch("apps.notifications.tasks._lock_states", return_value={}),
+            patch("apps.notifications.tasks.notify_due") as mock_due,
+        ):
+            check_notifications()
+        mock_due.assert_not_called()
+        self.assertIsNone(NotificationState.objects.get(routine=routine).last_due_notification)
+
+
+class ShardedCheckNotificationsTest(TestCase):
+    """The beat fans out into single-flight shards partitioned by user id."""
+
+    def setUp(self):
+        cache.clear()
+
+    def owner_with_routine(self, username, **kwargs):
+        user = make_user(username=username)
+        make_subscription(user, endpoint=f"https://example.com/push/{username}")
+        return make_routine(user, name=username, interval_hours=1, **kwargs)
+
+    @override_settings(NOTIFICATION_SHARDS=3)
+    def test_fans_out_one_task_per_shard(self):
+        with patch("apps.notifications.tasks.check_notifications_shard.delay") as mock_delay:
+            check_notifications()
+        self.assertEqual([c.args for c in mock_delay.call_args_list], [(0, 3), (1, 3), (2, 3)])
+
+    @override_settings(NOTIFICATION_SHARDS=3)
+    def test_every_routine_is_processed_by_exactly_one_shard(self):
+        routines = [self.owner_with_routine(f"shard{i}") for i in range(5)]
+        member = make_user(username="member")
+        make_subscription(member, endpoint="https://example.com/push/member")
+        routines[0].shared_with.add(member)
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            check_notifications()
+        # One call per member: the shared routine also reaches `member`.
+        self.assertCountEqual([c.args[0] for c in mock_due.call_args_list], [*routines, routines[0]])
+
+    def test_running_shard_is_skipped(self):
+        self.owner_with_routine("busy")
+        cache.set(_shard_key("lease", 0, 1), "other-run")
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            check_notifications_shard(0, 1)
+        mock_due.assert_not_called()
+        self.assertEqual(cache.get(_shard_key("lease", 0, 1)), "other-run")
+
+    def test_lease_is_released_after_run(self):
+        with patch("apps.notifications.tasks.notify_due"):
+            check_notifications_shard(0, 1)
+        self.assertIsNone(cache.get(_shard_key("lease", 0, 1)))
+
+    @patch("apps.notifications.tasks.STATE_BATCH_SIZE", 1)
+    def test_soft_time_limit_checkpoints_and_next_run_resumes(self):
+        first, second, third = (self.owner_with_routine(f"cp{i}") for i in range(3))
+        from apps.notifications import tasks
+
+        real_batch = tasks._process_due_batch
+        calls = []
+
+        def interrupted(batch, now_utc):
+            calls.append(batch[0])
+            if len(calls) == 2:
+                raise SoftTimeLimitExceeded()
+            return real_batch(batch, now_utc)
+
+        with patch("apps.notifications.tasks._process_due_batch", side_effect=interrupted):
+            check_notifications_shard(0, 1)
+        self.assertEqual(cache.get(_shard_key("checkpoint", 0, 1)), first.id)
+
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            check_notifications_shard(0, 1)
+        self.assertEqual([c.args[0] for c in mock_due.call_args_list], [second, third])
+        self.assertIsNone(cache.get(_shard_key("checkpoint", 0, 1)))
+
+    @patch("apps.notifications.tasks.STATE_BATCH_SIZE", 1)
+    def test_resumed_run_wraps_around_to_lower_ids(self):
+        first, second, third = (self.owner_with_routine(f"wrap{i}") for i in range(3))
+        cache.set(_shard_key("checkpoint", 0, 1), second.id)
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            check_notifications_shard(0, 1)
+        self.assertEqual([c.args[0] for c in mock_due.call_args_list], [third, first, second])
+        self.assertIsNone(cache.get(_shard_key("checkpoint", 0, 1)))
+
+
+class HeadsUpSelectionTest(TestCase):
+    """The beat only evaluates users whose heads-up window is open."""
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, hour, minute):
+        return datetime(2025, 7, 15, hour, minute, tzinfo=ZoneInfo("UTC"))
+
+    def subscribed(self, username, daily_time):
+        user = make_user(username=username, daily_time=daily_time)
+        make_subscription(user, endpoint=f"https://example.com/push/{username}")
+        return user
+
+    def beat(self, now):
+        with (
+            patch("django.utils.timezone.now", return_value=now),
+            patch("apps.notifications.tasks.notify_daily_heads_up") as mock_notify,
+            patch("apps.notifications.tasks.notify_due"),
+        ):
+            check_notifications()
+        return mock_notify
+
+    def test_only_open_windows_are_evaluated(self):
+        early = self.subscribed("early", "08:30")
+        self.subscribed("late", "14:00")
+        with (
+            patch("django.utils.timezone.now", return_value=self.at(8, 31)),
+            patch("apps.notifications.tasks._check_daily_heads_up", return_value=True) as mock_check,
+            patch("apps.notifications.tasks.notify_due"),
+        ):
+            check_notifications()
+        self.assertEqual([c.args[0] for c in mock_check.call_args_list], [early])
+
+    def test_window_wraps_midnight(self):
+        self.subscribed("midnight", "23:58")
+        make_routine(User.objects.get(username="midnight"), interval_hours=1)
+        self.assertEqual(self.beat(self.at(23, 55)).call_count, 1)
+
+    def test_window_missed_before_midnight_is_caught_up_after_it(self):
+        user = self.subscribed("night", "23:50")
+        make_routine(user, interval_hours=1)
+        # Yesterday's 23:50 window, never evaluated; today's is still ahead.
+        self.assertEqual(self.beat(self.at(0, 30)).call_count, 1)
+        self.assertEqual(self.beat(self.at(0, 35)).call_count, 0)
+        self.assertEqual(self.beat(self.at(23, 50)).call_count, 1)
+
+    def test_missed_window_is_caught_up_once(self):
+        user = self.subscribed("missed", "08:30")
+        make_routine(user, interval_hours=1)
+        self.assertEqual(self.beat(self.at(9, 10)).call_count, 1)
+        self.assertEqual(self.beat(self.at(9, 15)).call_count, 0)
+
+    def test_no_catch_up_after_evaluated_window(self):
+        user = self.subscribed("evaluated", "08:30")
+        self.beat(self.at(8, 30))  # nothing due yet
+        make_routine(user, interval_hours=1)
+        self.assertEqual(self.beat(self.at(9, 0)).call_count, 0)
+
+    def test_catch_up_is_bounded(self):
+        user = self.subscribed("too_late", "08:30")
+        make_routine(user, interval_hours=1)
+        self.assertEqual(self.beat(self.at(9, 40)).call_count, 0)
+
+
+class NotifyRoutineTest(TestCase):
+    """Per-routine ETA tasks planned when the due time moves."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(username="eta")
+        make_subscription(self.user)
+
+    def planned(self, action):
+        with (
+            patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            action()
+        return mock_async
+
+    def plan(self, routine, token, eta=None):
+        eta = eta or timezone.now()
+        cache.set(_eta_key(routine.pk), {"token": token, "eta": eta.isoformat()}, timeout=None)
+
+    @override_settings(NOTIFY_ETA_HORIZON_SECONDS=48 * 60 * 60)
+    def test_logging_plans_task_at_new_due_time(self):
+        routine = make_routine(self.user, interval_hours=24)
+        mock_async = self.planned(lambda: RoutineEntry.objects.create(routine=routine))
+        routine.refresh_from_db()
+        mock_async.assert_called_once()
+        (routine_id, token, eta), kwargs = mock_async.call_args[0][0], mock_async.call_args[1]
+        self.assertEqual(routine_id, routine.pk)
+        self.assertEqual(kwargs["eta"], routine.scheduled_due_at)
+        self.assertEqual(eta, routine.scheduled_due_at.isoformat())
+        self.assertEqual(cache.get(_eta_key(routine.pk)), {"token": token, "eta": eta})
+
+    def test_due_time_past_the_horizon_is_left_to_the_beat(self):
+        routine = make_routine(self.user, interval_hours=24)
+        self.plan(routine, "old")
+        mock_async = self.planned(lambda: RoutineEntry.objects.create(routine=routine))
+        mock_async.assert_not_called()
+        self.assertIsNone(cache.get(_eta_key(routine.pk)))
+
+    def test_new_routine_is_planned_right_away(self):
+        mock_async = self.planned(lambda: make_routine(self.user))
+        self.assertLessEqual(mock_async.call_args[1]["eta"], timezone.now())
+
+    @override_settings(EMBEDDED_SCHEDULER=True)
+    def test_embedded_mode_leaves_routine_to_the_scheduler_pass(self):
+        mock_async = self.planned(lambda: make_routine(self.user))
+        mock_async.assert_not_called()
+
+    def test_deactivating_cancels_plan(self):
+        routine = make_routine(self.user)
+        self.plan(routine, "old")
+
+        def deactivate():
+            routine.is_active = False
+            routine.save()
+
+        mock_async = self.planned(deactivate)
+        mock_async.assert_not_called()
+        self.assertIsNone(cache.get(_eta_key(routine.pk)))
+
+    def test_partial_save_of_other_fields_keeps_plan(self):
+        routine = make_routine(self.user)
+        self.plan(routine, "current")
+
+        def rename():
+            routine.name = "Renamed"
+            routine.save(update_fields=["name", "updated_at"])
+
+        mock_async = self.planned(rename)
+        mock_async.assert_not_called()
+        self.assertEqual(cache.get(_eta_key(routine.pk))["token"], "current")
+
+    def test_broker_failure_does_not_raise(self):
+        with (
+            patch("apps.notifications.tasks.notify_routine.apply_async", side_effect=ConnectionError),
+            self.assertLogs("apps.notifications.tasks", level="ERROR"),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            make_routine(self.user)
+
+    def test_superseded_task_is_noop(self):
+        routine = make_routine(self.user, interval_hours=1)
+        self.plan(routine, "current")
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            notify_routine(routine.pk, "stale", timezone.now().isoformat())
+        mock_due.assert_not_called()
+
+    def test_early_task_is_noop(self):
+        routine = make_routine(self.user, interval_hours=1)
+        eta = timezone.now() + timedelta(hours=1)
+        self.plan(routine, "t", eta)
+        with patch("apps.notifications.tasks.notify_due") as mock_due:
+            notify_routine(routine.pk, "t", eta.isoformat())
+        mock_due.assert_not_called()
+
+    @override_settings(NOTIFY_ETA_HORIZON_SECONDS=3 * 60 * 60)
+    def test_due_task_sends_and_plans_next_reminder(self):
+        routine = make_routine(self.user, interval_hours=1)
+        self.plan(routine, "t")
+        with (
+            patch("apps.notifications.tasks.notify_due") as mock_due,
+            patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async,
+        ):
+            notify_routine(routine.pk, "t", timezone.now().isoformat())
+        mock_due.assert_called_once()
+        state = NotificationState.objects.get(routine=routine)
+        args, kwargs = mock_async.call_args
+        self.assertEqual(args[0][1], cache.get(_eta_key(routine.pk))["token"])
+        self.assertEqual(kwargs["eta"], state.last_due_notification + timedelta(minutes=120))
+
+    def test_reminder_past_the_horizon_is_left_to_the_beat(self):
+        routine = make_routine(self.user, interval_hours=1)
+        self.plan(routine, "t")
+        with (
+            patch("apps.notifications.tasks.notify_due"),
+            patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async,
+        ):
+            notify_routine(routine.pk, "t", timezone.now().isoformat())
+        mock_async.assert_not_called()
+        self.assertIsNone(cache.get(_eta_key(routine.pk)))
+
+    def test_daily_mode_plans_no_reminder(self):
+        routine = make_routine(self.user, interval_hours=1)
+        Routine.objects.filter(pk=routine.pk).update(reminder_mode="daily")
+        self.plan(routine, "t")
+        with (
+            patch("apps.notifications.tasks.notify_due"),
+            patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async,
+        ):
+            notify_routine(routine.pk, "t", timezone.now().isoformat())
+        mock_async.assert_not_called()
+
+
+class PlanNotificationsTest(TestCase):
+    """The beat queues the moments that came within the ETA horizon."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(username="planner")
+
+    def due_in(self, minutes):
+        routine = make_routine(self.user, interval_hours=24)
+        due = timezone.now() + timedelta(minutes=minutes)
+        Routine.objects.filter(pk=routine.pk).update(scheduled_due_at=due)
+        return routine, due
+
+    def test_plans_routines_due_within_the_horizon(self):
+        soon, due = self.due_in(10)
+        self.due_in(60)
+        with patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async:
+            self.assertEqual(plan_notifications(), 1)
+        self.assertEqual(mock_async.call_args[0][0][0], soon.pk)
+        self.assertEqual(mock_async.call_args[1]["eta"], due)
+
+    def test_plans_next_reminder_within_the_horizon(self):
+        routine, _ = self.due_in(-60)
+        reminder = timezone.now() + timedelta(minutes=5)
+        NotificationState.objects.create(
+            routine=routine, last_due_notification=timezone.now(), next_reminder_at=reminder
+        )
+        with patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async:
+            plan_notifications()
+        self.assertEqual(mock_async.call_args[1]["eta"], reminder)
+
+    def test_planned_moment_is_not_queued_again(self):
+        routine, due = self.due_in(10)
+        cache.set(_eta_key(routine.pk), {"token": "t", "eta": due.isoformat()}, timeout=None)
+        with patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async:
+            self.assertEqual(plan_notifications(), 0)
+        mock_async.assert_not_called()
+
+    def test_inactive_routines_are_skipped(self):
+        routine, _ = self.due_in(10)
+        Routine.objects.filter(pk=routine.pk).update(is_active=False)
+        with patch("apps.notifications.tasks.notify_routine.apply_async") as mock_async:
+            self.assertEqual(plan_notifications(), 0)
+        mock_async.assert_not_called()
+
 
 # ── Push message i18n ─────────────────────────────────────────────────────────
 
@@ -1530,7 +2535,7 @@ class DSTDailyHeadsUpTest(TestCase):
 
 
 @override_settings(
-    VAPID_PRIVATE_KEY="fake-private-key",
+    VAPID_PRIVATE_KEY=TEST_VAPID_PRIVATE_KEY,
     VAPID_PUBLIC_KEY="fake-public-key",
     VAPID_CLAIMS_EMAIL="test@example.com",
 )
@@ -1549,7 +2554,7 @@ class SharedRoutineNotificationTest(TestCase):
     def test_due_notification_sends_to_all_members(self, mock_webpush):
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(self.routine, now)
+            run_check(_check_due_notification, self.routine, now)
             self.assertEqual(mock_notify.call_count, 2)
             called_users = {c.kwargs["target_user"] for c in mock_notify.call_args_list}
             self.assertEqual(called_users, {self.owner, self.shared_user})
@@ -1558,11 +2563,11 @@ class SharedRoutineNotificationTest(TestCase):
     def test_due_notification_only_fires_once(self, mock_webpush):
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(self.routine, now)
+            run_check(_check_due_notification, self.routine, now)
             self.assertEqual(mock_notify.call_count, 2)
         # Second call should skip (already notified this cycle)
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(self.routine, now + timedelta(minutes=1))
+            run_check(_check_due_notification, self.routine, now + timedelta(minutes=1))
             mock_notify.assert_not_called()
 
     @patch("apps.notifications.push.webpush")
@@ -1574,7 +2579,7 @@ class SharedRoutineNotificationTest(TestCase):
             last_due_notification=now - timedelta(hours=3),
         )
         with patch("apps.notifications.tasks.notify_reminder") as mock_notify:
-            _check_reminder(self.routine, now)
+            run_check(_check_reminder, self.routine, now)
             self.assertEqual(mock_notify.call_count, 2)
             called_users = {c.kwargs["target_user"] for c in mock_notify.call_args_list}
             self.assertEqual(called_users, {self.owner, self.shared_user})
@@ -1584,7 +2589,7 @@ class SharedRoutineNotificationTest(TestCase):
         now = timezone.now()
         # Send due notification first
         with patch("apps.notifications.tasks.notify_due"):
-            _check_due_notification(self.routine, now)
+            run_check(_check_due_notification, self.routine, now)
         # Owner completes the routine
         RoutineEntry.objects.create(routine=self.routine, completed_by=self.owner)
         # Reset notification state (as done in log view)
@@ -1599,7 +2604,7 @@ class SharedRoutineNotificationTest(TestCase):
         # Routine is no longer overdue, so no notifications should be sent
         self.assertFalse(self.routine.is_overdue())
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(self.routine, now + timedelta(minutes=1))
+            run_check(_check_due_notification, self.routine, now + timedelta(minutes=1))
             mock_notify.assert_not_called()
 
     @patch("apps.notifications.push.webpush")
@@ -1633,10 +2638,10 @@ class SharedRoutineNotificationTest(TestCase):
             # First processing (as owner)
             if self.routine.id not in processed_routines:
                 processed_routines.add(self.routine.id)
-                _check_due_notification(self.routine, now)
+                run_check(_check_due_notification, self.routine, now)
             # Second processing (as shared_user) — should be skipped
             if self.routine.id not in processed_routines:
-                _check_due_notification(self.routine, now)
+                run_check(_check_due_notification, self.routine, now)
             # Only called once (2 members), not twice (4 calls)
             self.assertEqual(mock_notify.call_count, 2)
 
@@ -1646,8 +2651,10 @@ class SharedRoutineNotificationTest(TestCase):
         PushSubscription.objects.filter(user=self.shared_user).delete()
         now = timezone.now()
         # notify_due sends to all members, but send_push_notification
-        # for shared_user will be a no-op (no subscriptions)
-        _check_due_notification(self.routine, now)
+        # for shared_user will be a no-op (no subscriptions). Pushes go out
+        # through the outbox drain.
+        _process_due_batch([self.routine], now)
+        drain_push_outbox()
         # webpush is only called for owner's subscription
         self.assertEqual(mock_webpush.call_count, 1)
 
@@ -1657,6 +2664,83 @@ class SharedRoutineNotificationTest(TestCase):
         self.routine.shared_with.remove(self.shared_user)
         now = timezone.now()
         with patch("apps.notifications.tasks.notify_due") as mock_notify:
-            _check_due_notification(self.routine, now)
+            run_check(_check_due_notification, self.routine, now)
             # Only owner should be notified
             mock_notify.assert_called_once_with(self.routine, target_user=self.owner)
+
+
+class SimulateNotificationsCommandTest(TestCase):
+    """`simulate_notifications` drives the real pass against a local push sink."""
+
+    def setUp(self):
+        cache.clear()
+
+    def run_command(self, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("simulate_notifications", *args, stdout=out)
+        return out.getvalue()
+
+    def test_refuses_without_debug(self):
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            self.run_command("--users", "1")
+
+    @override_settings(DEBUG=True)
+    def test_refuses_while_real_subscriptions_exist(self):
+        from django.core.management.base import CommandError
+
+        make_subscription(make_user())
+        with self.assertRaises(CommandError):
+            self.run_command("--users", "1")
+        self.assertFalse(User.objects.filter(username__startswith="loadsim-").exists())
+
+    def test_deliveries_outside_the_sink_are_not_sent(self):
+        from .management.commands.simulate_notifications import _sink_only
+        from .push import PushDelivery
+
+        deliver = MagicMock()
+        sink_only = _sink_only(deliver, "http://127.0.0.1:9")
+        subscription = make_subscription(make_user())
+        result = sink_only(PushDelivery(subscription=subscription, user=subscription.user, payload="{}", type=TYPE_DUE))
+
+        deliver.assert_not_called()
+        self.assertFalse(result.delivered)
+        self.assertFalse(result.attempted)
+
+    @override_settings(DEBUG=True)
+    def test_reports_every_beat_and_cleans_up(self):
+        report = json.loads(
+            self.run_command("--users", "3", "--hours", "1", "--start", "2026-01-05T06:00:00", "--json")
+        )
+        beats = report["beats"]
+        self.assertEqual(len(beats), 12)
+        self.assertEqual(beats[1]["at"], "2026-01-05T06:05:00+00:00")
+        for beat in beats:
+            self.assertEqual(set(beat), {"at", "wall_ms", "queries", "pushes", "peak_kib", "lock_wait_ms"})
+            self.assertGreater(beat["queries"], 0)
+        # Routines overdue at the start are pushed on the first beat, through
+        # the real encryption path, to the sink.
+        self.assertGreater(beats[0]["pushes"], 0)
+        self.assertEqual(report["summary"]["pushes"], sum(beat["pushes"] for beat in beats))
+        self.assertFalse(User.objects.filter(username__startswith="loadsim-").exists())
+
+    @override_settings(DEBUG=True)
+    def test_keep_leaves_generated_data(self):
+        self.run_command("--users", "2", "--routines", "3", "--hours", "0.25", "--keep")
+        self.assertEqual(Routine.objects.filter(user__username__startswith="loadsim-").count(), 6)
+        self.assertEqual(PushSubscription.objects.filter(user__username__startswith="loadsim-").count(), 2)
+
+    def test_push_sink_records_requests(self):
+        import requests
+
+        from .management.commands.simulate_notifications import PushSink
+
+        with PushSink() as sink:
+            response = requests.post(f"{sink.url}/push/1", data=b"payload", timeout=5)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sink.received, 1)
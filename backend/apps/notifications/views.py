@@ -4,6 +4,8 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from nudge import embedded
+
 from .models import PushSubscription
 from .push import notify_test
 from .serializers import PushSubscriptionSerializer
@@ -62,7 +64,7 @@ def test_push_scheduled(request):
             {"detail": "No push subscriptions found."},
             status=status.HTTP_404_NOT_FOUND,
         )
-    send_scheduled_test.apply_async(args=[request.user.id], countdown=300)
+    embedded.enqueue(send_scheduled_test, request.user.id, countdown=300)
     return Response(status=status.HTTP_202_ACCEPTED)
 
 
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
+from apps.sync.models import entries_deleted
+
 from .models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot
 
 
@@ -44,7 +46,7 @@ class StockAdmin(admin.ModelAdmin):
     filter_horizontal = ["shared_with"]
     inlines = [StockLotInline, StockConsumptionInline]
 
-    @admin.display(description="Total quantity")
+    @admin.display(description="Total quantity", ordering="stored_quantity")
     def total_quantity(self, obj):
         return obj.quantity
 
@@ -58,6 +60,14 @@ class RoutineAdmin(admin.ModelAdmin):
     filter_horizontal = ["shared_with"]
     inlines = [RoutineEntryInline]
 
+    def save_related(self, request, form, formsets, change):
+        # Entries deleted through the inline bypass the post_save receiver
+        # that keeps the materialized due time current, and the sync log.
+        deleted = [f.instance.pk for formset in formsets for f in formset.deleted_forms if f.instance.pk]
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_schedule()
+        entries_deleted(form.instance.pk, deleted)
+
 
 @admin.register(StockConsumption)
 class StockConsumptionAdmin(admin.ModelAdmin):
@@ -73,3 +83,17 @@ class RoutineEntryAdmin(admin.ModelAdmin):
     list_filter = ["routine__user", "routine"]
     search_fields = ["routine__name", "notes"]
     readonly_fields = ["created_at"]
+
+    def delete_model(self, request, obj):
+        entry_id = obj.pk
+        super().delete_model(request, obj)
+        obj.routine.refresh_schedule()
+        entries_deleted(obj.routine_id, [entry_id])
+
+    def delete_queryset(self, request, queryset):
+        routines = list(Routine.objects.filter(entries__in=queryset).distinct())
+        deleted = list(queryset.values_list("routine_id", "pk"))
+        super().delete_queryset(request, queryset)
+        for routine in routines:
+            routine.refresh_schedule()
+            entries_deleted(routine.pk, [entry_id for routine_id, entry_id in deleted if routine_id == routine.pk])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from apps.routines.models import Stock
+
+
+class Command(BaseCommand):
+    help = "Checks each stock's stored lot counters against its lots and repairs the ones that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without repairing it.")
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for stock in Stock.objects.order_by("pk").iterator():
+            expected = stock.lot_counters()
+            stored = {field: getattr(stock, field) for field in expected}
+            if stored == expected:
+                continue
+            drifted += 1
+            changes = ", ".join(f"{field} {stored[field]} → {expected[field]}" for field in expected)
+            self.stdout.write(f"Stock {stock.pk} ({stock.name}): {changes}")
+            if not options["dry_run"]:
+                stock.refresh_counters()
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All stock counters match their lots."))
+        elif options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{drifted} stock(s) drifted; run without --dry-run to repair."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {drifted} stock(s)."))
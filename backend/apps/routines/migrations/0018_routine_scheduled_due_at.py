@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:03
+#
+# Materializes `Routine.next_due_at()` into `scheduled_due_at` (plus the phase
+# cursor for `interval_phases`) so the notification worker can select due
+# routines with an indexed range query. The backfill mirrors
+# `Routine.current_phase` — historical models carry no custom methods.
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    Routine = apps.get_model("routines", "Routine")
+    RoutineEntry = apps.get_model("routines", "RoutineEntry")
+    for routine in Routine.objects.all().iterator():
+        entries = RoutineEntry.objects.filter(routine_id=routine.pk)
+        last = entries.order_by("-client_created_at").first()
+        if last is None:
+            continue
+        cursor, hours = 0, routine.interval_hours
+        phases = routine.interval_phases
+        if phases:
+            remaining = entries.count()
+            cursor, hours = len(phases) - 1, phases[-1]["interval_hours"]
+            for index, phase in enumerate(phases[:-1]):
+                if remaining < phase["count"]:
+                    cursor, hours = index, phase["interval_hours"]
+                    break
+                remaining -= phase["count"]
+        Routine.objects.filter(pk=routine.pk).update(
+            scheduled_due_at=(last.client_created_at or last.created_at) + timedelta(hours=hours),
+            phase_cursor=cursor,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("routines", "0017_userstockpin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="routine",
+            name="phase_cursor",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="routine",
+            name="scheduled_due_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="routine",
+            index=models.Index(fields=["is_active", "scheduled_due_at"], name="routine_active_due_idx"),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Composite and partial indexes for the hot query shapes: latest entry and
+# history per routine, consumption history per stock, FEFO lot selection and
+# lot identity lookups. `Routine(is_active, …)` is covered already by
+# `routine_active_due_idx` (0018).
+#
+# The indexes are built `CONCURRENTLY`, so large tables keep taking writes
+# while they build; that cannot run inside a transaction, hence
+# `atomic = False`. PostgreSQL only, like every deployment and CI.
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("routines", "0018_routine_scheduled_due_at"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="routineentry",
+            index=models.Index(fields=["routine", "-client_created_at", "-id"], name="entry_routine_recent_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="stockconsumption",
+            index=models.Index(fields=["stock", "-client_created_at", "-id"], name="consumption_stock_recent_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="stocklot",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["stock", "expiry_date", "created_at"],
+                name="stocklot_fefo_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="stocklot",
+            index=models.Index(
+                fields=["stock", "lot_number", "expiry_date", "serial_number"], name="stocklot_identity_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Denormalizes the lot totals onto Stock (see `Stock.refresh_counters`). The
+# backfill mirrors `Stock.lot_counters` — historical models carry no custom
+# methods.
+
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import Min, Q, Sum
+
+
+def backfill(apps, schema_editor):
+    Stock = apps.get_model("routines", "Stock")
+    StockLot = apps.get_model("routines", "StockLot")
+    today = date.today()
+    counters = (
+        StockLot.objects.filter(quantity__gt=0)
+        .values("stock_id")
+        .annotate(
+            total=Sum("quantity"),
+            available=Sum("quantity", filter=Q(expiry_date__isnull=True) | Q(expiry_date__gt=today)),
+            until=Min("expiry_date", filter=Q(expiry_date__gt=today)),
+        )
+    )
+    for row in counters.iterator():
+        Stock.objects.filter(pk=row["stock_id"]).update(
+            stored_quantity=row["total"],
+            stored_quantity_available=row["available"] or 0,
+            stored_available_until=row["until"],
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("routines", "0019_index_pack"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="stored_available_until",
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="stock",
+            name="stored_quantity",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="stock",
+            name="stored_quantity_available",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,21 @@
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import date, timedelta
 from zoneinfo import ZoneInfo
 
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models, transaction
-from django.db.models import F, Q, Sum
-from django.db.models.signals import m2m_changed, post_save
-from django.dispatch import receiver
+from django.db.models import Count, F, Min, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
 from django.utils import timezone
 from rest_framework import serializers
 
+from apps.core.transactions import transaction_state
+from apps.core.versioning import bump_data_version
+
 
 class StockGroup(models.Model):
     """User-defined grouping for stock items (e.g. 'Diabetes', 'Household')."""
@@ -79,6 +85,13 @@ class Stock(models.Model):
         help_text="Quantity to prefill when adding a lot. Null when not yet known.",
     )
     updated_at = models.DateTimeField(auto_now=True)
+    # Lot totals, denormalized by `refresh_counters` in the transaction of
+    # every lot write. Read through `quantity` / `quantity_available`.
+    stored_quantity = models.IntegerField(default=0, editable=False)
+    stored_quantity_available = models.IntegerField(default=0, editable=False)
+    # Earliest expiry among the lots counted as available: from that day on
+    # `stored_quantity_available` is stale until the next refresh.
+    stored_available_until = models.DateField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ["name"]
@@ -90,7 +103,7 @@ class Stock(models.Model):
     def quantity(self):
         if "lots" in self.__dict__.get("_prefetched_objects_cache", {}):
             return sum(lot.quantity for lot in self.lots.all())
-        return self.lots.aggregate(total=Sum("quantity"))["total"] or 0
+        return self.stored_quantity
 
     @property
     def quantity_available(self):
@@ -102,17 +115,50 @@ class Stock(models.Model):
         estimation, and the user-facing "X ud." figure.
 
         Prefetch-aware: when the caller has prefetched `lots`, the partition
-        is computed in Python from the cached list. Otherwise it falls back
-        to a single aggregate query. This keeps `RoutineSerializer.stock_quantity_available`
-        (which reaches through `source="stock.quantity_available"`) free of
-        per-routine queries when the viewset prefetches `stock__lots`.
+        is computed in Python from the cached list. Otherwise it reads the
+        stored counter, and only falls back to an aggregate query once a
+        counted lot has expired since the last refresh (see
+        `refresh_expired_stock_counters`).
         """
         today = date.today()
         if "lots" in self.__dict__.get("_prefetched_objects_cache", {}):
             return sum(lot.quantity for lot in self.lots.all() if lot.expiry_date is None or lot.expiry_date > today)
+        if self.stored_available_until is None or today < self.stored_available_until:
+            return self.stored_quantity_available
         agg = self.lots.filter(Q(expiry_date__isnull=True) | Q(expiry_date__gt=today)).aggregate(total=Sum("quantity"))
         return agg["total"] or 0
 
+    def lot_counters(self):
+        """The stored counters as they should be, summed from the lots in the database."""
+        today = date.today()
+        return self.lots.filter(quantity__gt=0).aggregate(
+            stored_quantity=Coalesce(Sum("quantity"), 0),
+            stored_quantity_available=Coalesce(
+                Sum("quantity", filter=Q(expiry_date__isnull=True) | Q(expiry_date__gt=today)), 0
+            ),
+            stored_available_until=Min("expiry_date", filter=Q(expiry_date__gt=today)),
+        )
+
+    def refresh_counters(self):
+        """Recompute the stored counters from the lots.
+
+        Sums under the stock row lock: two transactions writing different lots
+        of one stock would otherwise each sum a state missing the other's
+        write. Persisted with a queryset `update()`, like
+        `Routine.refresh_schedule`, so `updated_at` still means an edit.
+        """
+        if _in_lot_writes(self.pk):
+            return  # The block refreshes them on exit.
+        with transaction.atomic():
+            lock_stock(self.pk)
+            self._store_counters()
+
+    def _store_counters(self):
+        counters = self.lot_counters()
+        Stock.objects.filter(pk=self.pk).update(**counters)
+        for field, value in counters.items():
+            setattr(self, field, value)
+
     @transaction.atomic
     def consume_lots(self, quantity, lot_selections=None):
         """
@@ -136,8 +182,11 @@ class Stock(models.Model):
             rest_framework.serializers.ValidationError on bad input.
             DRF translates to 400 when this bubbles from a viewset action.
         """
-        consumed_lots = []
+        with lot_writes(self):
+            return self._consume_lots(quantity, lot_selections)
 
+    def _consume_lots(self, quantity, lot_selections):
+        consumed_lots = []
         if lot_selections is not None:
             total = sum(sel.get("quantity", 0) for sel in lot_selections)
             if total != quantity:
@@ -174,6 +223,46 @@ class Stock(models.Model):
         return consumed_lots
 
 
+def lock_stock(stock_id):
+    """Take the row lock that serializes writes to one stock's lots.
+
+    Every lot write refreshes the stock's counters under this lock (see
+    `lock_stock_before_lot_write`). Paths that lock lot rows themselves —
+    `consume_lots`, the undo restore — take it first through `lot_writes`,
+    so the stock row is always locked before any lot row and two writers
+    cannot deadlock.
+    """
+    list(Stock.objects.select_for_update().filter(pk=stock_id).values_list("pk", flat=True))
+
+
+@contextmanager
+def lot_writes(stock):
+    """Write several lots of `stock` and refresh its counters once, at the end.
+
+    Locks the stock first (see `lock_stock`). Inside the block the lot
+    receivers neither lock nor refresh per write; the counters are
+    recomputed on a clean exit and set on `stock` as well. Nested blocks
+    for the same stock leave the work to the outermost one.
+    """
+    with transaction.atomic():
+        batched = transaction_state("routines.lot-writes", set)
+        if stock.pk in batched:
+            yield
+            return
+        lock_stock(stock.pk)
+        batched.add(stock.pk)
+        try:
+            yield
+        finally:
+            batched.discard(stock.pk)
+        stock._store_counters()
+
+
+def _in_lot_writes(stock_id):
+    batched = transaction_state("routines.lot-writes")
+    return batched is not None and stock_id in batched
+
+
 def _lot_consumed_dict(lot, qty):
     """Build the dict shape used by `Stock.consume_lots` for each consumed lot.
 
@@ -301,6 +390,18 @@ class StockLot(models.Model):
                 name="unique_serial_per_stock",
             ),
         ]
+        indexes = [
+            # FEFO: `consume_lots` and the quantity sums read only lots with
+            # units left, in `ordering` order (NULL expiry sorts last in a
+            # PostgreSQL ascending index, as in `ordering`).
+            models.Index(
+                fields=["stock", "expiry_date", "created_at"],
+                condition=models.Q(quantity__gt=0),
+                name="stocklot_fefo_idx",
+            ),
+            # Lot identity, matched when restoring an undone entry.
+            models.Index(fields=["stock", "lot_number", "expiry_date", "serial_number"], name="stocklot_identity_idx"),
+        ]
 
     def __str__(self):
         label = self.lot_number or f"#{self.pk}"
@@ -313,6 +414,58 @@ def delete_empty_lot(sender, instance, **kwargs):
         instance.delete()
 
 
+# Lot fields the stock counters are summed from.
+_COUNTED_LOT_FIELDS = {"quantity", "expiry_date"}
+_COUNTER_FIELDS = {"stored_quantity", "stored_quantity_available", "stored_available_until"}
+
+
+def _deleted_with_stock(origin):
+    """True when a lot delete cascades from its stock (or the stock's owner)."""
+    return origin is not None and not isinstance(origin, (StockLot, models.QuerySet))
+
+
+@receiver(pre_save, sender=StockLot)
+@receiver(pre_delete, sender=StockLot)
+def lock_stock_before_lot_write(sender, instance, raw=False, origin=None, **kwargs):
+    """Lock the stock ahead of the lot row the write is about to lock."""
+    if raw or _deleted_with_stock(origin) or not transaction.get_connection().in_atomic_block:
+        return
+    if _in_lot_writes(instance.stock_id):
+        return
+    lock_stock(instance.stock_id)
+
+
+@receiver(post_save, sender=StockLot)
+@receiver(post_delete, sender=StockLot)
+def refresh_counters_on_lot_write(sender, instance, update_fields=None, raw=False, origin=None, **kwargs):
+    """Keep the stock counters in step with every lot write, in its transaction.
+
+    Writes inside `lot_writes` leave the refresh to the end of the block.
+    Bulk paths (`bulk_create`, queryset `update()`) skip this; they refresh
+    explicitly, and `verify_stock_counters` repairs any drift left behind.
+    The stock instance cached on the lot, when there is one, is refreshed in
+    place so the caller's copy does not go stale.
+    """
+    if raw or _deleted_with_stock(origin):
+        return
+    if update_fields is not None and not _COUNTED_LOT_FIELDS & set(update_fields):
+        return
+    if _in_lot_writes(instance.stock_id):
+        return
+    stock = instance.stock if StockLot.stock.is_cached(instance) else Stock(pk=instance.stock_id)
+    stock.refresh_counters()
+
+
+@receiver(post_save, sender=Stock)
+def refresh_counters_on_stock_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """A full save writes this instance's counters back, and they may be stale."""
+    if raw or created:
+        return
+    if update_fields is not None and not _COUNTER_FIELDS & set(update_fields):
+        return
+    instance.refresh_counters()
+
+
 @receiver(m2m_changed, sender=Stock.shared_with.through)
 def unlink_routines_on_unshare(sender, instance, action, pk_set, **kwargs):
     """When users are removed from a stock's shared_with, drop what they kept of it.
@@ -366,6 +519,10 @@ class StockConsumption(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Consumption history and the direct-consumption window, per stock.
+            models.Index(fields=["stock", "-client_created_at", "-id"], name="consumption_stock_recent_idx"),
+        ]
 
     def __str__(self):
         return f"{self.stock.name} — consumed {self.quantity} — {self.created_at:%Y-%m-%d %H:%M}"
@@ -375,6 +532,32 @@ class StockConsumption(models.Model):
         return self.client_created_at or self.created_at
 
 
+class RoutineQuerySet(models.QuerySet):
+    def with_entry_stats(self):
+        """Attach each routine's latest entry and its entry count, bounded.
+
+        The latest entry comes from a sliced prefetch — one row per routine,
+        picked by a window function in the database — and the count from a
+        correlated subquery annotation. Neither depends on how much history a
+        routine has, unlike prefetching every entry to read ``[0]`` and
+        ``len()``. `Routine.last_entry` / `entry_count` read both. Used by the
+        notification worker, the dashboard and the routine list/detail.
+        """
+        latest = Prefetch(
+            "entries",
+            queryset=RoutineEntry.objects.order_by("-client_created_at")[:1],
+            to_attr="_latest_entry",
+        )
+        count = (
+            RoutineEntry.objects.filter(routine=OuterRef("pk"))
+            .order_by()
+            .values("routine")
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        return self.annotate(entry_total=Coalesce(Subquery(count), 0)).prefetch_related(latest)
+
+
 class Routine(models.Model):
     """
     A recurring task that must be performed at regular intervals.
@@ -451,67 +634,114 @@ class Routine(models.Model):
         help_text="Units deducted from stock per entry",
     )
     is_active = models.BooleanField(default=True)
+    # Materialized `next_due_at()`, kept in sync by `refresh_schedule()` so the
+    # notification worker can select due routines with one range query instead
+    # of walking every routine's history in Python. Null means "never logged",
+    # which `is_overdue()` treats as due. Not an API field — serializers keep
+    # computing from the entries they already hold.
+    scheduled_due_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Index into `interval_phases` of the phase that produced `scheduled_due_at`.
+    # Always 0 for fixed schedules.
+    phase_cursor = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = RoutineQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["is_active", "scheduled_due_at"], name="routine_active_due_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
     def last_entry(self):
         if not hasattr(self, "_last_entry_cache"):
-            if hasattr(self, "_prefetched_entries"):
-                self._last_entry_cache = self._prefetched_entries[0] if self._prefetched_entries else None
+            if hasattr(self, "_latest_entry"):
+                self._last_entry_cache = self._latest_entry[0] if self._latest_entry else None
             else:
                 self._last_entry_cache = self.entries.order_by("-client_created_at").first()
         return self._last_entry_cache
 
     def entry_count(self):
         if not hasattr(self, "_entry_count_cache"):
-            if hasattr(self, "_prefetched_entries"):
-                self._entry_count_cache = len(self._prefetched_entries)
+            if hasattr(self, "entry_total"):
+                self._entry_count_cache = self.entry_total
             else:
                 self._entry_count_cache = self.entries.count()
         return self._entry_count_cache
 
-    def next_due_at(self):
-        last = self.last_entry()
-        if last is None:
-            return None
+    def current_phase(self, entry_count):
+        """Return ``(index, interval_hours)`` of the phase the next entry falls in.
 
+        Fixed schedules always answer ``(0, interval_hours)``. With phases, walk
+        them subtracting counts until `entry_count` lands inside one; the last
+        phase repeats forever.
+        """
         if not self.interval_phases:
-            return last.effective_created_at + timedelta(hours=self.interval_hours)
-
-        # Phase-based scheduling: walk phases subtracting counts until we find
-        # which phase the next entry falls in. The last phase repeats forever.
-        remaining = self.entry_count()
-        phase = self.interval_phases[-1]
-        for p in self.interval_phases[:-1]:
+            return 0, self.interval_hours
+        remaining = entry_count
+        for index, p in enumerate(self.interval_phases[:-1]):
             if remaining < p["count"]:
-                phase = p
-                break
+                return index, p["interval_hours"]
             remaining -= p["count"]
+        return len(self.interval_phases) - 1, self.interval_phases[-1]["interval_hours"]
 
-        return last.effective_created_at + timedelta(hours=phase["interval_hours"])
+    def next_due_at(self):
+        last = self.last_entry()
+        if last is None:
+            return None
+        # Fixed schedules never need the count, so don't pay for it.
+        count = self.entry_count() if self.interval_phases else 0
+        _, hours = self.current_phase(count)
+        return last.effective_created_at + timedelta(hours=hours)
+
+    def refresh_schedule(self):
+        """Recompute `scheduled_due_at` / `phase_cursor` from the stored history.
+
+        Reads the entries from the database rather than from any prefetch or
+        cache on this instance — callers reach here right after writing an
+        entry, when those are stale. Persisted with a queryset `update()` so
+        `updated_at` is untouched: logging a routine is not an edit of it, and
+        bumping the timestamp would turn a client's next PATCH into a 412.
+        """
+        entries = RoutineEntry.objects.filter(routine_id=self.pk)
+        last = entries.order_by("-client_created_at").first()
+        if last is None:
+            due, cursor = None, 0
+        else:
+            cursor, hours = self.current_phase(entries.count() if self.interval_phases else 0)
+            due = last.effective_created_at + timedelta(hours=hours)
+        self.scheduled_due_at = due
+        self.phase_cursor = cursor
+        Routine.objects.filter(pk=self.pk).update(scheduled_due_at=due, phase_cursor=cursor)
+        schedule_changed.send(sender=Routine, routine=self)
 
     def is_overdue(self):
         """True when the exact due time has passed (or routine was never logged)."""
-        due = self.next_due_at()
-        if due is None:
-            return True
-        return timezone.now() >= due
+        return is_overdue_at(self.next_due_at(), timezone.now())
 
     def is_due(self):
         """True when the routine is due today or already overdue (user's local date)."""
-        due = self.next_due_at()
-        if due is None:
-            return True
-        user_tz = ZoneInfo(self.user.timezone)
-        due_date = due.astimezone(user_tz).date()
-        today = timezone.now().astimezone(user_tz).date()
-        return today >= due_date
+        return is_due_at(self.next_due_at(), self.user.timezone, timezone.now())
+
+
+def is_overdue_at(due, now):
+    """`Routine.is_overdue` for a known next due moment (None: never logged)."""
+    return due is None or now >= due
+
+
+def is_due_at(due, tz_name, now):
+    """`Routine.is_due` for a known next due moment, in the owner's timezone.
+
+    Split out so cached payloads can be re-evaluated without the routine.
+    """
+    if due is None:
+        return True
+    user_tz = ZoneInfo(tz_name)
+    return now.astimezone(user_tz).date() >= due.astimezone(user_tz).date()
 
 
 class RoutineEntry(models.Model):
@@ -549,6 +779,10 @@ class RoutineEntry(models.Model):
     class Meta:
         ordering = ["-created_at"]
         verbose_name_plural = "routine entries"
+        indexes = [
+            # Latest entry per routine (`with_entry_stats`) and entry history.
+            models.Index(fields=["routine", "-client_created_at", "-id"], name="entry_routine_recent_idx"),
+        ]
 
     def __str__(self):
         return f"{self.routine.name} — {self.created_at:%Y-%m-%d %H:%M}"
@@ -556,3 +790,239 @@ class RoutineEntry(models.Model):
     @property
     def effective_created_at(self):
         return self.client_created_at or self.created_at
+
+
+# Entry fields that move a routine's due time. Any other partial save (notes,
+# the `consumed_lots` snapshot written right after creation) leaves it alone.
+_SCHEDULE_FIELDS = {"created_at", "client_created_at"}
+# Routine fields that move its due time, or whether it is planned at all.
+ROUTINE_SCHEDULE_FIELDS = {"interval_hours", "interval_phases", "is_active"}
+
+# Sent whenever a routine's due time may have moved: after
+# `Routine.refresh_schedule` and when a routine is created. Receivers get the
+# routine as `routine`; the notifications app plans its pushes from it.
+schedule_changed = Signal()
+
+
+@receiver(post_save, sender=RoutineEntry)
+def refresh_schedule_on_entry_save(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Keep `Routine.scheduled_due_at` in step with new and edited entries.
+
+    Deletions are not covered by a receiver on purpose: a `post_delete`
+    handler would disable Django's fast-delete path for the whole table, so
+    every cascade (deleting a routine, a user) would load each entry into
+    memory. The one delete path that leaves the routine alive —
+    `RoutineEntryViewSet.destroy`, plus its admin twin — refreshes explicitly.
+    """
+    if raw:
+        return
+    if update_fields is not None and not _SCHEDULE_FIELDS & set(update_fields):
+        return
+    instance.routine.refresh_schedule()
+
+
+@receiver(post_save, sender=Routine)
+def refresh_schedule_on_routine_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """A changed interval (or phase list) moves the due time of existing history.
+
+    A brand-new routine has no entries yet (its backdated first entry, if any,
+    goes through the entry receiver above) but is due right away. A partial
+    save of other fields leaves the schedule, and the planned push, alone.
+    """
+    if raw:
+        return
+    if created:
+        schedule_changed.send(sender=Routine, routine=instance)
+        return
+    if update_fields is not None and not ROUTINE_SCHEDULE_FIELDS & set(update_fields):
+        return
+    instance.refresh_schedule()
+
+
+# ── Data version ─────────────────────────────────────────────────────────────
+# Every write a user could see through the API bumps the data version of each
+# member it affects (owner and everyone it is shared with, on both the routine
+# and the stock side), which invalidates their cached payloads. See
+# `apps.core.versioning`. Like the schedule receivers above, entries and
+# consumptions get no `post_delete` handler: cascades reach them only through
+# a routine or stock delete, which bumps already, and the one entry delete
+# that leaves its routine alive refreshes the schedule explicitly.
+
+_PROFILE_FIELDS = {"first_name", "last_name", "email", "timezone"}
+
+
+def routine_members(routine_ids):
+    """``{routine id: user ids}``: the owner and members of each routine.
+
+    Memoized for the transaction, like `stock_members` and `stock_routines`:
+    the several writes behind one request (entry, lots, consumption, stock)
+    each reach the same audiences, which are then read once. Shares and
+    routine saves, which can change them, drop the memo (`forget_members`).
+    """
+    return _memoized("routine", routine_ids, _load_routine_members)
+
+
+def stock_members(stock_ids):
+    """``{stock id: user ids}``: the owner and members of each stock."""
+    return _memoized("stock", stock_ids, _load_stock_members)
+
+
+def stock_routines(stock_ids):
+    """``{stock id: routine ids}``: the routines consuming from each stock."""
+    return _memoized("stock-routines", stock_ids, _load_stock_routines)
+
+
+def _memoized(kind, ids, load):
+    ids = set(ids)
+    memo = transaction_state("routines.audiences", dict)
+    if memo is None:
+        memo = {}
+    missing = [pk for pk in ids if (kind, pk) not in memo]
+    if missing:
+        found = load(missing)
+        for pk in missing:
+            memo[kind, pk] = frozenset(found.get(pk, ()))
+    return {pk: memo[kind, pk] for pk in ids}
+
+
+def _load_routine_members(ids):
+    members = defaultdict(set)
+    for pk, user_id in Routine.objects.filter(pk__in=ids).order_by().values_list("pk", "user_id"):
+        members[pk].add(user_id)
+    through = Routine.shared_with.through.objects.filter(routine_id__in=ids)
+    for pk, user_id in through.values_list("routine_id", "user_id"):
+        members[pk].add(user_id)
+    return members
+
+
+def _load_stock_members(ids):
+    members = defaultdict(set)
+    for pk, user_id in Stock.objects.filter(pk__in=ids).order_by().values_list("pk", "user_id"):
+        members[pk].add(user_id)
+    through = Stock.shared_with.through.objects.filter(stock_id__in=ids)
+    for pk, user_id in through.values_list("stock_id", "user_id"):
+        members[pk].add(user_id)
+    return members
+
+
+def _load_stock_routines(ids):
+    routines = defaultdict(set)
+    for stock_id, pk in Routine.objects.filter(stock_id__in=ids).order_by().values_list("stock_id", "pk"):
+        routines[stock_id].add(pk)
+    return routines
+
+
+@receiver(m2m_changed, sender=Routine.shared_with.through)
+@receiver(m2m_changed, sender=Stock.shared_with.through)
+@receiver(post_save, sender=Routine)
+@receiver(post_delete, sender=Routine)
+def forget_members(sender, action="post", **kwargs):
+    """Membership or a routine's stock changed: drop the transaction's memo.
+
+    Connected ahead of the data-version receivers below and those of
+    `apps.sync`, so an added member is seen right away. Removals are read
+    from their `pre_` signal, while the memo still holds the members going
+    away.
+    """
+    memo = transaction_state("routines.audiences", dict)
+    if memo is not None and action.startswith("post"):
+        memo.clear()
+
+
+def _routine_audience(routine_ids):
+    """User ids of the owners and members of `routine_ids`."""
+    return set().union(*routine_members(routine_ids).values())
+
+
+def _stock_audience(stock_ids):
+    """User ids that see `stock_ids`: their owners and members, and the members
+    of routines consuming from them (their routines show its quantity)."""
+    audience = set().union(*stock_members(stock_ids).values())
+    return audience | _routine_audience(set().union(*stock_routines(stock_ids).values()))
+
+
+def _routine_changed(routine):
+    audience = _routine_audience([routine.pk])
+    if routine.stock_id:
+        # Stock depletion estimates count the routines consuming from it.
+        audience |= _stock_audience([routine.stock_id])
+    bump_data_version(audience)
+
+
+@receiver(schedule_changed)
+def bump_version_on_schedule_change(sender, routine, **kwargs):
+    """Entry writes and routine saves end in `refresh_schedule`, bar the ones below."""
+    _routine_changed(routine)
+
+
+@receiver(post_save, sender=Routine)
+def bump_version_on_routine_edit(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Partial routine saves that leave the schedule alone (see `refresh_schedule_on_routine_save`)."""
+    if raw or update_fields is None or ROUTINE_SCHEDULE_FIELDS & set(update_fields):
+        return
+    _routine_changed(instance)
+
+
+@receiver(post_save, sender=RoutineEntry)
+def bump_version_on_entry_edit(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Entry edits that leave the schedule alone (see `refresh_schedule_on_entry_save`)."""
+    if raw or update_fields is None or _SCHEDULE_FIELDS & set(update_fields):
+        return
+    bump_data_version(_routine_audience([instance.routine_id]))
+
+
+@receiver(pre_delete, sender=Routine)
+def bump_version_on_routine_delete(sender, instance, **kwargs):
+    _routine_changed(instance)
+
+
+@receiver(m2m_changed, sender=Routine.shared_with.through)
+def bump_version_on_routine_share(sender, instance, action, pk_set, **kwargs):
+    # `pre_` for removals: members are read before they are gone.
+    if action in ("post_add", "pre_remove", "pre_clear"):
+        bump_data_version(_routine_audience([instance.pk]) | (pk_set or set()))
+
+
+@receiver(post_save, sender=Stock)
+@receiver(pre_delete, sender=Stock)
+def bump_version_on_stock_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_data_version(_stock_audience([instance.pk]))
+
+
+@receiver(m2m_changed, sender=Stock.shared_with.through)
+def bump_version_on_stock_share(sender, instance, action, pk_set, **kwargs):
+    # `pre_` for removals: read before `unlink_routines_on_unshare` drops the
+    # removed members' routine links.
+    if action in ("post_add", "pre_remove", "pre_clear"):
+        bump_data_version(_stock_audience([instance.pk]) | (pk_set or set()))
+
+
+@receiver(post_save, sender=StockLot)
+@receiver(post_delete, sender=StockLot)
+@receiver(post_save, sender=StockConsumption)
+def bump_version_on_stock_content_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_data_version(_stock_audience([instance.stock_id]))
+
+
+@receiver(post_save, sender=StockGroup)
+@receiver(post_delete, sender=StockGroup)
+@receiver(post_save, sender=UserStockGroup)
+@receiver(post_delete, sender=UserStockGroup)
+@receiver(post_save, sender=UserStockPin)
+@receiver(post_delete, sender=UserStockPin)
+def bump_version_on_personal_stock_view(sender, instance, raw=False, **kwargs):
+    """Groups and pins are per user: only their owner sees them."""
+    if not raw:
+        bump_data_version([instance.user_id])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def bump_version_on_profile_change(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Names and email show up in other members' payloads; the timezone in all of them."""
+    if raw or created or (update_fields is not None and not _PROFILE_FIELDS & set(update_fields)):
+        return
+    routines = Routine.objects.filter(Q(user=instance) | Q(shared_with=instance)).values_list("pk", flat=True)
+    stocks = Stock.objects.filter(Q(user=instance) | Q(shared_with=instance)).values_list("pk", flat=True)
+    bump_data_version(_routine_audience(routines) | _stock_audience(stocks) | {instance.pk})
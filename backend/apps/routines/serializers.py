@@ -9,7 +9,7 @@ from rest_framework import serializers
 
 from apps.core.mixins import SharedWithMixin
 
-from .models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot
+from .models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot, is_due_at, is_overdue_at
 
 User = get_user_model()
 
@@ -751,11 +751,18 @@ class RoutineSerializer(SharedWithMixin, FlexFieldsModelSerializer):
         return obj.is_overdue()
 
     def get_hours_until_due(self, obj):
-        due = obj.next_due_at()
-        if due is None:
-            return None
-        delta = (due - timezone.now()).total_seconds() / 3600
-        return round(delta, 1)
+        return _hours_until(obj.next_due_at(), timezone.now())
+
+    @staticmethod
+    def refresh_due_fields(item, now=None):
+        """Re-evaluate ``is_due``, ``is_overdue`` and ``hours_until_due`` of a
+        serialized routine (a cached payload) from its ``next_due_at`` and
+        ``user_timezone``."""
+        now = now or timezone.now()
+        due = item["next_due_at"]
+        item["is_due"] = is_due_at(due, item["user_timezone"], now)
+        item["is_overdue"] = is_overdue_at(due, now)
+        item["hours_until_due"] = _hours_until(due, now)
 
     def get_requires_lot_selection(self, obj):
         if not obj.stock_id:
@@ -798,3 +805,9 @@ class RoutineEntrySerializer(FlexFieldsModelSerializer):
             "completed_by_id",
             "completed_by_display_name",
         ]
+
+
+def _hours_until(due, now):
+    if due is None:
+        return None
+    return round((due - now).total_seconds() / 3600, 1)
@@ -0,0 +1,24 @@
+import logging
+from datetime import date
+
+from celery import shared_task
+
+from .models import Stock
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="apps.routines.tasks.refresh_expired_stock_counters")
+def refresh_expired_stock_counters() -> int:
+    """Refresh the stored counters of stocks a lot has expired in since their
+    last refresh (`stored_available_until` reached), so `quantity_available`
+    is a single-row read again. Runs hourly via Celery beat
+    (`refresh-expired-stock-counters`). Returns the count refreshed.
+    """
+    refreshed = 0
+    for stock in Stock.objects.filter(stored_available_until__lte=date.today()).only("pk").iterator():
+        stock.refresh_counters()
+        refreshed += 1
+    if refreshed:
+        logger.info("refresh_expired_stock_counters: refreshed %s stocks", refreshed)
+    return refreshed
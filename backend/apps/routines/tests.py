@@ -1,11 +1,14 @@
 import datetime as dt
 from datetime import date, timedelta
+from io import StringIO
 from math import floor
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import call_command
 from django.db import IntegrityError, connection, transaction
 from django.test import TestCase, override_settings
 from django.test.utils import CaptureQueriesContext
@@ -13,10 +16,22 @@ from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.test import APITestCase
 
+from apps.core.pagination import HistoryCursorPagination
 from apps.notifications.models import NotificationState
 
-from .models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot, UserStockGroup, UserStockPin
+from .models import (
+    Routine,
+    RoutineEntry,
+    Stock,
+    StockConsumption,
+    StockGroup,
+    StockLot,
+    UserStockGroup,
+    UserStockPin,
+    stock_members,
+)
 from .serializers import RoutineSerializer, StockLotSerializer, StockSerializer
+from .tasks import refresh_expired_stock_counters
 
 User = get_user_model()
 
@@ -151,6 +166,115 @@ class StockModelTest(TestCase):
         self.assertEqual(names, sorted(names))
 
 
+class StockCountersTest(APITestCase):
+    """`stored_quantity` / `stored_quantity_available` follow every lot write."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(user=self.user)
+        self.stock = make_stock(self.user)
+
+    def assertCounters(self, quantity, available):
+        stock = Stock.objects.get(pk=self.stock.pk)
+        self.assertEqual((stock.stored_quantity, stock.stored_quantity_available), (quantity, available))
+        self.assertEqual(stock.lot_counters()["stored_quantity"], quantity)
+
+    def test_lot_create_edit_and_delete(self):
+        lot = make_lot(self.stock, quantity=5, expiry_date=date.today() + timedelta(days=30))
+        self.assertCounters(5, 5)
+        response = self.client.patch(f"/api/stock/{self.stock.id}/lots/{lot.id}/", {"quantity": 8}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertCounters(8, 8)
+        self.assertEqual(self.client.delete(f"/api/stock/{self.stock.id}/lots/{lot.id}/").status_code, 204)
+        self.assertCounters(0, 0)
+
+    def test_lot_create_merges_into_existing_lot(self):
+        make_lot(self.stock, quantity=2, lot_number="A")
+        response = self.client.post(
+            f"/api/stock/{self.stock.id}/lots/", {"quantity": 3, "lot_number": "A"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertCounters(5, 5)
+
+    def test_consume_and_undo(self):
+        make_lot(self.stock, quantity=1, lot_number="A")
+        make_lot(self.stock, quantity=4)
+        routine = make_routine(self.user, stock=self.stock)
+        self.client.post(f"/api/routines/{routine.id}/log/", {}, format="json")
+        self.assertCounters(4, 4)
+        entry = routine.entries.get()
+        self.assertEqual(self.client.delete(f"/api/entries/{entry.id}/").status_code, 204)
+        self.assertCounters(5, 5)
+
+    def test_consume_refreshes_counters_once(self):
+        for number in "ABC":
+            make_lot(self.stock, quantity=1, lot_number=number)
+        with CaptureQueriesContext(connection) as ctx:
+            self.stock.consume_lots(3)
+        refreshes = [q["sql"] for q in ctx.captured_queries if '"stored_quantity" =' in q["sql"]]
+        self.assertEqual(len(refreshes), 1)
+        self.assertEqual(self.stock.stored_quantity, 0)
+        self.assertCounters(0, 0)
+
+    def test_failed_consume_leaves_counters(self):
+        make_lot(self.stock, quantity=2)
+        with self.assertRaises(serializers.ValidationError):
+            self.stock.consume_lots(2, [{"lot_id": 0, "quantity": 2}])
+        self.assertCounters(2, 2)
+
+    def test_log_checks_the_stored_counter(self):
+        make_lot(self.stock, quantity=4)
+        routine = make_routine(self.user, stock=self.stock)
+        Stock.objects.filter(pk=self.stock.pk).update(stored_quantity=0)
+
+        response = self.client.post(f"/api/routines/{routine.id}/log/", {}, format="json")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data["available"], 0)
+
+    def test_stale_full_save_does_not_roll_back_counters(self):
+        stale = Stock.objects.get(pk=self.stock.pk)
+        make_lot(self.stock, quantity=6)
+        stale.name = "Renamed"
+        stale.save()
+        self.assertCounters(6, 6)
+
+    def test_reads_need_no_query(self):
+        make_lot(self.stock, quantity=2, expiry_date=date.today() + timedelta(days=30))
+        stock = Stock.objects.get(pk=self.stock.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(stock.quantity, 2)
+            self.assertEqual(stock.quantity_available, 2)
+
+    def test_quantity_available_falls_back_once_a_counted_lot_expires(self):
+        lot = make_lot(self.stock, quantity=2, expiry_date=date.today() + timedelta(days=30))
+        make_lot(self.stock, quantity=3)
+        # The day `stored_available_until` names has come.
+        StockLot.objects.filter(pk=lot.pk).update(expiry_date=date.today())
+        Stock.objects.filter(pk=self.stock.pk).update(stored_available_until=date.today())
+        stock = Stock.objects.get(pk=self.stock.pk)
+        self.assertEqual(stock.quantity_available, 3)
+
+        self.assertEqual(refresh_expired_stock_counters(), 1)
+        stock.refresh_from_db()
+        self.assertEqual((stock.stored_quantity_available, stock.stored_available_until), (3, None))
+
+    def test_verify_command_reports_and_repairs_drift(self):
+        lot = make_lot(self.stock, quantity=5)
+        StockLot.objects.filter(pk=lot.pk).update(quantity=2)
+
+        out = StringIO()
+        call_command("verify_stock_counters", "--dry-run", stdout=out)
+        self.assertIn(f"Stock {self.stock.pk}", out.getvalue())
+        self.assertEqual(Stock.objects.get(pk=self.stock.pk).stored_quantity, 5)
+
+        call_command("verify_stock_counters", stdout=StringIO())
+        self.assertCounters(2, 2)
+        out = StringIO()
+        call_command("verify_stock_counters", stdout=out)
+        self.assertIn("All stock counters match", out.getvalue())
+
+
 # ── StockLot model ───────────────────────────────────────────────────────────
 
 
@@ -424,8 +548,9 @@ class RoutineIntervalPhasesTest(TestCase):
         e1 = make_entry(r, offset_hours=-3)
         make_entry(r, offset_hours=-2)
         make_entry(r, offset_hours=-1)
-        # Simulate a 1-entry prefetch on a routine that has 3 DB entries
-        r._prefetched_entries = [e1]
+        # Simulate stale entry stats on a routine that has 3 DB entries
+        r._latest_entry = [e1]
+        r.entry_total = 1
         with self.assertNumQueries(0):
             count = r.entry_count()
         self.assertEqual(count, 1)
@@ -443,6 +568,163 @@ class RoutineIntervalPhasesTest(TestCase):
         self.assertAlmostEqual(r.next_due_at().timestamp(), expected.timestamp(), delta=1)
 
 
+# ── Bounded entry stats ───────────────────────────────────────────────────────
+
+
+class RoutineWithEntryStatsTest(TestCase):
+    """`Routine.objects.with_entry_stats()` feeds last_entry()/entry_count() without the history."""
+
+    def setUp(self):
+        self.user = make_user()
+
+    def _entries(self, routine, hours_ago_list):
+        now = timezone.now()
+        entries = []
+        for hours_ago in hours_ago_list:
+            ts = now - timedelta(hours=hours_ago)
+            entries.append(RoutineEntry.objects.create(routine=routine, created_at=ts, client_created_at=ts))
+        return entries
+
+    def test_latest_entry_and_count_are_attached(self):
+        r = make_routine(self.user)
+        entries = self._entries(r, [30, 1, 20, 10])
+        routine = Routine.objects.with_entry_stats().get(pk=r.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(routine.last_entry(), entries[1])
+            self.assertEqual(routine.entry_count(), 4)
+
+    def test_only_one_entry_row_is_loaded_per_routine(self):
+        r = make_routine(self.user)
+        self._entries(r, range(1, 40))
+        routine = Routine.objects.with_entry_stats().get(pk=r.pk)
+        self.assertEqual(len(routine._latest_entry), 1)
+
+    def test_never_logged_routine(self):
+        r = make_routine(self.user)
+        routine = Routine.objects.with_entry_stats().get(pk=r.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNone(routine.last_entry())
+            self.assertEqual(routine.entry_count(), 0)
+            self.assertIsNone(routine.next_due_at())
+
+    def test_phased_next_due_uses_annotated_count(self):
+        r = make_routine(self.user)
+        r.interval_phases = [{"count": 2, "interval_hours": 100}, {"interval_hours": 300}]
+        r.save()
+        last = self._entries(r, [5, 2])[-1]
+        routine = Routine.objects.with_entry_stats().get(pk=r.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(routine.next_due_at(), last.client_created_at + timedelta(hours=300))
+
+    def test_stats_are_per_routine(self):
+        a = make_routine(self.user, name="A")
+        b = make_routine(self.user, name="B")
+        self._entries(a, [3, 2, 1])
+        latest_b = self._entries(b, [4])[0]
+        by_name = {r.name: r for r in Routine.objects.with_entry_stats()}
+        self.assertEqual(by_name["A"].entry_count(), 3)
+        self.assertEqual(by_name["B"].entry_count(), 1)
+        self.assertEqual(by_name["B"].last_entry(), latest_b)
+
+
+# ── Materialized due time ─────────────────────────────────────────────────────
+
+
+class RoutineScheduledDueAtTest(APITestCase):
+    """`scheduled_due_at` / `phase_cursor` track `next_due_at()` through every write path."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(user=self.user)
+
+    def _entry_at(self, routine, hours_ago):
+        ts = timezone.now() - timedelta(hours=hours_ago)
+        return RoutineEntry.objects.create(routine=routine, created_at=ts, client_created_at=ts)
+
+    def _assert_matches_live(self, routine):
+        routine.refresh_from_db()
+        fresh = Routine.objects.get(pk=routine.pk)
+        self.assertEqual(routine.scheduled_due_at, fresh.next_due_at())
+
+    def test_never_logged_is_null(self):
+        r = make_routine(self.user)
+        r.refresh_from_db()
+        self.assertIsNone(r.scheduled_due_at)
+        self.assertEqual(r.phase_cursor, 0)
+
+    def test_entry_create_sets_due_time(self):
+        r = make_routine(self.user, interval_hours=24)
+        entry = self._entry_at(r, hours_ago=5)
+        r.refresh_from_db()
+        self.assertEqual(r.scheduled_due_at, entry.client_created_at + timedelta(hours=24))
+
+    def test_log_endpoint_sets_due_time_without_bumping_updated_at(self):
+        r = make_routine(self.user, interval_hours=24)
+        r.refresh_from_db()
+        before = r.updated_at
+        response = self.client.post(f"/api/routines/{r.id}/log/", {})
+        self.assertEqual(response.status_code, 201)
+        self._assert_matches_live(r)
+        self.assertIsNotNone(r.scheduled_due_at)
+        self.assertEqual(r.updated_at, before)
+
+    def test_undo_rewinds_to_previous_entry(self):
+        r = make_routine(self.user, interval_hours=24)
+        older = self._entry_at(r, hours_ago=30)
+        newer = self._entry_at(r, hours_ago=1)
+        response = self.client.delete(f"/api/entries/{newer.id}/")
+        self.assertEqual(response.status_code, 204)
+        r.refresh_from_db()
+        self.assertEqual(r.scheduled_due_at, older.client_created_at + timedelta(hours=24))
+
+    def test_undo_of_only_entry_clears_due_time(self):
+        r = make_routine(self.user)
+        entry = self._entry_at(r, hours_ago=1)
+        self.client.delete(f"/api/entries/{entry.id}/")
+        r.refresh_from_db()
+        self.assertIsNone(r.scheduled_due_at)
+
+    def test_interval_change_moves_due_time(self):
+        r = make_routine(self.user, interval_hours=24)
+        entry = self._entry_at(r, hours_ago=1)
+        response = self.client.patch(f"/api/routines/{r.id}/", {"interval_hours": 48}, format="json")
+        self.assertEqual(response.status_code, 200)
+        r.refresh_from_db()
+        self.assertEqual(r.scheduled_due_at, entry.client_created_at + timedelta(hours=48))
+
+    def test_backdated_first_entry_sets_due_time(self):
+        backdated = timezone.now() - timedelta(hours=10)
+        response = self.client.post(
+            "/api/routines/",
+            {"name": "Backdated", "interval_hours": 24, "backdated_first_entry_at": backdated.isoformat()},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self._assert_matches_live(Routine.objects.get(pk=response.json()["id"]))
+
+    def test_phase_cursor_advances_with_history(self):
+        r = make_routine(self.user)
+        r.interval_phases = [{"count": 2, "interval_hours": 100}, {"interval_hours": 300}]
+        r.save()
+        self._entry_at(r, hours_ago=3)
+        r.refresh_from_db()
+        self.assertEqual(r.phase_cursor, 0)
+        last = self._entry_at(r, hours_ago=2)
+        r.refresh_from_db()
+        self.assertEqual(r.phase_cursor, 1)
+        self.assertEqual(r.scheduled_due_at, last.client_created_at + timedelta(hours=300))
+
+    def test_notes_edit_does_not_recompute(self):
+        r = make_routine(self.user)
+        entry = self._entry_at(r, hours_ago=1)
+        entry.notes = "edited"
+        # The UPDATE alone: the data-version bump and the sync log reuse the
+        # members read when the entry was created, its sync row was written
+        # with it in this transaction, and the schedule is not recomputed.
+        with self.assertNumQueries(1):
+            entry.save(update_fields=["notes"])
+
+
 # ── RoutineEntry model ───────────────────────────────────────────────────────
 
 
@@ -630,8 +912,13 @@ class StockQuantityFieldsTest(TestCase):
         self.user = make_user()
 
     def _backdate(self, lot, days_in_past):
-        """Bypass StockLotSerializer.validate_expiry_date to set a past date."""
+        """Bypass StockLotSerializer.validate_expiry_date to set a past date.
+
+        The queryset update also bypasses the stock counter receivers, so
+        the counters are refreshed by hand.
+        """
         StockLot.objects.filter(pk=lot.pk).update(expiry_date=date.today() - timedelta(days=days_in_past))
+        lot.stock.refresh_counters()
 
     # ── Empty / single-bucket cases ──────────────────────────────────────────
 
@@ -804,6 +1091,7 @@ class RoutineSerializerTest(TestCase):
         make_lot(stock, quantity=4, expiry_date=date.today() + timedelta(days=200))
         expired = make_lot(stock, quantity=3, expiry_date=date.today() + timedelta(days=10))
         StockLot.objects.filter(pk=expired.pk).update(expiry_date=date.today() - timedelta(days=2))
+        stock.refresh_counters()
         r = make_routine(self.user, stock=stock)
         data = RoutineSerializer(r).data
         self.assertEqual(data["stock_quantity"], 7)
@@ -1760,6 +2048,7 @@ class StockConsumeTest(APITestCase):
         make_lot(self.stock, quantity=5, expiry_date=date.today() + timedelta(days=50))
         response = self.client.post(f"/api/stock/{self.stock.id}/consume/", {"quantity": 3})
         self.assertEqual(response.status_code, 200)
+        self.stock.refresh_from_db()
         self.assertEqual(self.stock.quantity, 3)
 
     def test_consume_with_lot_selections(self):
@@ -2235,9 +2524,7 @@ class RoutineViewSetTest(APITestCase):
         make_entry(r)
         response = self.client.get(f"/api/routines/{r.id}/entries/")
         self.assertEqual(response.status_code, 200)
-        data = response.json()
-        count = data.get("count", len(data))
-        self.assertEqual(count, 2)
+        self.assertEqual(len(response.json()["results"]), 2)
 
     def test_entries_only_for_own_routine(self):
         other_routine = make_routine(self.other)
@@ -3656,8 +3943,10 @@ class StockDepletionSerializerTest(TestCase):
     # estimate (depletion_date is None); Tipo 2 = with estimate.
 
     def _backdate_lot(self, lot, days_in_past):
-        """Bypass `StockLotSerializer.validate_expiry_date` to set a past date."""
+        """Bypass `StockLotSerializer.validate_expiry_date` to set a past date
+        (and the stock counter receivers, hence the refresh)."""
         StockLot.objects.filter(pk=lot.pk).update(expiry_date=date.today() - timedelta(days=days_in_past))
+        lot.stock.refresh_counters()
 
     # — Tipo 1: no consumption estimate —
 
@@ -4378,6 +4667,164 @@ class ClientCreatedAtQueryRefactorTest(APITestCase):
         self.assertIn(consumption.id, ids, msg="date_from/date_to must filter by client_created_at")
 
 
+class HistoryPaginationTest(APITestCase):
+    """Keyset pagination and local-day ranges on the history endpoints."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(user=self.user)
+        self.routine = make_routine(self.user)
+
+    def _entry_at(self, when):
+        entry = RoutineEntry.objects.create(routine=self.routine)
+        RoutineEntry.objects.filter(pk=entry.pk).update(created_at=when, client_created_at=when)
+        return entry
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.json()["results"]]
+
+    @patch.object(HistoryCursorPagination, "page_size", 2)
+    def test_pages_follow_cursor_newest_first(self):
+        now = timezone.now()
+        entries = [self._entry_at(now - timedelta(hours=h)) for h in range(5)]
+        # Two rows sharing a timestamp are split by id, not skipped or repeated.
+        tie = self._entry_at(now - timedelta(hours=2))
+
+        seen, url = [], "/api/entries/"
+        while url:
+            response = self.client.get(url)
+            seen += self._ids(response)
+            url = response.json()["next"]
+            self.assertNotIn("count", response.json())
+
+        expected = [entries[0].id, entries[1].id, tie.id, entries[2].id, entries[3].id, entries[4].id]
+        self.assertEqual(seen, expected)
+
+    @patch.object(HistoryCursorPagination, "page_size", 2)
+    def test_new_entries_do_not_shift_later_pages(self):
+        now = timezone.now()
+        entries = [self._entry_at(now - timedelta(hours=h)) for h in range(1, 5)]
+        first = self.client.get("/api/entries/").json()
+
+        self._entry_at(now)
+
+        second = self._ids(self.client.get(first["next"]))
+        self.assertEqual(second, [entries[2].id, entries[3].id])
+
+    @patch.object(HistoryCursorPagination, "page_size", 2)
+    def test_later_page_runs_no_count_or_offset(self):
+        now = timezone.now()
+        for h in range(6):
+            self._entry_at(now - timedelta(hours=h))
+        second = self.client.get("/api/entries/").json()["next"]
+        third = self.client.get(second).json()["next"]
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(self._ids(self.client.get(third))), 2)
+        sql = " ".join(q["sql"] for q in ctx.captured_queries).upper()
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn("OFFSET", sql)
+
+    def test_routine_entries_action_is_cursor_paginated(self):
+        self._entry_at(timezone.now())
+        data = self.client.get(f"/api/routines/{self.routine.id}/entries/").json()
+        self.assertEqual(set(data), {"next", "previous", "results"})
+
+    def test_date_range_is_a_local_day_in_user_timezone(self):
+        self.user.timezone = "America/New_York"
+        self.user.save(update_fields=["timezone"])
+        # 2024-03-10 03:30 UTC is still 2024-03-09 in New York.
+        late_evening = self._entry_at(dt.datetime(2024, 3, 10, 3, 30, tzinfo=dt.UTC))
+        next_morning = self._entry_at(dt.datetime(2024, 3, 10, 14, 0, tzinfo=dt.UTC))
+
+        ids = self._ids(self.client.get("/api/entries/", {"date_from": "2024-03-09", "date_to": "2024-03-09"}))
+        self.assertEqual(ids, [late_evening.id])
+        ids = self._ids(self.client.get("/api/entries/", {"date_from": "2024-03-10"}))
+        self.assertEqual(ids, [next_morning.id])
+
+    def test_date_filter_compares_the_bare_column(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/stock-consumptions/", {"date_from": "2024-03-09", "date_to": "2024-03-10"})
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn("::date", sql)
+        self.assertNotIn("DATE(", sql.upper())
+
+    def test_malformed_date_is_rejected(self):
+        response = self.client.get("/api/entries/", {"date_from": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("date_from", response.json())
+
+
+@skipUnless(connection.vendor == "postgresql", "reads PostgreSQL EXPLAIN output")
+class IndexUsageTest(APITestCase):
+    """The hot query shapes are served by the indexes of migration 0019.
+
+    Each test runs the production path, captures the SQL it sent and
+    explains that, so a change to the query is checked against the index
+    too. Test tables are tiny, so sequential scans are switched off for the
+    transaction: the assertion is that a matching index exists and the
+    planner can use it, not that it wins on ten rows.
+    """
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(user=self.user)
+        self.stock = make_stock(self.user)
+        self.routine = make_routine(self.user, stock=self.stock)
+        make_lot(self.stock, quantity=5, lot_number="L1")
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def captured(self, action, *fragments):
+        """The one query `action` runs whose SQL holds every fragment."""
+        with CaptureQueriesContext(connection) as ctx:
+            action()
+        matches = [q["sql"] for q in ctx.captured_queries if all(f in q["sql"] for f in fragments)]
+        self.assertEqual(len(matches), 1, msg=[q["sql"] for q in ctx.captured_queries])
+        return matches[0]
+
+    def get(self, path, params=None):
+        self.assertEqual(self.client.get(path, params).status_code, 200)
+
+    def assertUsesIndex(self, sql, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn(name, plan, msg=plan)
+
+    def test_fefo_lot_selection(self):
+        sql = self.captured(lambda: self.stock.consume_lots(1), 'FROM "routines_stocklot"', "FOR UPDATE")
+        self.assertUsesIndex(sql, "stocklot_fefo_idx")
+
+    def test_lot_identity_lookup(self):
+        self.assertEqual(self.client.post(f"/api/routines/{self.routine.id}/log/", {}).status_code, 201)
+        entry = self.routine.entries.get()
+        sql = self.captured(
+            lambda: self.assertEqual(self.client.delete(f"/api/entries/{entry.id}/").status_code, 204),
+            'FROM "routines_stocklot"',
+            '"lot_number" =',
+        )
+        self.assertUsesIndex(sql, "stocklot_identity_idx")
+
+    def test_latest_entry_lookup(self):
+        make_entry(self.routine)
+        sql = self.captured(lambda: self.get("/api/dashboard/"), 'FROM "routines_routineentry"', "ROW_NUMBER()")
+        self.assertUsesIndex(sql, "entry_routine_recent_idx")
+
+    def test_entry_history_date_filter(self):
+        params = {"routine": self.routine.id, "date_from": "2024-03-01", "date_to": "2024-03-31"}
+        sql = self.captured(lambda: self.get("/api/entries/", params), 'FROM "routines_routineentry"', "ORDER BY")
+        self.assertUsesIndex(sql, "entry_routine_recent_idx")
+
+    def test_consumption_history_date_filter(self):
+        params = {"stock": self.stock.id, "date_from": "2024-03-01"}
+        sql = self.captured(
+            lambda: self.get("/api/stock-consumptions/", params), 'FROM "routines_stockconsumption"', "ORDER BY"
+        )
+        self.assertUsesIndex(sql, "consumption_stock_recent_idx")
+
+
 class QueryBudgetTests(APITestCase):
     """Regression tests against N+1 in list endpoints.
 
@@ -4399,14 +4846,19 @@ class QueryBudgetTests(APITestCase):
     over.
     """
 
-    BUDGET_ROUTINES_LIST = 5
+    # The routines, stock and dashboard budgets include one query for the
+    # time-dependent ETag state (`list_etag_state` / `_due_state`). It is
+    # served from the response cache in production; the test settings turn
+    # that cache off.
+    BUDGET_ROUTINES_LIST = 6
     # 7 → 8 in T094: the `pins` prefetch backing `is_pinned`. One query for the
     # whole page, not one per row — `UserStockPinTest` pins several stocks and
     # asserts the total is unchanged.
-    BUDGET_STOCK_LIST = 8
-    BUDGET_DASHBOARD = 4
-    BUDGET_ENTRIES_LIST = 2
-    BUDGET_STOCK_CONSUMPTIONS_LIST = 2
+    BUDGET_STOCK_LIST = 9
+    BUDGET_DASHBOARD = 5
+    # 2 → 1: cursor pagination runs no paginator count.
+    BUDGET_ENTRIES_LIST = 1
+    BUDGET_STOCK_CONSUMPTIONS_LIST = 1
 
     @classmethod
     def setUpTestData(cls):
@@ -4458,7 +4910,8 @@ class QueryBudgetTests(APITestCase):
         Budget breakdown (~5):
         - 1 SELECT count for the paginator
         - 1 SELECT routines (with select_related stock+user)
-        - 1 prefetch entries (latest, _prefetched_entries)
+        - 1 prefetch entries (latest only, _latest_entry; the count is an
+          annotation on the routines SELECT)
         - 1 prefetch shared_with
         - 1 prefetch stock__lots
         """
@@ -4488,6 +4941,26 @@ class QueryBudgetTests(APITestCase):
             response = self.client.get("/api/dashboard/")
         self.assertEqual(response.status_code, 200)
 
+    def test_dashboard_loads_latest_entry_only(self):
+        """The entry history is never loaded: one windowed row per routine."""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/dashboard/")
+        self.assertEqual(response.status_code, 200)
+        # The routines SELECT counts entries in a subquery; only the prefetch loads rows.
+        entry_queries = [
+            q["sql"]
+            for q in ctx.captured_queries
+            if 'FROM "routines_routineentry"' in q["sql"] and "COUNT(" not in q["sql"]
+        ]
+        self.assertEqual(len(entry_queries), 1)
+        self.assertIn("ROW_NUMBER", entry_queries[0])
+        routines = response.json()["due"] + response.json()["upcoming"]
+        latest = RoutineEntry.objects.filter(routine__name=routines[0]["name"]).order_by("-client_created_at").first()
+        self.assertEqual(
+            dt.datetime.fromisoformat(routines[0]["last_entry_at"].replace("Z", "+00:00")),
+            latest.client_created_at,
+        )
+
     def test_entries_list_query_count_is_constant(self):
         """GET /api/entries/ stays under BUDGET_ENTRIES_LIST."""
         with self.assertNumQueries(self.BUDGET_ENTRIES_LIST):
@@ -4874,3 +5347,247 @@ class UserStockPinTest(APITestCase):
             self.assertEqual(res.status_code, 200)
         self.assertEqual(len(pinned.captured_queries), baseline)
         self.assertEqual(sum(1 for row in res.data["results"] if row["is_pinned"]), settings.STOCK_MAX_PINNED_ITEMS)
+
+
+@override_settings(API_CACHE_SECONDS=600)
+class ResponseCacheTests(APITestCase):
+    """Dashboard and list payloads are cached per user and data version."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.owner = make_user("cache-owner")
+        self.member = make_user("cache-member")
+        self.owner.contacts.add(self.member)
+        self.client.force_authenticate(self.owner)
+
+    def names(self, path="/api/dashboard/"):
+        body = self.client.get(path).json()
+        if "due" in body:
+            return sorted(r["name"] for r in body["due"] + body["upcoming"])
+        return sorted(r["name"] for r in body.get("results", body))
+
+    def test_repeat_dashboard_is_served_from_cache(self):
+        make_entry(make_routine(self.owner), offset_hours=-1)
+        self.client.get("/api/dashboard/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/dashboard/")
+        self.assertEqual(len(response.json()["upcoming"]), 1)
+
+    def test_logging_invalidates_dashboard(self):
+        routine = make_routine(self.owner)
+        self.assertEqual(len(self.client.get("/api/dashboard/").json()["due"]), 1)
+        self.client.post(f"/api/routines/{routine.id}/log/", {})
+        body = self.client.get("/api/dashboard/").json()
+        self.assertEqual((len(body["due"]), len(body["upcoming"])), (0, 1))
+
+    def test_time_fields_are_recomputed_on_hit(self):
+        make_entry(make_routine(self.owner, interval_hours=72), offset_hours=-1)
+        first = self.client.get("/api/dashboard/").json()["upcoming"][0]
+        later = timezone.now() + timedelta(hours=96)
+        with patch("django.utils.timezone.now", return_value=later), self.assertNumQueries(0):
+            body = self.client.get("/api/dashboard/").json()
+        self.assertEqual(body["upcoming"], [])
+        (item,) = body["due"]
+        self.assertTrue(item["is_overdue"])
+        self.assertAlmostEqual(item["hours_until_due"], first["hours_until_due"] - 96, delta=0.1)
+
+    def test_owner_edit_invalidates_members(self):
+        routine = make_routine(self.owner, name="Before")
+        routine.shared_with.add(self.member)
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.names(), ["Before"])
+        routine.name = "After"
+        routine.save()
+        self.assertEqual(self.names(), ["After"])
+        self.assertEqual(self.names("/api/routines/"), ["After"])
+
+    def test_partial_routine_save_invalidates_without_refreshing_schedule(self):
+        routine = make_routine(self.owner, name="Before")
+        self.assertEqual(self.names(), ["Before"])
+        routine.name = "After"
+        with patch.object(Routine, "refresh_schedule") as refresh:
+            routine.save(update_fields=["name"])
+        refresh.assert_not_called()
+        self.assertEqual(self.names(), ["After"])
+
+    def test_unsharing_invalidates_removed_member(self):
+        stock = make_stock(self.owner, name="Shared stock")
+        stock.shared_with.add(self.member)
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.names("/api/stock/"), ["Shared stock"])
+        stock.shared_with.remove(self.member)
+        self.assertEqual(self.names("/api/stock/"), [])
+
+    def test_lot_change_invalidates_routines_of_the_stock(self):
+        stock = make_stock(self.owner)
+        lot = make_lot(stock, quantity=5)
+        routine = make_routine(self.member, stock=stock)
+        routine.shared_with.add(self.owner)
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.client.get("/api/routines/").json()["results"][0]["stock_quantity"], 5)
+        lot.quantity = 3
+        lot.save()
+        self.assertEqual(self.client.get("/api/routines/").json()["results"][0]["stock_quantity"], 3)
+
+    def test_entry_note_edit_invalidates_entries_list(self):
+        entry = make_entry(make_routine(self.owner), notes="old")
+        self.assertEqual(self.client.get("/api/entries/").json()["results"][0]["notes"], "old")
+        entry.notes = "new"
+        entry.save(update_fields=["notes"])
+        self.assertEqual(self.client.get("/api/entries/").json()["results"][0]["notes"], "new")
+
+    def test_profile_change_invalidates_other_members(self):
+        routine = make_routine(self.owner)
+        routine.shared_with.add(self.member)
+        self.client.get("/api/routines/")
+        self.member.first_name = "Renamed"
+        self.member.save()
+        details = self.client.get("/api/routines/").json()["results"][0]["shared_with_details"]
+        self.assertEqual(details[0]["first_name"], "Renamed")
+
+    def test_sparse_fields_bypass_cache(self):
+        make_routine(self.owner)
+        self.client.get("/api/routines/?fields=id,name")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/routines/?fields=id,name")
+        self.assertGreater(len(ctx), 0)
+        self.assertEqual(set(response.json()["results"][0]), {"id", "name"})
+
+    def test_bump_is_repeated_on_commit(self):
+        from apps.core.versioning import bump_data_version, data_version
+
+        before = data_version(self.owner.pk)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            bump_data_version([self.owner.pk])
+        immediate = data_version(self.owner.pk)
+        self.assertNotEqual(before, immediate)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(data_version(self.owner.pk), immediate)
+
+    def test_audiences_are_read_once_per_transaction(self):
+        stock = make_stock(self.owner)
+        with transaction.atomic():
+            stock_members([stock.pk])
+            with self.assertNumQueries(0):
+                self.assertEqual(stock_members([stock.pk]), {stock.pk: {self.owner.pk}})
+            # A share drops the memo: the new member is seen right away.
+            stock.shared_with.add(self.member)
+            self.assertEqual(stock_members([stock.pk])[stock.pk], {self.owner.pk, self.member.pk})
+
+    def test_one_commit_bump_per_transaction(self):
+        # Creating the stock queued the transaction's commit bump already.
+        stock = make_stock(self.owner)
+        with self.captureOnCommitCallbacks() as callbacks:
+            for quantity in (1, 2, 3):
+                make_lot(stock, quantity=quantity)
+        self.assertEqual(callbacks, [])
+
+
+@override_settings(API_CACHE_SECONDS=600)
+class ConditionalGetTests(APITestCase):
+    """List endpoints and the dashboard answer If-None-Match with 304."""
+
+    PATHS = ("/api/dashboard/", "/api/routines/", "/api/stock/", "/api/entries/", "/api/stock-consumptions/")
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.owner = make_user("etag-owner")
+        self.member = make_user("etag-member")
+        self.owner.contacts.add(self.member)
+        self.client.force_authenticate(self.owner)
+
+    def revalidate(self, path, etag):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_lists_answer_304(self):
+        make_entry(make_routine(self.owner, stock=make_stock(self.owner)), offset_hours=-1)
+        for path in self.PATHS:
+            with self.subTest(path=path):
+                first = self.client.get(path)
+                self.assertEqual(first.status_code, 200)
+                self.assertIn("private", first["Cache-Control"])
+                self.assertIn("no-cache", first["Cache-Control"])
+                response = self.revalidate(path, first["ETag"])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b"")
+                self.assertEqual(response["ETag"], first["ETag"])
+
+    def test_304_runs_no_queries_once_warm(self):
+        make_entry(make_routine(self.owner), offset_hours=-1)
+        etag = self.client.get("/api/dashboard/")["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate("/api/dashboard/", etag).status_code, 304)
+
+    @override_settings(API_CACHE_SECONDS=0)
+    def test_304_skips_serialization_without_the_cache(self):
+        make_routine(self.owner)
+        etag = self.client.get("/api/routines/")["ETag"]
+        with patch.object(RoutineSerializer, "to_representation") as to_representation:
+            self.assertEqual(self.revalidate("/api/routines/", etag).status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_write_changes_etag(self):
+        routine = make_routine(self.owner)
+        etag = self.client.get("/api/dashboard/")["ETag"]
+        self.client.post(f"/api/routines/{routine.id}/log/", {})
+        response = self.revalidate("/api/dashboard/", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_member_sees_owner_writes(self):
+        routine = make_routine(self.owner, name="Before")
+        routine.shared_with.add(self.member)
+        self.client.force_authenticate(self.member)
+        etag = self.client.get("/api/routines/")["ETag"]
+        routine.name = "After"
+        routine.save()
+        self.assertEqual(self.revalidate("/api/routines/", etag).status_code, 200)
+
+    @override_settings(API_CACHE_SHARED=False)
+    def test_no_etag_without_a_shared_cache(self):
+        make_routine(self.owner)
+        for path in self.PATHS:
+            with self.subTest(path=path):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH="*")
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("ETag", response)
+
+    def test_due_fields_moving_with_the_clock_change_etag(self):
+        make_entry(make_routine(self.owner, interval_hours=72), offset_hours=-1)
+        etag = self.client.get("/api/dashboard/")["ETag"]
+        later = timezone.now() + timedelta(hours=1)
+        with patch("django.utils.timezone.now", return_value=later):
+            response = self.revalidate("/api/dashboard/", etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_consumption_leaving_the_window_changes_stock_etag(self):
+        stock = make_stock(self.owner)
+        consumption = make_stock_consumption(stock)
+        StockConsumption.objects.filter(pk=consumption.pk).update(
+            client_created_at=timezone.now() - timedelta(days=settings.STOCK_DIRECT_CONSUMPTION_HALF_DAYS, hours=-1)
+        )
+        etag = self.client.get("/api/stock/")["ETag"]
+        with patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(minutes=30)):
+            self.assertEqual(self.revalidate("/api/stock/", etag).status_code, 304)
+        with patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(hours=2)):
+            self.assertEqual(self.revalidate("/api/stock/", etag).status_code, 200)
+
+    def test_etag_is_per_user_and_per_query(self):
+        routine = make_routine(self.owner)
+        routine.shared_with.add(self.member)
+        etag = self.client.get("/api/routines/")["ETag"]
+        self.assertEqual(self.revalidate("/api/routines/?fields=id", etag).status_code, 200)
+        self.client.force_authenticate(self.member)
+        self.assertEqual(self.revalidate("/api/routines/", etag).status_code, 200)
+
+    def test_weak_list_and_wildcard_forms_match(self):
+        make_routine(self.owner)
+        etag = self.client.get("/api/routines/")["ETag"]
+        for header in (f"W/{etag}", f'"other", {etag}', "*"):
+            with self.subTest(header=header):
+                self.assertEqual(self.revalidate("/api/routines/", header).status_code, 304)
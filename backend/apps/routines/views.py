@@ -12,12 +12,25 @@ from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from apps.core.mixins import OptimisticLockingMixin
+from apps.core.mixins import CachedListMixin, ConditionalListMixin, OptimisticLockingMixin, conditional_get
+from apps.core.pagination import HistoryCursorPagination, local_day_range
 from apps.core.permissions import IsOwner
+from apps.core.versioning import cached_payload, data_etag, versioned
 from apps.notifications.models import NotificationState
 from apps.notifications.push import notify_routine_shared, notify_stock_shared
-
-from .models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot, UserStockGroup, UserStockPin
+from apps.sync.models import entries_deleted
+
+from .models import (
+    Routine,
+    RoutineEntry,
+    Stock,
+    StockConsumption,
+    StockGroup,
+    StockLot,
+    UserStockGroup,
+    UserStockPin,
+    lot_writes,
+)
 from .serializers import (
     ClientTimestampInputSerializer,
     RoutineEntrySerializer,
@@ -41,44 +54,74 @@ class StockGroupViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class StockViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
+def stock_queryset(user):
+    """Stock visible to `user`, with every prefetch `StockSerializer` reads."""
+    active_routines = Prefetch(
+        "routines",
+        queryset=Routine.objects.filter(is_active=True).select_related("user"),
+        to_attr="active_routines",
+    )
+    consumptions_window_start = timezone.now() - timedelta(
+        days=settings.STOCK_DIRECT_CONSUMPTION_WINDOW_DAYS,
+    )
+    recent_consumptions = Prefetch(
+        "consumptions",
+        queryset=StockConsumption.objects.filter(client_created_at__gte=consumptions_window_start),
+        to_attr="recent_consumptions",
+    )
+    return (
+        Stock.objects.filter(Q(user=user) | Q(shared_with=user))
+        .distinct()
+        .select_related("group", "user")
+        .prefetch_related(
+            "lots",
+            "shared_with",
+            active_routines,
+            recent_consumptions,
+            Prefetch(
+                "group_overrides",
+                queryset=UserStockGroup.objects.select_related("group").filter(user=user),
+                to_attr="_my_group_override",
+            ),
+            Prefetch(
+                "pins",
+                queryset=UserStockPin.objects.filter(user=user),
+                to_attr="_my_pin",
+            ),
+        )
+        .order_by("name")
+    )
+
+
+class StockViewSet(ConditionalListMixin, CachedListMixin, OptimisticLockingMixin, viewsets.ModelViewSet):
     serializer_class = StockSerializer
 
     def get_queryset(self):
-        active_routines = Prefetch(
-            "routines",
-            queryset=Routine.objects.filter(is_active=True).select_related("user"),
-            to_attr="active_routines",
-        )
-        consumptions_window_start = timezone.now() - timedelta(
-            days=settings.STOCK_DIRECT_CONSUMPTION_WINDOW_DAYS,
-        )
-        recent_consumptions = Prefetch(
-            "consumptions",
-            queryset=StockConsumption.objects.filter(client_created_at__gte=consumptions_window_start),
-            to_attr="recent_consumptions",
-        )
-        return (
-            Stock.objects.filter(Q(user=self.request.user) | Q(shared_with=self.request.user))
-            .distinct()
-            .select_related("group", "user")
-            .prefetch_related(
-                "lots",
-                "shared_with",
-                active_routines,
-                recent_consumptions,
-                Prefetch(
-                    "group_overrides",
-                    queryset=UserStockGroup.objects.select_related("group").filter(user=self.request.user),
-                    to_attr="_my_group_override",
-                ),
-                Prefetch(
-                    "pins",
-                    queryset=UserStockPin.objects.filter(user=self.request.user),
-                    to_attr="_my_pin",
-                ),
+        return stock_queryset(self.request.user)
+
+    def list_etag_state(self):
+        """How many consumptions sit in each half of the direct-consumption
+        window: the estimates only move with the clock when these change."""
+        user = self.request.user
+
+        def recent():
+            # Anything older has left the window for good; anything newer
+            # bumps the data version.
+            window_start = timezone.now() - timedelta(days=settings.STOCK_DIRECT_CONSUMPTION_WINDOW_DAYS)
+            visible = Stock.objects.filter(Q(user=user) | Q(shared_with=user)).values("pk")
+            return list(
+                StockConsumption.objects.filter(stock__in=visible, client_created_at__gte=window_start).values_list(
+                    "client_created_at", flat=True
+                )
             )
-            .order_by("name")
+
+        now = timezone.now()
+        window_start = now - timedelta(days=settings.STOCK_DIRECT_CONSUMPTION_WINDOW_DAYS)
+        half_ago = now - timedelta(days=settings.STOCK_DIRECT_CONSUMPTION_HALF_DAYS)
+        timestamps = versioned(user.pk, "stock-consumptions", recent)
+        return (
+            sum(1 for created in timestamps if created >= window_start),
+            sum(1 for created in timestamps if created >= half_ago),
         )
 
     def get_permissions(self):
@@ -296,38 +339,54 @@ class StockLotViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class RoutineViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
+def routine_queryset(user):
+    """Routines visible to `user`, for the list and detail endpoints.
+
+    Prefetch budget for the serializer fields:
+    - ``with_entry_stats`` — the latest entry (one row per routine) and
+      the entry count, used by ``Routine.last_entry`` / ``entry_count``
+      (and therefore ``next_due_at``, ``is_due``, ``is_overdue``,
+      ``hours_until_due``). Bounded regardless of history length.
+    - ``shared_with`` — used by ``SharedWithMixin``.
+    - ``stock__lots`` — used by ``stock_quantity``,
+      ``stock_quantity_available`` and ``get_requires_lot_selection``.
+      Without it each routine triggers three extra queries.
+    """
+    return (
+        Routine.objects.filter(Q(user=user) | Q(shared_with=user))
+        .distinct()
+        .select_related("stock", "user")
+        .with_entry_stats()
+        .prefetch_related("shared_with", "stock__lots")
+    )
+
+
+class RoutineViewSet(ConditionalListMixin, CachedListMixin, OptimisticLockingMixin, viewsets.ModelViewSet):
     serializer_class = RoutineSerializer
 
     def get_queryset(self):
-        """Routine list/detail queryset.
-
-        Prefetch budget for the serializer fields:
-        - ``entries`` (latest, exposed as ``_prefetched_entries``) — used by
-          ``Routine.last_entry`` (and therefore ``next_due_at``, ``is_due``,
-          ``is_overdue``, ``hours_until_due``).
-        - ``shared_with`` — used by ``SharedWithMixin``.
-        - ``stock__lots`` — used by ``stock_quantity``,
-          ``stock_quantity_available`` and ``get_requires_lot_selection``.
-          Without it each routine triggers three extra queries.
-        """
-        latest_entry = Prefetch(
-            "entries",
-            queryset=RoutineEntry.objects.order_by("-client_created_at"),
-            to_attr="_prefetched_entries",
-        )
-        return (
-            Routine.objects.filter(Q(user=self.request.user) | Q(shared_with=self.request.user))
-            .distinct()
-            .select_related("stock", "user")
-            .prefetch_related(latest_entry, "shared_with", "stock__lots")
-        )
+        if self.action == "log":
+            # Reads the stored stock counter and answers with the entry:
+            # none of the serializer prefetches are needed.
+            return (
+                Routine.objects.filter(Q(user=self.request.user) | Q(shared_with=self.request.user))
+                .distinct()
+                .select_related("stock")
+            )
+        return routine_queryset(self.request.user)
 
     def get_permissions(self):
         if self.action in ("update", "partial_update", "destroy"):
             return [IsAuthenticated(), IsOwner()]
         return super().get_permissions()
 
+    def refresh_cached_list(self, payload):
+        for item in payload["results"] if isinstance(payload, dict) else payload:
+            RoutineSerializer.refresh_due_fields(item)
+
+    def list_etag_state(self):
+        return _due_state(self.request.user, active_only=False)
+
     def perform_create(self, serializer):
         routine = serializer.save(user=self.request.user)
         logger.info("Routine %r created (user %s).", routine.name, self.request.user.username)
@@ -370,13 +429,13 @@ class RoutineViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
         # recorded as "consumed" while no stock actually existed — an
         # audit hole that also let `pain_relief` (seeded with 0-qty
         # Ibuprofen) be marked done without blocking in the UI.
-        if routine.stock and routine.stock.quantity < routine.stock_usage:
+        if routine.stock and routine.stock.stored_quantity < routine.stock_usage:
             return Response(
                 {
                     "detail": "Insufficient stock to log this routine.",
                     "code": "insufficient_stock",
                     "required": routine.stock_usage,
-                    "available": routine.stock.quantity,
+                    "available": routine.stock.stored_quantity,
                 },
                 status=status.HTTP_422_UNPROCESSABLE_ENTITY,
             )
@@ -399,18 +458,19 @@ class RoutineViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
                 entry.save(update_fields=["consumed_lots"])
                 routine.stock.save(update_fields=["updated_at"])
 
-            # Reset notification state so the worker doesn't send stale reminders
-            state, _ = NotificationState.objects.get_or_create(routine=routine)
-            state.last_due_notification = None
-            state.last_reminder = None
-            state.save(update_fields=["last_due_notification", "last_reminder"])
+            # Reset notification state so the worker doesn't send stale reminders.
+            # A single UPDATE: a missing row has nothing to reset, and the
+            # worker creates it fresh the next time the routine is due.
+            NotificationState.objects.filter(routine=routine).update(
+                last_due_notification=None, last_reminder=None, next_reminder_at=None
+            )
 
         logger.info("Routine %r logged (user %s).", routine.name, request.user.username)
         return Response(RoutineEntrySerializer(entry).data, status=status.HTTP_201_CREATED)
 
-    @action(detail=True, methods=["get"], url_path="entries")
+    @action(detail=True, methods=["get"], url_path="entries", pagination_class=HistoryCursorPagination)
     def entries(self, request, pk=None):
-        """Return the full entry history for a single routine."""
+        """Return the full entry history for a single routine, newest first."""
         routine = self.get_object()
         qs = routine.entries.all()
         page = self.paginate_queryset(qs)
@@ -420,6 +480,8 @@ class RoutineViewSet(OptimisticLockingMixin, viewsets.ModelViewSet):
 
 
 class StockConsumptionViewSet(
+    ConditionalListMixin,
+    CachedListMixin,
     OptimisticLockingMixin,
     mixins.ListModelMixin,
     mixins.UpdateModelMixin,
@@ -428,28 +490,23 @@ class StockConsumptionViewSet(
     """List stock consumptions and edit notes."""
 
     serializer_class = StockConsumptionSerializer
+    pagination_class = HistoryCursorPagination
 
     def get_queryset(self):
-        qs = (
-            StockConsumption.objects.filter(
-                Q(stock__user=self.request.user) | Q(stock__shared_with=self.request.user),
-            )
-            .distinct()
-            .select_related("stock", "consumed_by")
-        )
+        # Visibility through a subquery on the stock rather than a join on
+        # `shared_with`: no duplicate rows to `DISTINCT` away, so the
+        # keyset page reads straight off the ordering.
+        visible = Stock.objects.filter(Q(user=self.request.user) | Q(shared_with=self.request.user)).values("pk")
+        qs = StockConsumption.objects.filter(stock__in=visible).select_related("stock", "consumed_by")
         stock_id = self.request.query_params.get("stock")
         if stock_id:
             qs = qs.filter(stock_id=stock_id)
-        date_from = self.request.query_params.get("date_from")
-        date_to = self.request.query_params.get("date_to")
-        if date_from:
-            qs = qs.filter(client_created_at__date__gte=date_from)
-        if date_to:
-            qs = qs.filter(client_created_at__date__lte=date_to)
-        return qs
+        return qs.filter(**local_day_range(self.request))
 
 
 class RoutineEntryViewSet(
+    ConditionalListMixin,
+    CachedListMixin,
     OptimisticLockingMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -460,25 +517,18 @@ class RoutineEntryViewSet(
     """Global entry history for the authenticated user."""
 
     serializer_class = RoutineEntrySerializer
+    pagination_class = HistoryCursorPagination
 
     def get_queryset(self):
-        qs = (
-            RoutineEntry.objects.filter(
-                Q(routine__user=self.request.user) | Q(routine__shared_with=self.request.user),
-            )
-            .distinct()
-            .select_related("routine", "routine__stock", "completed_by")
+        # See `StockConsumptionViewSet.get_queryset` for the subquery.
+        visible = Routine.objects.filter(Q(user=self.request.user) | Q(shared_with=self.request.user)).values("pk")
+        qs = RoutineEntry.objects.filter(routine__in=visible).select_related(
+            "routine", "routine__stock", "completed_by"
         )
         routine_id = self.request.query_params.get("routine")
         if routine_id:
             qs = qs.filter(routine_id=routine_id)
-        date_from = self.request.query_params.get("date_from")
-        date_to = self.request.query_params.get("date_to")
-        if date_from:
-            qs = qs.filter(client_created_at__date__gte=date_from)
-        if date_to:
-            qs = qs.filter(client_created_at__date__lte=date_to)
-        return qs
+        return qs.filter(**local_day_range(self.request))
 
     def destroy(self, request, *args, **kwargs):
         """
@@ -513,34 +563,38 @@ class RoutineEntryViewSet(
         with transaction.atomic():
             stock = entry.routine.stock
             if stock and entry.consumed_lots:
-                for lot_data in entry.consumed_lots:
-                    qty = int(lot_data.get("quantity", 0) or 0)
-                    if qty <= 0:
-                        continue
-                    lot_number = lot_data.get("lot_number") or ""
-                    expiry_date = lot_data.get("expiry_date")
-                    serial_number = lot_data.get("serial_number") or ""
-                    if serial_number:
-                        lookup = {"serial_number": serial_number}
-                    else:
-                        lookup = {
-                            "lot_number": lot_number,
-                            "expiry_date": expiry_date,
-                            "serial_number": "",
-                        }
-                    lot = StockLot.objects.select_for_update().filter(stock=stock, **lookup).first()
-                    if lot is not None:
-                        lot.quantity += qty
-                        lot.save(update_fields=["quantity"])
-                    else:
-                        StockLot.objects.create(
-                            stock=stock,
-                            lot_number=lot_number,
-                            expiry_date=expiry_date,
-                            serial_number=serial_number,
-                            quantity=qty,
-                        )
+                with lot_writes(stock):
+                    for lot_data in entry.consumed_lots:
+                        qty = int(lot_data.get("quantity", 0) or 0)
+                        if qty <= 0:
+                            continue
+                        lot_number = lot_data.get("lot_number") or ""
+                        expiry_date = lot_data.get("expiry_date")
+                        serial_number = lot_data.get("serial_number") or ""
+                        if serial_number:
+                            lookup = {"serial_number": serial_number}
+                        else:
+                            lookup = {
+                                "lot_number": lot_number,
+                                "expiry_date": expiry_date,
+                                "serial_number": "",
+                            }
+                        lot = StockLot.objects.select_for_update().filter(stock=stock, **lookup).first()
+                        if lot is not None:
+                            lot.quantity += qty
+                            lot.save(update_fields=["quantity"])
+                        else:
+                            StockLot.objects.create(
+                                stock=stock,
+                                lot_number=lot_number,
+                                expiry_date=expiry_date,
+                                serial_number=serial_number,
+                                quantity=qty,
+                            )
+            entry_id = entry.pk
             entry.delete()
+            entry.routine.refresh_schedule()
+            entries_deleted(entry.routine_id, [entry_id])
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -551,38 +605,65 @@ def dashboard(request):
     Returns routines split into two groups:
     - due: already overdue or never logged
     - upcoming: not yet due, ordered by next due date
+
+    The serialized routines come from the per-user response cache when
+    nothing changed since the last call; their time-dependent fields are
+    re-evaluated and the split redone on every call. A client that already
+    holds the current ETag gets a 304 before any of that.
     """
-    latest_entry = Prefetch(
-        "entries",
-        queryset=RoutineEntry.objects.order_by("-client_created_at"),
-        to_attr="_prefetched_entries",
-    )
-    # Mirrors RoutineViewSet.get_queryset's prefetch budget: stock__lots is
-    # required to keep the serializer's stock_quantity / stock_quantity_available /
-    # requires_lot_selection fields query-free.
-    routines = (
-        Routine.objects.filter(
-            Q(user=request.user) | Q(shared_with=request.user),
-            is_active=True,
+
+    def build():
+        # Mirrors RoutineViewSet.get_queryset's prefetch budget: stock__lots is
+        # required to keep the serializer's stock_quantity / stock_quantity_available /
+        # requires_lot_selection fields query-free.
+        routines = (
+            Routine.objects.filter(
+                Q(user=request.user) | Q(shared_with=request.user),
+                is_active=True,
+            )
+            .distinct()
+            .select_related("stock", "user")
+            .with_entry_stats()
+            .prefetch_related("shared_with", "stock__lots")
         )
-        .distinct()
-        .select_related("stock", "user")
-        .prefetch_related(latest_entry, "shared_with", "stock__lots")
-    )
+        return [RoutineSerializer(routine, context={"request": request}).data for routine in routines]
 
-    due = []
-    upcoming = []
+    def refresh(items):
+        for item in items:
+            RoutineSerializer.refresh_due_fields(item)
 
-    for routine in routines:
-        is_due = routine.is_due()
-        serialized = RoutineSerializer(routine, context={"request": request}).data
+    def respond():
+        due = []
+        upcoming = []
 
-        if is_due:
-            due.append(serialized)
-        else:
-            upcoming.append(serialized)
+        for serialized in cached_payload(request, "dashboard", build, refresh=refresh):
+            if serialized["is_due"]:
+                due.append(serialized)
+            else:
+                upcoming.append(serialized)
+
+        # Sort upcoming by next_due_at ascending
+        upcoming.sort(key=lambda r: r["next_due_at"] or "")
+
+        return Response({"due": due, "upcoming": upcoming})
+
+    return conditional_get(request, lambda: data_etag(request, "dashboard", _due_state(request.user)), respond)
+
+
+def _due_state(user, active_only=True):
+    """The due fields of `user`'s routines as of now — the part of a routine
+    payload that changes with the clock rather than with a write. Evaluated
+    from the stored schedule, so no serializer or entry query is involved."""
 
-    # Sort upcoming by next_due_at ascending
-    upcoming.sort(key=lambda r: r["next_due_at"] or "")
+    def schedule():
+        routines = Routine.objects.filter(Q(user=user) | Q(shared_with=user))
+        if active_only:
+            routines = routines.filter(is_active=True)
+        return list(routines.distinct().order_by("pk").values_list("scheduled_due_at", "user__timezone"))
 
-    return Response({"due": due, "upcoming": upcoming})
+    state = []
+    for due, tz_name in versioned(user.pk, "schedule" if active_only else "schedule-all", schedule):
+        item = {"next_due_at": due, "user_timezone": tz_name}
+        RoutineSerializer.refresh_due_fields(item)
+        state.append((item["is_due"], item["is_overdue"], item["hours_until_due"]))
+    return state
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("routine", "Routine"),
+                            ("entry", "Routine entry"),
+                            ("stock", "Stock"),
+                            ("lot", "Stock lot"),
+                            ("consumption", "Stock consumption"),
+                            ("group", "Stock group"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("object_id", models.PositiveBigIntegerField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "id"], name="sync_change_user_cursor_idx"),
+                    models.Index(fields=["created_at"], name="sync_change_created_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sync", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncPruneMark",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("pruned_through", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
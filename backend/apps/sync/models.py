@@ -0,0 +1,295 @@
+"""Change log behind ``GET /api/sync/``.
+
+Every write to a synced object appends one `SyncChange` row per user who
+could see it — before or after the write — through the receivers below.
+A row only says "this object may have changed for this user": the sync
+view re-reads the object and returns it if the user can still see it, or
+a tombstone if not. Deletes, lots removed by `delete_empty_lot` and
+access lost through unsharing therefore need no separate bookkeeping, and
+an over-wide audience costs a spurious tombstone, never a leak.
+
+Deleting a routine or a stock records a tombstone for it alone; its
+entries, or its lots and consumptions, go with it on the client. Entry
+deletes have no ``post_delete`` receiver (see
+`refresh_schedule_on_entry_save`), so their two delete paths call
+`entries_deleted` explicitly.
+
+Audiences come from the per-transaction memo the data-version receivers
+read too (`routine_members`, `stock_members`, `stock_routines`). Rows are
+inserted inside the writing transaction, so they commit or roll back with
+the write they describe.
+"""
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.core.transactions import transaction_state
+from apps.routines.models import (
+    ROUTINE_SCHEDULE_FIELDS,
+    Routine,
+    RoutineEntry,
+    Stock,
+    StockConsumption,
+    StockGroup,
+    StockLot,
+    UserStockGroup,
+    UserStockPin,
+    routine_members,
+    schedule_changed,
+    stock_members,
+    stock_routines,
+)
+
+
+class SyncChange(models.Model):
+    """One object touched for one user. The row id is the sync cursor."""
+
+    KIND_ROUTINE = "routine"
+    KIND_ENTRY = "entry"
+    KIND_STOCK = "stock"
+    KIND_LOT = "lot"
+    KIND_CONSUMPTION = "consumption"
+    KIND_GROUP = "group"
+    KIND_CHOICES = [
+        (KIND_ROUTINE, "Routine"),
+        (KIND_ENTRY, "Routine entry"),
+        (KIND_STOCK, "Stock"),
+        (KIND_LOT, "Stock lot"),
+        (KIND_CONSUMPTION, "Stock consumption"),
+        (KIND_GROUP, "Stock group"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # No database constraint: rows are written from `pre_delete` receivers
+    # while a user delete cascades, for members the collector has already
+    # gathered and is about to remove. Orphans are
+    # never read (the view filters on the requesting user) and age out with
+    # the rest.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="sync_change_user_cursor_idx"),
+            models.Index(fields=["created_at"], name="sync_change_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} → user {self.user_id} (#{self.id})"
+
+
+class SyncPruneMark(models.Model):
+    """How far `prune_sync_changes` has deleted the log. A single row.
+
+    Ids are not contiguous (a rolled-back insert still uses up its ids), so
+    the oldest remaining row cannot tell a pruned cursor from a gap.
+    """
+
+    pruned_through = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sync log pruned through #{self.pruned_through}"
+
+
+def record(kind, audience):
+    """Write a change row for every ``{object_id: user ids}`` pair in `audience`.
+
+    Rows go in with the write, inside its transaction. Rows the transaction
+    has already written are skipped; the record is kept per savepoint, so a
+    rolled-back savepoint takes its rows out of it as well.
+    """
+    rows = {
+        (user_id, kind, object_id)
+        for object_id, user_ids in audience.items()
+        for user_id in user_ids
+        if user_id is not None
+    }
+    connection = transaction.get_connection()
+    written = transaction_state(("sync.changes", tuple(connection.savepoint_ids)), set)
+    if written is None:
+        with transaction.atomic():
+            _write(rows, lock=True)
+        return
+    rows -= written
+    # The first write of the savepoint takes the lock: one taken in a
+    # savepoint that rolls back is released with it.
+    _write(rows, lock=not written)
+    written |= rows
+
+
+# Held from a transaction's first change row until it commits (Postgres):
+# ids are then visible in the order they were drawn, and the newest visible
+# row is a safe cursor. SQLite serializes writers by itself.
+SYNC_WRITE_LOCK = 0x5379_6E63
+
+
+def _write(rows, lock):
+    if not rows:
+        return
+    connection = transaction.get_connection()
+    if lock and connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [SYNC_WRITE_LOCK])
+    now = timezone.now()
+    SyncChange.objects.bulk_create(
+        SyncChange(user_id=user_id, kind=kind, object_id=object_id, created_at=now)
+        for user_id, kind, object_id in sorted(rows)
+    )
+
+
+def entries_deleted(routine_id, entry_ids):
+    """Record entry deletes, which no receiver sees (see the module docstring)."""
+    members = routine_members([routine_id])[routine_id]
+    record(SyncChange.KIND_ENTRY, dict.fromkeys(entry_ids, members))
+
+
+# ── Audiences ────────────────────────────────────────────────────────────────
+
+
+def _routines_changed(routine_ids):
+    record(SyncChange.KIND_ROUTINE, routine_members(routine_ids))
+
+
+def _stock_changed(stock_ids):
+    """The stock rows, and the routines consuming from them: routines show
+    their stock's name and quantities, stock its routines' consumption."""
+    record(SyncChange.KIND_STOCK, stock_members(stock_ids))
+    _routines_changed(set().union(*stock_routines(stock_ids).values()))
+
+
+def _children(model, parent, parent_id, user_ids):
+    ids = model.objects.filter(**{parent: parent_id}).values_list("pk", flat=True)
+    return dict.fromkeys(ids, set(user_ids))
+
+
+def _cascaded_from(origin, model):
+    """True when a delete reached this row through its parent's delete."""
+    return isinstance(origin, model)
+
+
+# ── Receivers ────────────────────────────────────────────────────────────────
+
+
+@receiver(schedule_changed)
+def sync_routine_schedule(sender, routine, **kwargs):
+    """Entry writes and routine saves end in `refresh_schedule`, bar the ones below."""
+    _routines_changed([routine.pk])
+    if routine.stock_id:
+        _stock_changed([routine.stock_id])
+
+
+@receiver(post_save, sender=Routine)
+def sync_routine_edit(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Partial routine saves that leave the schedule alone."""
+    if raw or update_fields is None or ROUTINE_SCHEDULE_FIELDS & set(update_fields):
+        return
+    sync_routine_schedule(sender, instance)
+
+
+@receiver(pre_delete, sender=Routine)
+def sync_routine_delete(sender, instance, **kwargs):
+    _routines_changed([instance.pk])
+    if instance.stock_id:
+        record(SyncChange.KIND_STOCK, stock_members([instance.stock_id]))
+
+
+@receiver(m2m_changed, sender=Routine.shared_with.through)
+def sync_routine_share(sender, instance, action, pk_set, **kwargs):
+    # `pre_` for removals: members are read before they are gone.
+    if action in ("post_add", "pre_remove", "pre_clear"):
+        _routines_changed([instance.pk])
+    if action == "post_add" and pk_set:
+        record(SyncChange.KIND_ENTRY, _children(RoutineEntry, "routine_id", instance.pk, pk_set))
+
+
+@receiver(post_save, sender=RoutineEntry)
+def sync_entry(sender, instance, raw=False, **kwargs):
+    if not raw:
+        members = routine_members([instance.routine_id])[instance.routine_id]
+        record(SyncChange.KIND_ENTRY, {instance.pk: members})
+
+
+@receiver(post_save, sender=Stock)
+def sync_stock(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _stock_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=Stock)
+def sync_stock_delete(sender, instance, **kwargs):
+    # Consuming routines fall back to `stock=None`.
+    _stock_changed([instance.pk])
+
+
+@receiver(m2m_changed, sender=Stock.shared_with.through)
+def sync_stock_share(sender, instance, action, pk_set, **kwargs):
+    # `pre_` for removals: read before `unlink_routines_on_unshare` drops the
+    # removed members' routine links.
+    if action in ("post_add", "pre_remove", "pre_clear"):
+        _stock_changed([instance.pk])
+    if action == "post_add" and pk_set:
+        record(SyncChange.KIND_LOT, _children(StockLot, "stock_id", instance.pk, pk_set))
+        record(SyncChange.KIND_CONSUMPTION, _children(StockConsumption, "stock_id", instance.pk, pk_set))
+
+
+@receiver(post_save, sender=StockLot)
+@receiver(post_delete, sender=StockLot)
+def sync_lot(sender, instance, raw=False, origin=None, **kwargs):
+    # A save that emptied the lot arrives after `delete_empty_lot` deleted it
+    # (and cleared its pk); the delete already recorded the tombstone.
+    if raw or instance.pk is None or _cascaded_from(origin, Stock):
+        return
+    record(SyncChange.KIND_LOT, {instance.pk: stock_members([instance.stock_id])[instance.stock_id]})
+    _stock_changed([instance.stock_id])
+
+
+@receiver(post_save, sender=StockConsumption)
+def sync_consumption(sender, instance, raw=False, **kwargs):
+    if not raw:
+        members = stock_members([instance.stock_id])[instance.stock_id]
+        record(SyncChange.KIND_CONSUMPTION, {instance.pk: members})
+        _stock_changed([instance.stock_id])
+
+
+@receiver(post_save, sender=StockGroup)
+@receiver(pre_delete, sender=StockGroup)
+def sync_group(sender, instance, raw=False, **kwargs):
+    """Groups are per user; stock filed under one shows its name."""
+    if raw:
+        return
+    record(SyncChange.KIND_GROUP, {instance.pk: {instance.user_id}})
+    record(SyncChange.KIND_STOCK, stock_members(instance.stocks.values_list("pk", flat=True)))
+    overrides = instance.stock_overrides.values_list("stock_id", flat=True)
+    record(SyncChange.KIND_STOCK, dict.fromkeys(overrides, {instance.user_id}))
+
+
+@receiver(post_save, sender=UserStockGroup)
+@receiver(post_delete, sender=UserStockGroup)
+@receiver(post_save, sender=UserStockPin)
+@receiver(post_delete, sender=UserStockPin)
+def sync_personal_stock_view(sender, instance, raw=False, origin=None, **kwargs):
+    """Group overrides and pins change the stock row of their owner only."""
+    if not raw and not _cascaded_from(origin, Stock):
+        record(SyncChange.KIND_STOCK, {instance.stock_id: {instance.user_id}})
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def sync_profile_change(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Members' names and the owner's timezone appear on routine and stock rows."""
+    fields = {"first_name", "last_name", "email", "timezone"}
+    if raw or created or (update_fields is not None and not fields & set(update_fields)):
+        return
+    visible = models.Q(user=instance) | models.Q(shared_with=instance)
+    _routines_changed(Routine.objects.filter(visible).values_list("pk", flat=True))
+    record(SyncChange.KIND_STOCK, stock_members(Stock.objects.filter(visible).values_list("pk", flat=True)))
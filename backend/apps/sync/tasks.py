@@ -0,0 +1,32 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SyncChange, SyncPruneMark
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="apps.sync.tasks.prune_sync_changes")
+def prune_sync_changes():
+    """
+    Delete SyncChange rows older than SYNC_RETENTION_DAYS. Runs daily via
+    Celery beat.
+
+    Deletes by id, up to the newest expired row, so what is left is always
+    a suffix of the log, and records that id in `SyncPruneMark`: the sync
+    view answers cursors below it with a snapshot.
+    """
+    threshold = timezone.now() - timedelta(days=settings.SYNC_RETENTION_DAYS)
+    horizon = SyncChange.objects.filter(created_at__lt=threshold).order_by("-id").values_list("id", flat=True).first()
+    if horizon is None:
+        return 0
+    with transaction.atomic():
+        SyncPruneMark.objects.update_or_create(pk=1, defaults={"pruned_through": horizon})
+        deleted, _ = SyncChange.objects.filter(id__lte=horizon).delete()
+    logger.info("prune_sync_changes: deleted %s rows", deleted)
+    return deleted
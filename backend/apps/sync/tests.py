@@ -0,0 +1,275 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITransactionTestCase
+
+from apps.routines.models import Routine, RoutineEntry, Stock, StockConsumption, StockGroup, StockLot
+
+from .models import SyncChange, SyncPruneMark
+from .tasks import prune_sync_changes
+
+User = get_user_model()
+
+
+def make_user(username):
+    return User.objects.create_user(username=username, password="pw", email=f"{username}@example.com")
+
+
+# Change rows are deduplicated per transaction, so the writes must really
+# commit: no per-test transaction around them.
+class SyncViewTest(APITransactionTestCase):
+    def setUp(self):
+        self.user = make_user("alice")
+        self.other = make_user("bob")
+        self.client.force_authenticate(user=self.user)
+
+    def sync(self, since=None):
+        params = {} if since is None else {"since": since}
+        response = self.client.get("/api/sync/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, body, key):
+        return [row["id"] for row in body[key]["updated"]]
+
+    # ── Snapshot ─────────────────────────────────────────────────────────────
+    def test_without_cursor_returns_full_snapshot(self):
+        stock = Stock.objects.create(user=self.user, name="Filter")
+        lot = StockLot.objects.create(stock=stock, quantity=3)
+        routine = Routine.objects.create(user=self.user, name="Water", interval_hours=24, stock=stock)
+        Routine.objects.create(user=self.other, name="Not mine", interval_hours=24)
+
+        body = self.sync()
+
+        self.assertTrue(body["reset"])
+        self.assertFalse(body["has_more"])
+        self.assertEqual(self.ids(body, "routines"), [routine.pk])
+        self.assertEqual(self.ids(body, "stock"), [stock.pk])
+        self.assertEqual(self.ids(body, "lots"), [lot.pk])
+        self.assertEqual(body["lots"]["updated"][0]["stock"], stock.pk)
+        self.assertNotIn("lots", body["stock"]["updated"][0])
+        self.assertEqual(body["cursor"], SyncChange.objects.order_by("-id").first().pk)
+
+    def test_partial_routine_save_is_recorded(self):
+        routine = Routine.objects.create(user=self.user, name="Water", interval_hours=24)
+        cursor = self.sync()["cursor"]
+
+        routine.name = "Tea"
+        routine.save(update_fields=["name"])
+        body = self.sync(cursor)
+
+        self.assertEqual(self.ids(body, "routines"), [routine.pk])
+
+    def test_invalid_cursor_is_rejected(self):
+        for since in ("abc", "-1"):
+            response = self.client.get("/api/sync/", {"since": since})
+            self.assertEqual(response.status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get("/api/sync/").status_code, 401)
+
+    # ── Deltas ───────────────────────────────────────────────────────────────
+    def test_delta_returns_only_changes_since_cursor(self):
+        old = Routine.objects.create(user=self.user, name="Old", interval_hours=24)
+        cursor = self.sync()["cursor"]
+
+        new = Routine.objects.create(user=self.user, name="New", interval_hours=24)
+        entry = RoutineEntry.objects.create(routine=new)
+        body = self.sync(cursor)
+
+        self.assertFalse(body["reset"])
+        self.assertEqual(self.ids(body, "routines"), [new.pk])
+        self.assertEqual(self.ids(body, "entries"), [entry.pk])
+        self.assertNotIn(old.pk, self.ids(body, "routines"))
+        self.assertEqual(self.sync(body["cursor"])["routines"], {"updated": [], "deleted": []})
+
+    def test_other_users_changes_are_not_returned(self):
+        cursor = self.sync()["cursor"]
+        Routine.objects.create(user=self.other, name="Bob's", interval_hours=24)
+
+        body = self.sync(cursor)
+
+        self.assertEqual(body["routines"], {"updated": [], "deleted": []})
+        # The cursor is a position in the shared log: it moves past Bob's
+        # rows too, so an idle client's cursor never falls behind pruning.
+        self.assertEqual(body["cursor"], SyncChange.objects.order_by("-id").first().pk)
+        self.assertGreater(body["cursor"], cursor)
+
+    def test_delete_returns_tombstone(self):
+        routine = Routine.objects.create(user=self.user, name="Water", interval_hours=24)
+        group = StockGroup.objects.create(user=self.user, name="Kitchen")
+        cursor = self.sync()["cursor"]
+
+        routine_id, group_id = routine.pk, group.pk
+        self.client.delete(f"/api/routines/{routine_id}/")
+        self.client.delete(f"/api/stock-groups/{group_id}/")
+        body = self.sync(cursor)
+
+        self.assertEqual(body["routines"], {"updated": [], "deleted": [routine_id]})
+        self.assertEqual(body["groups"], {"updated": [], "deleted": [group_id]})
+
+    def test_entry_delete_returns_tombstone(self):
+        routine = Routine.objects.create(user=self.user, name="Water", interval_hours=24)
+        entry = RoutineEntry.objects.create(routine=routine)
+        cursor = self.sync()["cursor"]
+
+        response = self.client.delete(f"/api/entries/{entry.pk}/")
+        self.assertEqual(response.status_code, 204)
+        body = self.sync(cursor)
+
+        self.assertEqual(body["entries"]["deleted"], [entry.pk])
+        self.assertEqual(self.ids(body, "routines"), [routine.pk])
+
+    def test_emptied_lot_returns_tombstone(self):
+        stock = Stock.objects.create(user=self.user, name="Filter")
+        lot = StockLot.objects.create(stock=stock, quantity=1)
+        cursor = self.sync()["cursor"]
+
+        response = self.client.post(f"/api/stock/{stock.pk}/consume/", {"quantity": 1}, format="json")
+        self.assertEqual(response.status_code, 200)
+        body = self.sync(cursor)
+
+        self.assertEqual(body["lots"]["deleted"], [lot.pk])
+        self.assertEqual(self.ids(body, "stock"), [stock.pk])
+        self.assertEqual(len(body["consumptions"]["updated"]), 1)
+
+    def test_unsharing_returns_tombstones_to_removed_member(self):
+        stock = Stock.objects.create(user=self.other, name="Shared")
+        stock.shared_with.add(self.user)
+        routine = Routine.objects.create(user=self.other, name="Shared", interval_hours=24)
+        routine.shared_with.add(self.user)
+        cursor = self.sync()["cursor"]
+
+        stock.shared_with.remove(self.user)
+        routine.shared_with.remove(self.user)
+        body = self.sync(cursor)
+
+        self.assertEqual(body["stock"], {"updated": [], "deleted": [stock.pk]})
+        self.assertEqual(body["routines"], {"updated": [], "deleted": [routine.pk]})
+
+    def test_sharing_sends_existing_children_to_new_member(self):
+        stock = Stock.objects.create(user=self.other, name="Shared")
+        lot = StockLot.objects.create(stock=stock, quantity=2)
+        consumption = StockConsumption.objects.create(stock=stock, quantity=1)
+        cursor = self.sync()["cursor"]
+
+        stock.shared_with.add(self.user)
+        body = self.sync(cursor)
+
+        self.assertEqual(self.ids(body, "stock"), [stock.pk])
+        self.assertEqual(self.ids(body, "lots"), [lot.pk])
+        self.assertEqual(self.ids(body, "consumptions"), [consumption.pk])
+
+    # ── Paging and retention ────────────────────────────────────────────────
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_pages_through_changes(self):
+        cursor = self.sync()["cursor"]
+        for name in ("A", "B", "C"):
+            StockGroup.objects.create(user=self.user, name=name)
+
+        first = self.sync(cursor)
+        second = self.sync(first["cursor"])
+
+        self.assertTrue(first["has_more"])
+        self.assertEqual(len(first["groups"]["updated"]), 2)
+        self.assertFalse(second["has_more"])
+        self.assertEqual(len(second["groups"]["updated"]), 1)
+
+    def test_cursor_moves_to_the_newest_change(self):
+        cursor = self.sync()["cursor"]
+        group = StockGroup.objects.create(user=self.user, name="Fresh")
+
+        body = self.sync(cursor)
+
+        self.assertEqual(self.ids(body, "groups"), [group.pk])
+        self.assertEqual(body["cursor"], SyncChange.objects.latest("id").pk)
+
+    def test_pruned_cursor_returns_snapshot(self):
+        StockGroup.objects.create(user=self.user, name="A")
+        cursor = self.sync()["cursor"]
+        StockGroup.objects.create(user=self.user, name="B")
+        StockGroup.objects.create(user=self.user, name="C")
+        missed = SyncChange.objects.filter(id__gt=cursor).order_by("id").first()
+        SyncChange.objects.filter(id__lte=missed.pk).update(created_at=timezone.now() - timedelta(days=31))
+        prune_sync_changes()
+
+        body = self.sync(cursor)
+
+        self.assertTrue(body["reset"])
+        self.assertEqual(len(body["groups"]["updated"]), 3)
+
+    def test_cursor_at_the_prune_mark_is_not_expired(self):
+        StockGroup.objects.create(user=self.user, name="A")
+        SyncChange.objects.update(created_at=timezone.now() - timedelta(days=31))
+        prune_sync_changes()
+        cursor = SyncPruneMark.objects.get().pruned_through
+        # Ids skipped by a rolled-back insert leave a gap after the mark.
+        SyncChange.objects.create(user=self.other, kind=SyncChange.KIND_GROUP, object_id=0, id=cursor + 10)
+        group = StockGroup.objects.create(user=self.user, name="B")
+
+        body = self.sync(cursor)
+
+        self.assertFalse(body["reset"])
+        self.assertEqual(self.ids(body, "groups"), [group.pk])
+
+    def _delta_queries(self, routines):
+        cursor = self.sync()["cursor"]
+        for i in range(routines):
+            routine = Routine.objects.create(user=self.user, name=f"R{i}", interval_hours=24)
+            RoutineEntry.objects.create(routine=routine)
+        with CaptureQueriesContext(connection) as queries:
+            body = self.sync(cursor)
+        self.assertEqual(len(body["routines"]["updated"]), routines)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_changes(self):
+        one = self._delta_queries(1)
+        five = self._delta_queries(5)
+        self.assertEqual(one, five)
+
+    def test_transaction_writes_each_change_once(self):
+        stock = Stock.objects.create(user=self.user, name="Filter")
+        lot = StockLot.objects.create(stock=stock, quantity=5)
+        cursor = self.sync()["cursor"]
+
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for quantity in (4, 3, 2):
+                    lot.quantity = quantity
+                    lot.save()
+
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "sync_syncchange"')]
+        self.assertEqual(len(inserts), 2)
+        kinds = SyncChange.objects.filter(id__gt=cursor).values_list("kind", "object_id")
+        self.assertCountEqual(kinds, [(SyncChange.KIND_LOT, lot.pk), (SyncChange.KIND_STOCK, stock.pk)])
+
+    def test_rolled_back_writes_leave_no_change(self):
+        cursor = self.sync()["cursor"]
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            StockGroup.objects.create(user=self.user, name="Gone")
+            raise RuntimeError
+
+        self.assertFalse(SyncChange.objects.filter(id__gt=cursor).exists())
+
+
+class PruneSyncChangesTest(TestCase):
+    def test_deletes_expired_rows_and_marks_the_newest(self):
+        user = make_user("alice")
+        old = timezone.now() - timedelta(days=31)
+        SyncChange.objects.all().delete()
+        rows = [SyncChange.objects.create(user=user, kind=SyncChange.KIND_GROUP, object_id=i) for i in range(3)]
+        SyncChange.objects.filter(pk__in=[rows[0].pk, rows[1].pk]).update(created_at=old)
+
+        deleted = prune_sync_changes()
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(list(SyncChange.objects.values_list("pk", flat=True)), [rows[2].pk])
+        self.assertEqual(SyncPruneMark.objects.get().pruned_through, rows[1].pk)
+
+    def test_nothing_expired(self):
+        self.assertEqual(prune_sync_changes(), 0)
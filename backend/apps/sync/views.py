@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from apps.routines.models import RoutineEntry, StockConsumption, StockGroup, StockLot
+from apps.routines.serializers import (
+    RoutineEntrySerializer,
+    RoutineSerializer,
+    StockConsumptionSerializer,
+    StockGroupSerializer,
+    StockLotSerializer,
+    StockSerializer,
+)
+from apps.routines.views import routine_queryset, stock_queryset
+
+from .models import SyncChange, SyncPruneMark
+
+
+class SyncStockLotSerializer(StockLotSerializer):
+    """Lots outside their stock need to say which one they belong to."""
+
+    stock = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta(StockLotSerializer.Meta):
+        fields = [*StockLotSerializer.Meta.fields, "stock"]
+
+
+# Response key → (change kind, visible queryset, serializer, fields omitted).
+# Rows are normalized: stock rows leave their lots to the `lots` key, and
+# entries and consumptions leave the routine and stock names to the client.
+def _collections(user):
+    own_stock = Q(stock__user=user) | Q(stock__shared_with=user)
+    return {
+        "routines": (SyncChange.KIND_ROUTINE, routine_queryset(user), RoutineSerializer, []),
+        "entries": (
+            SyncChange.KIND_ENTRY,
+            RoutineEntry.objects.filter(Q(routine__user=user) | Q(routine__shared_with=user))
+            .distinct()
+            .select_related("completed_by"),
+            RoutineEntrySerializer,
+            ["routine_name", "stock_name"],
+        ),
+        "stock": (SyncChange.KIND_STOCK, stock_queryset(user), StockSerializer, ["lots"]),
+        "lots": (SyncChange.KIND_LOT, StockLot.objects.filter(own_stock).distinct(), SyncStockLotSerializer, []),
+        "consumptions": (
+            SyncChange.KIND_CONSUMPTION,
+            StockConsumption.objects.filter(own_stock).distinct().select_related("consumed_by"),
+            StockConsumptionSerializer,
+            ["stock_name"],
+        ),
+        "groups": (SyncChange.KIND_GROUP, StockGroup.objects.filter(user=user), StockGroupSerializer, []),
+    }
+
+
+@api_view(["GET"])
+def sync(request):
+    """
+    Everything that changed for the user since ``?since=<cursor>``.
+
+    Each collection lists the rows the user can see (``updated``) and the
+    ids of the rows they no longer can (``deleted``: deleted, or access
+    lost). A routine or stock in ``deleted`` takes its entries, or its lots
+    and consumptions, with it. Without ``since`` — or with a cursor older
+    than the retained change log, flagged by ``reset`` — the response is a
+    full snapshot. ``has_more`` asks the client to call again with the
+    returned ``cursor`` straight away.
+
+    The cursor is a position in the log shared by all users, not in the
+    user's own rows: it advances past other users' changes as well, so the
+    cursor of a client with nothing to receive keeps up with pruning
+    instead of aging into a snapshot.
+
+    Change rows commit in id order (see `apps.sync.models.SYNC_WRITE_LOCK`), so the newest row
+    is a cursor no row still to come can fall behind.
+    """
+    since = request.query_params.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            since = -1
+        if since < 0:
+            return Response({"error": "Invalid since cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    settled = SyncChange.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    collections = _collections(request.user)
+    context = {"request": request}
+
+    if since is None or _expired(since):
+        body = {"cursor": settled, "reset": True, "has_more": False}
+        for key, (_, queryset, serializer_class, omit) in collections.items():
+            rows = serializer_class(queryset, many=True, context=context, omit=omit).data
+            body[key] = {"updated": rows, "deleted": []}
+        return Response(body)
+
+    limit = settings.SYNC_PAGE_SIZE
+    rows = list(
+        SyncChange.objects.filter(user=request.user, id__gt=since, id__lte=max(settled, since))
+        .order_by("id")
+        .values_list("id", "kind", "object_id")[: limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1][0] if has_more else max(settled, since)
+
+    touched = defaultdict(set)
+    for _, kind, object_id in rows:
+        touched[kind].add(object_id)
+
+    body = {"cursor": cursor, "reset": False, "has_more": has_more}
+    for key, (kind, queryset, serializer_class, omit) in collections.items():
+        ids = touched.get(kind, set())
+        visible = list(queryset.filter(pk__in=ids)) if ids else []
+        body[key] = {
+            "updated": serializer_class(visible, many=True, context=context, omit=omit).data,
+            "deleted": sorted(ids - {obj.pk for obj in visible}),
+        }
+    return Response(body)
+
+
+def _expired(since):
+    """True when rows after `since` have been pruned (see `prune_sync_changes`)."""
+    pruned = SyncPruneMark.objects.values_list("pruned_through", flat=True).first()
+    return pruned is not None and since < pruned
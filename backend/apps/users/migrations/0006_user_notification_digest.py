@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0005_login_code_and_auth_method"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="notification_digest",
+            field=models.BooleanField(default=False),
+        ),
+    ]
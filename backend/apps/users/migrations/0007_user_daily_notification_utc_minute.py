@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:35
+#
+# Materializes `daily_notification_time` as a minute of the UTC day so the
+# notifications beat selects heads-up candidates with an indexed range query.
+# The backfill mirrors `apps.users.models.daily_utc_minute`.
+
+import zoneinfo
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    now = timezone.now()
+    for tz_name in User.objects.values_list("timezone", flat=True).distinct().order_by():
+        try:
+            offset = now.astimezone(zoneinfo.ZoneInfo(tz_name)).utcoffset()
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            continue
+        offset_minutes = int(offset.total_seconds()) // 60
+        for user in User.objects.filter(timezone=tz_name).only("daily_notification_time").iterator():
+            local = user.daily_notification_time
+            User.objects.filter(pk=user.pk).update(
+                daily_notification_utc_minute=(local.hour * 60 + local.minute - offset_minutes) % (24 * 60)
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("users", "0006_user_notification_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="daily_notification_utc_minute",
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["daily_notification_utc_minute"], name="user_daily_utc_minute_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["timezone"], name="user_timezone_idx"),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
 import hashlib
 import zoneinfo
-from datetime import time
+from datetime import datetime, time, timedelta
 
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
@@ -17,6 +17,24 @@ def validate_timezone(value):
         raise ValidationError(f'"{value}" is not a valid IANA timezone.')
 
 
+def daily_utc_minute(tz_name, local_time, now=None):
+    """Minute of the UTC day at which `local_time` in `tz_name` falls, using
+    the zone's current UTC offset. None for an unknown zone.
+
+    Stored on the user so the notifications beat can select the users whose
+    heads-up window is open with an indexed range query.
+    """
+    try:
+        tz = zoneinfo.ZoneInfo(tz_name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+    if isinstance(local_time, str):
+        local_time = time.fromisoformat(local_time)
+    offset = (now or tz_now()).astimezone(tz).utcoffset()
+    local_minute = local_time.hour * 60 + local_time.minute
+    return (local_minute - int(offset.total_seconds()) // 60) % (24 * 60)
+
+
 class User(AbstractUser):
     # Override AbstractUser's email field to be required + unique. Email is
     # now the primary user identifier for login (see auth_method below).
@@ -48,6 +66,10 @@ class User(AbstractUser):
         default="08:30",
         help_text="Local time for the daily heads-up notification",
     )
+    # `daily_notification_time` as a minute of the UTC day under the zone's
+    # current offset. Recomputed on save and, for DST changes, by the
+    # `refresh_daily_utc_minutes` beat task. NULL for an invalid timezone.
+    daily_notification_utc_minute = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
     # Quiet hours. Reminders (every routine.reminder_interval_minutes) are
     # paused during this range when routine.respect_quiet_hours is True.
     # The initial "due" notification and the daily heads-up always fire.
@@ -55,6 +77,10 @@ class User(AbstractUser):
     quiet_hours_enabled = models.BooleanField(default=False)
     quiet_hours_start = models.TimeField(default=time(22, 0))
     quiet_hours_end = models.TimeField(default=time(7, 0))
+    # Hourly digest. When on, due and reminder pushes are held in the push
+    # outbox until the top of the next UTC hour and arrive as one summary.
+    # The daily heads-up and share/contact notifications are unaffected.
+    notification_digest = models.BooleanField(default=False)
     contacts = models.ManyToManyField("self", symmetrical=True, blank=True)
     # Bumped explicitly only when `timezone`, `daily_notification_time` or
     # `language` change (see UserUpdateSerializer). Exposed as an ETag for
@@ -64,6 +90,17 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "user"
         verbose_name_plural = "users"
+        indexes = [
+            models.Index(fields=["daily_notification_utc_minute"], name="user_daily_utc_minute_idx"),
+            models.Index(fields=["timezone"], name="user_timezone_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.daily_notification_utc_minute = daily_utc_minute(self.timezone, self.daily_notification_time)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"timezone", "daily_notification_time"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "daily_notification_utc_minute"}
+        super().save(*args, **kwargs)
 
     @property
     def display_name(self) -> str:
@@ -90,6 +127,14 @@ class User(AbstractUser):
         # range crosses midnight
         return local_time >= start or local_time < end
 
+    def quiet_hours_end_after(self, now_local):
+        """When the quiet period containing `now_local` (an aware datetime in
+        the user's timezone) ends, as an aware datetime."""
+        end = datetime.combine(now_local.date(), self.quiet_hours_end, tzinfo=now_local.tzinfo)
+        if end <= now_local:
+            end += timedelta(days=1)
+        return end
+
 
 class LoginCode(models.Model):
     """One-time 6-digit code emailed to a user for OTP login or signup
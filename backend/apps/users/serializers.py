@@ -11,6 +11,7 @@ SETTINGS_FIELDS = (
     "quiet_hours_enabled",
     "quiet_hours_start",
     "quiet_hours_end",
+    "notification_digest",
 )
 
 
@@ -28,6 +29,7 @@ class UserSerializer(serializers.ModelSerializer):
             "quiet_hours_enabled",
             "quiet_hours_start",
             "quiet_hours_end",
+            "notification_digest",
             "is_staff",
             "language",
             "settings_updated_at",
@@ -103,6 +105,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
             "quiet_hours_enabled",
             "quiet_hours_start",
             "quiet_hours_end",
+            "notification_digest",
             "first_name",
             "last_name",
             "settings_updated_at",
@@ -12,6 +12,8 @@ from datetime import timedelta
 
 from django.utils.timezone import now
 
+from nudge import embedded
+
 from .models import LoginCode, User
 from .tasks import send_login_email
 
@@ -65,7 +67,7 @@ def issue_otp(user: User, *, is_signup: bool, lang: str) -> None:
         code_hash=LoginCode.hash_code(code),
         expires_at=now() + OTP_TTL,
     )
-    send_login_email.delay(user.id, code, is_signup, lang)
+    embedded.enqueue(send_login_email, user.id, code, is_signup, lang)
 
 
 def verify_otp(user: User, raw_code: str) -> bool:
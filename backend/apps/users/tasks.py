@@ -1,14 +1,16 @@
 import logging
+from datetime import time
 from email.mime.image import MIMEImage
 from pathlib import Path
 
 from celery import shared_task
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db.models.functions import ExtractHour, ExtractMinute, Mod
 from django.template.loader import render_to_string
 from django.utils.timezone import now
 
-from .models import LoginCode, User
+from .models import LoginCode, User, daily_utc_minute
 
 logger = logging.getLogger(__name__)
 
@@ -97,3 +99,28 @@ def cleanup_login_codes() -> int:
     """
     deleted, _ = LoginCode.objects.filter(expires_at__lt=now()).delete()
     return deleted
+
+
+@shared_task(name="apps.users.tasks.refresh_daily_utc_minutes")
+def refresh_daily_utc_minutes() -> int:
+    """Re-derive `daily_notification_utc_minute` from each timezone's current
+    UTC offset, so the heads-up follows the wall clock across DST changes.
+    Runs every 15 minutes via Celery beat (`refresh-daily-utc-minutes`);
+    one UPDATE per timezone, touching only rows whose minute moved. Returns
+    the count updated.
+    """
+    current = now()
+    local_minute = ExtractHour("daily_notification_time") * 60 + ExtractMinute("daily_notification_time")
+    updated = 0
+    for tz_name in User.objects.values_list("timezone", flat=True).distinct().order_by():
+        # The UTC minute of local midnight is the zone's offset, negated.
+        shift = daily_utc_minute(tz_name, time(0, 0), current)
+        users = User.objects.filter(timezone=tz_name)
+        if shift is None:
+            updated += users.filter(daily_notification_utc_minute__isnull=False).update(
+                daily_notification_utc_minute=None
+            )
+            continue
+        minute = Mod(local_minute + shift, 24 * 60)
+        updated += users.exclude(daily_notification_utc_minute=minute).update(daily_notification_utc_minute=minute)
+    return updated
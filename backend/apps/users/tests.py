@@ -1,6 +1,8 @@
 import os
+from datetime import datetime, time
 from io import StringIO
 from unittest.mock import patch
+from zoneinfo import ZoneInfo
 
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
@@ -9,7 +11,8 @@ from django.db import IntegrityError
 from django.test import TestCase, override_settings
 from rest_framework.test import APITestCase
 
-from .models import LoginCode, validate_timezone
+from .models import LoginCode, daily_utc_minute, validate_timezone
+from .tasks import refresh_daily_utc_minutes
 
 User = get_user_model()
 
@@ -340,6 +343,64 @@ class CleanupLoginCodesTaskTest(TestCase):
         self.assertEqual(self.cleanup(), 1)
 
 
+# ── daily_notification_utc_minute ────────────────────────────────────────────
+
+
+class DailyUtcMinuteTest(APITestCase):
+    SUMMER = datetime(2025, 7, 15, 12, 0, tzinfo=ZoneInfo("UTC"))
+    WINTER = datetime(2025, 1, 15, 12, 0, tzinfo=ZoneInfo("UTC"))
+
+    def make_user(self, **kwargs):
+        return User.objects.create_user(username="utcmin", password="pw", email="utcmin@example.com", **kwargs)
+
+    def test_helper_follows_current_offset(self):
+        self.assertEqual(daily_utc_minute("Europe/Madrid", time(8, 30), self.SUMMER), 6 * 60 + 30)
+        self.assertEqual(daily_utc_minute("Europe/Madrid", time(8, 30), self.WINTER), 7 * 60 + 30)
+
+    def test_helper_wraps_around_midnight(self):
+        self.assertEqual(daily_utc_minute("Pacific/Auckland", time(8, 0), self.WINTER), 19 * 60)
+        self.assertEqual(daily_utc_minute("America/New_York", time(22, 0), self.WINTER), 3 * 60)
+
+    def test_helper_invalid_zone_is_none(self):
+        self.assertIsNone(daily_utc_minute("Not/Valid", time(8, 0)))
+
+    def test_save_computes_minute(self):
+        user = self.make_user(timezone="UTC", daily_notification_time="08:30")
+        user.refresh_from_db()
+        self.assertEqual(user.daily_notification_utc_minute, 8 * 60 + 30)
+
+    def test_save_with_update_fields_recomputes(self):
+        user = self.make_user(timezone="UTC", daily_notification_time="08:30")
+        user.daily_notification_time = time(9, 0)
+        user.save(update_fields=["daily_notification_time"])
+        user.refresh_from_db()
+        self.assertEqual(user.daily_notification_utc_minute, 9 * 60)
+
+    def test_settings_patch_recomputes(self):
+        user = self.make_user(timezone="UTC", daily_notification_time="08:30")
+        self.client.force_authenticate(user=user)
+        resp = self.client.patch("/api/auth/me/", {"timezone": "Asia/Kolkata"}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual(user.daily_notification_utc_minute, 3 * 60)
+
+    def test_refresh_task_follows_dst(self):
+        with patch("apps.users.models.tz_now", return_value=self.WINTER):
+            user = self.make_user(timezone="Europe/Madrid", daily_notification_time="08:30")
+        with patch("apps.users.tasks.now", return_value=self.SUMMER):
+            self.assertEqual(refresh_daily_utc_minutes(), 1)
+            self.assertEqual(refresh_daily_utc_minutes(), 0)
+        user.refresh_from_db()
+        self.assertEqual(user.daily_notification_utc_minute, 6 * 60 + 30)
+
+    def test_refresh_task_clears_invalid_zone(self):
+        user = self.make_user(timezone="UTC")
+        User.objects.filter(pk=user.pk).update(timezone="Not/Valid")
+        self.assertEqual(refresh_daily_utc_minutes(), 1)
+        user.refresh_from_db()
+        self.assertIsNone(user.daily_notification_utc_minute)
+
+
 # ── Celery beat schedule sanity ──────────────────────────────────────────────
 
 
@@ -429,6 +490,12 @@ class BeatScheduleTest(TestCase):
         self.assertEqual(entry["task"], "apps.users.tasks.cleanup_login_codes")
         self.assertEqual(entry["schedule"], 24 * 60 * 60)
 
+    def test_refresh_daily_utc_minutes_registered(self):
+        from django.conf import settings as dj_settings
+
+        entry = dj_settings.CELERY_BEAT_SCHEDULE["refresh-daily-utc-minutes"]
+        self.assertEqual(entry["task"], "apps.users.tasks.refresh_daily_utc_minutes")
+
 
 # ── /api/auth/login/start/ ───────────────────────────────────────────────────
 
@@ -469,10 +536,10 @@ class LoginStartTest(APITestCase):
 
     def setUp(self):
         from django.core import mail
-        from django.core.cache import cache
+        from django.core.cache import caches
 
         mail.outbox = []
-        cache.clear()
+        caches["throttle"].clear()
 
     def _post(self, email):
         return self.client.post(self.URL, {"email": email}, format="json")
@@ -606,10 +673,10 @@ class LoginVerifyTest(APITestCase):
 
     def setUp(self):
         from django.core import mail
-        from django.core.cache import cache
+        from django.core.cache import caches
 
         mail.outbox = []
-        cache.clear()
+        caches["throttle"].clear()
 
     def _issue_code_for(self, user, *, lang="en", is_signup=False):
         """Drive login_start via the helper so we exercise the real path,
@@ -831,10 +898,10 @@ class LoginRateLimitTest(APITestCase):
 
     def setUp(self):
         from django.core import mail
-        from django.core.cache import cache
+        from django.core.cache import caches
 
         mail.outbox = []
-        cache.clear()
+        caches["throttle"].clear()
 
     def _patch_rates(self, **overrides):
         """Returns a context manager that swaps the rates on the
@@ -882,6 +949,17 @@ class LoginRateLimitTest(APITestCase):
             r = self.client.post(self.URL_START, {"email": "victim@example.com"}, format="json")
             self.assertEqual(r.status_code, 429)
 
+    @override_settings(ALLOW_SELF_SIGNUP=True)
+    def test_counters_live_in_the_throttle_cache(self):
+        from django.core.cache import cache
+
+        with self._patch_rates(email_dest="1/hour"):
+            self.client.post(self.URL_START, {"email": "victim@example.com"}, format="json")
+            # Flushing the response cache does not reset a rate limit.
+            cache.clear()
+            r = self.client.post(self.URL_START, {"email": "victim@example.com"}, format="json")
+            self.assertEqual(r.status_code, 429)
+
 
 # ── JWT settings sanity ──────────────────────────────────────────────────────
 
@@ -1110,6 +1188,14 @@ class SettingsUpdatedAtTest(APITestCase):
         after = self._snapshot()
         self.assertGreater(after, before)
 
+    def test_patch_notification_digest_bumps(self):
+        before = self._snapshot()
+        response = self.client.patch("/api/auth/me/", {"notification_digest": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["notification_digest"])
+        after = self._snapshot()
+        self.assertGreater(after, before)
+
     def test_patch_same_value_does_not_bump(self):
         # Re-PATCHing the same value should not move the timestamp.
         before = self._snapshot()
@@ -1240,6 +1326,16 @@ class QuietHoursHelperTest(TestCase):
         u = self._user(enabled=True, start_h=22, start_m=0, end_h=22, end_m=0)
         self.assertFalse(u.is_in_quiet_hours(time(22, 0)))
 
+    def test_quiet_hours_end_after_same_night(self):
+        u = self._user(enabled=True, start_h=22, start_m=0, end_h=7, end_m=0)
+        now_local = datetime(2026, 1, 15, 3, 0, tzinfo=ZoneInfo("Europe/Madrid"))
+        self.assertEqual(u.quiet_hours_end_after(now_local), now_local.replace(hour=7))
+
+    def test_quiet_hours_end_after_before_midnight(self):
+        u = self._user(enabled=True, start_h=22, start_m=0, end_h=7, end_m=0)
+        now_local = datetime(2026, 1, 15, 23, 0, tzinfo=ZoneInfo("Europe/Madrid"))
+        self.assertEqual(u.quiet_hours_end_after(now_local), datetime(2026, 1, 16, 7, 0, tzinfo=now_local.tzinfo))
+
 
 class UserUpdateValidatorTest(APITestCase):
     """`UserUpdateSerializer.validate()` blocks daily_notification_time
@@ -1,26 +1,33 @@
+from django.core.cache import caches
 from rest_framework.throttling import AnonRateThrottle, SimpleRateThrottle
 
 
-class AuthRateThrottle(AnonRateThrottle):
+class ThrottleCacheMixin:
+    """Count in the `throttle` cache rather than DRF's default one."""
+
+    cache = caches["throttle"]
+
+
+class AuthRateThrottle(ThrottleCacheMixin, AnonRateThrottle):
     """Used by /api/auth/token/ and /api/auth/refresh/."""
 
     scope = "auth"
 
 
-class LoginStartThrottle(AnonRateThrottle):
+class LoginStartThrottle(ThrottleCacheMixin, AnonRateThrottle):
     """Per-IP rate on /api/auth/login/start/ — every hit can trigger an
     outbound email, so the cap is per-hour rather than per-minute."""
 
     scope = "login_start"
 
 
-class LoginVerifyThrottle(AnonRateThrottle):
+class LoginVerifyThrottle(ThrottleCacheMixin, AnonRateThrottle):
     """Per-IP rate on /api/auth/login/verify/."""
 
     scope = "login_verify"
 
 
-class EmailDestThrottle(SimpleRateThrottle):
+class EmailDestThrottle(ThrottleCacheMixin, SimpleRateThrottle):
     """Per-email-destination rate, keyed on the `email` field in the
     request body. Defends against an attacker rotating IPs to spam OTP
     emails to a single victim address. Returns no cache key (i.e. skips
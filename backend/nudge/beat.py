@@ -0,0 +1,86 @@
+"""Celery beat scheduler that only dispatches while it holds a leader lease.
+
+Several beat processes (or `worker -B` replicas) can run side by side: each
+one keeps its schedule ticking, but only the holder of a short Redis lease
+sends the due tasks. The leader renews the lease on every tick; when it
+dies, the lease expires and the next replica to tick takes over, well
+within one schedule interval.
+"""
+
+import logging
+import uuid
+
+from celery.beat import PersistentScheduler
+from django.conf import settings
+from redis import Redis, RedisError
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY = "celery:beat:leader"
+
+# Renew the lease if it is ours, otherwise take it if it is free.
+_ACQUIRE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# Drop the lease only if it is still ours.
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderElectedScheduler(PersistentScheduler):
+    def __init__(self, *args, **kwargs):
+        self.lease_seconds = settings.BEAT_LEADER_LEASE_SECONDS
+        self.token = uuid.uuid4().hex
+        self.is_leader = False
+        self._redis = None
+        super().__init__(*args, **kwargs)
+
+    def tick(self, *args, **kwargs):
+        leader = self._hold_lease()
+        if leader != self.is_leader:
+            logger.info("beat: %s the leader lease.", "acquired" if leader else "lost")
+            self.is_leader = leader
+        # Followers tick too, so their schedule stays in step with the
+        # leader's and a takeover does not re-fire everything at once. Wake
+        # up often enough to renew (or claim) the lease before it expires.
+        return min(super().tick(*args, **kwargs), self.lease_seconds / 3)
+
+    def apply_entry(self, entry, producer=None):
+        if not self.is_leader:
+            logger.debug("beat: not the leader — %s not sent.", entry.task)
+            return
+        super().apply_entry(entry, producer=producer)
+
+    def close(self):
+        if self.is_leader:
+            try:
+                self._client().eval(_RELEASE, 1, LEASE_KEY, self.token)
+            except RedisError:
+                logger.warning("beat: could not release the leader lease; it expires on its own.")
+            self.is_leader = False
+        super().close()
+
+    def _hold_lease(self):
+        try:
+            return bool(self._client().eval(_ACQUIRE, 1, LEASE_KEY, self.token, int(self.lease_seconds * 1000)))
+        except RedisError:
+            # Without Redis there is no broker to send to either; stepping
+            # down is the safe side.
+            logger.exception("beat: leader lease check failed.")
+            return False
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = Redis.from_url(settings.CELERY_BROKER_URL)
+        return self._redis
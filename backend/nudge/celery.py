@@ -7,3 +7,22 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nudge.settings")
 app = Celery("nudge")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+# Every queue a worker should consume (`celery -A nudge worker -Q ...`).
+# Routing lives in CELERY_TASK_ROUTES (settings.py).
+QUEUES = ("push", "email", "maintenance", "default")
+
+
+def queue_depths():
+    """Messages waiting in each queue, as ``{queue: count}``.
+
+    Reads the broker directly. With the Redis transport a queue is one list
+    per priority step, so the steps are summed. Reserved (prefetched)
+    messages are no longer in the broker and are not counted.
+    """
+    options = app.conf.broker_transport_options or {}
+    steps = options.get("priority_steps", [0])
+    sep = options.get("sep", ":")
+    with app.connection_for_read() as conn:
+        client = conn.default_channel.client
+        return {queue: sum(client.llen(f"{queue}{sep}{step}" if step else queue) for step in steps) for queue in QUEUES}
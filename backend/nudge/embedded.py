@@ -0,0 +1,161 @@
+"""In-process scheduler for small single-container deployments.
+
+With ``EMBEDDED_SCHEDULER`` on, no Celery worker, beat or Redis is needed:
+the web process runs the periodic tasks of ``CELERY_BEAT_SCHEDULE`` itself
+and hands request-triggered work (login emails, scheduled test pushes) to a
+bounded in-process work queue.
+
+Every gunicorn worker starts the scheduler thread, but only the one holding
+an exclusive lock on ``EMBEDDED_SCHEDULER_LOCK_FILE`` runs the schedule; the
+others keep retrying so a replacement worker takes over when the holder
+dies (the kernel releases the lock with the process). The work queue runs
+in every worker, since a request may land on any of them.
+
+Tasks are called directly, so ``.delay()`` calls made *inside* a task run
+inline (``CELERY_TASK_ALWAYS_EAGER`` is on in this mode).
+"""
+
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# How often a worker that does not hold the scheduler lock tries again.
+LOCK_RETRY_SECONDS = 30
+# Upper bound on one scheduler sleep, so a stop request is noticed promptly.
+MAX_IDLE_SECONDS = 60
+
+_start_lock = threading.Lock()
+_work_queue = None
+_worker = None
+_scheduler = None
+
+
+def start():
+    """Start the work-queue worker and the scheduler thread (once per process)."""
+    global _scheduler
+    _ensure_worker()
+    with _start_lock:
+        if _scheduler is None:
+            _scheduler = EmbeddedScheduler(settings.CELERY_BEAT_SCHEDULE, settings.EMBEDDED_SCHEDULER_LOCK_FILE)
+            _scheduler.start()
+
+
+def enqueue(task, *args, countdown=None):
+    """Run `task` with `args` outside the request.
+
+    Through Celery normally; in embedded mode through the in-process work
+    queue, after `countdown` seconds if given. The queue is bounded: when it
+    is full the job is dropped and logged rather than stalling the request.
+    """
+    if not settings.EMBEDDED_SCHEDULER:
+        task.apply_async(args, countdown=countdown)
+        return
+    if countdown:
+        timer = threading.Timer(countdown, _put, (task, args))
+        timer.daemon = True
+        timer.start()
+    else:
+        _put(task, args)
+
+
+class EmbeddedScheduler(threading.Thread):
+    """Runs each beat entry at its interval while holding the lock file.
+
+    Every entry runs once when the lock is first taken, then every
+    ``schedule`` seconds. Entries run one after another on this thread, so
+    a slow pass delays the next entry instead of overlapping it.
+    """
+
+    def __init__(self, schedule, lock_path):
+        super().__init__(name="embedded-scheduler", daemon=True)
+        self.entries = [(name, entry["task"], float(entry["schedule"])) for name, entry in schedule.items()]
+        self.lock_path = lock_path
+        self.next_run = {}
+        self._lock_fd = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if self._lock_fd is None and not self.acquire():
+                self._stopped.wait(LOCK_RETRY_SECONDS)
+                continue
+            self._stopped.wait(min(self.tick(), MAX_IDLE_SECONDS))
+        self.release()
+
+    def stop(self):
+        self._stopped.set()
+
+    def acquire(self):
+        """Take the lock file without blocking; True if this process holds it."""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        logger.info("Embedded scheduler running in pid %s.", os.getpid())
+        return True
+
+    def release(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def tick(self):
+        """Run every due entry; return the seconds until the next one is due."""
+        for name, task_name, interval in self.entries:
+            if time.monotonic() < self.next_run.get(name, 0):
+                continue
+            _run(import_string(task_name), ())
+            self.next_run[name] = time.monotonic() + interval
+        return max(0, min(self.next_run.values(), default=0) - time.monotonic())
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+
+
+def _ensure_worker():
+    global _work_queue, _worker
+    with _start_lock:
+        if _worker is None:
+            _work_queue = queue.Queue(maxsize=settings.EMBEDDED_WORK_QUEUE_SIZE)
+            _worker = threading.Thread(target=_work, args=(_work_queue,), name="embedded-worker", daemon=True)
+            _worker.start()
+
+
+def _put(task, args):
+    _ensure_worker()
+    try:
+        _work_queue.put_nowait((task, args))
+    except queue.Full:
+        logger.error("Embedded work queue is full; dropped %s.", task.name)
+
+
+def _work(jobs):
+    while True:
+        task, args = jobs.get()
+        _run(task, args)
+        jobs.task_done()
+
+
+def _run(task, args):
+    # These threads live for the whole process, outside any request cycle, so
+    # stale connections must be dropped by hand around each job.
+    close_old_connections()
+    try:
+        task(*args)
+    except Exception:
+        logger.exception("Embedded task %s failed.", task.name)
+    finally:
+        close_old_connections()
@@ -58,6 +58,7 @@ INSTALLED_APPS = [
     "apps.core",
     "apps.users",
     "apps.routines",
+    "apps.sync",
     "apps.notifications",
     "apps.idempotency",
 ]
@@ -217,21 +218,132 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION": True,
 }
 
+# ── Embedded scheduler ────────────────────────────────────────────────────────
+# Opt-in mode for small single-container installs: the web process runs the
+# beat schedule and background jobs itself (see `nudge.embedded`), so no Celery
+# worker, beat or Redis container is needed. REDIS_URL becomes optional.
+
+EMBEDDED_SCHEDULER = env.bool("EMBEDDED_SCHEDULER", default=False)
+# Only the gunicorn worker holding this lock runs the schedule.
+EMBEDDED_SCHEDULER_LOCK_FILE = env("EMBEDDED_SCHEDULER_LOCK_FILE", default="/tmp/nudge-scheduler.lock")
+# Pending login emails and test pushes per process; further jobs are dropped.
+EMBEDDED_WORK_QUEUE_SIZE = env.int("EMBEDDED_WORK_QUEUE_SIZE", default=100)
+
+REDIS_URL = env("REDIS_URL", default="") if EMBEDDED_SCHEDULER else env("REDIS_URL")
+
+# ── Cache ─────────────────────────────────────────────────────────────────────
+# Shared by the web and worker processes: the per-push-service backoff state,
+# data versions and cached API payloads live in "default", and the DRF
+# throttle counters in "throttle" (apps.users.throttles), so every gunicorn
+# worker counts against the same limit. Both reuse the Celery Redis instance.
+# Without Redis (embedded mode only) each process keeps its own caches, and
+# each worker its own throttle counters.
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+        "throttle": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "throttle",
+        },
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "throttle": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "throttle"},
+    }
+
+# The response cache and ETags hang off per-user data versions kept in this
+# cache (apps.core.versioning). A per-process cache would give each gunicorn
+# worker its own versions, and a write would only invalidate the worker that
+# served it: without Redis both are off.
+API_CACHE_SHARED = bool(REDIS_URL)
+
+# Lifetime of a cached API payload (dashboard and list endpoints, per user).
+# Writes invalidate through the per-user data version (apps.core.versioning);
+# this only bounds how long an unread entry occupies the cache. 0 disables.
+API_CACHE_SECONDS = env.int("API_CACHE_SECONDS", default=600) if API_CACHE_SHARED else 0
+
 # ── Celery ────────────────────────────────────────────────────────────────────
 
-CELERY_BROKER_URL = env("REDIS_URL")
-CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_BROKER_URL = REDIS_URL or "memory://localhost/"
+CELERY_RESULT_BACKEND = REDIS_URL or "cache+memory://"
 CELERY_TIMEZONE = "UTC"
-CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_ACCEPT_CONTENT = ["json"]
+# Every task is fire-and-forget: nothing reads a result back, so none is
+# written. A task that ever needs one can opt in with `ignore_result=False`.
+CELERY_TASK_IGNORE_RESULT = True
+# In embedded mode tasks run in-process, and a `.delay()` made by one task runs
+# inline in the same thread.
+CELERY_TASK_ALWAYS_EAGER = EMBEDDED_SCHEDULER
+
+# Queues. Time-critical push work never waits behind a slow SMTP server or a
+# large cleanup delete: each kind of work has its own queue (see
+# `nudge.celery.QUEUES`) and workers can be sized per queue with `-Q`. Within
+# a queue, lower priority numbers run first (Redis emulates priorities with
+# one list per step).
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_TASK_ROUTES = {
+    "apps.notifications.tasks.notify_routine": {"queue": "push", "priority": 0},
+    "apps.notifications.tasks.drain_push_outbox": {"queue": "push", "priority": 0},
+    "apps.notifications.tasks.send_scheduled_test": {"queue": "push", "priority": 0},
+    "apps.notifications.tasks.check_notifications": {"queue": "push", "priority": 3},
+    "apps.notifications.tasks.check_notifications_shard": {"queue": "push", "priority": 3},
+    "apps.notifications.tasks.plan_notifications": {"queue": "push", "priority": 3},
+    "apps.users.tasks.send_login_email": {"queue": "email", "priority": 0},
+    "apps.users.tasks.refresh_daily_utc_minutes": {"queue": "maintenance", "priority": 3},
+    "apps.routines.tasks.refresh_expired_stock_counters": {"queue": "maintenance", "priority": 3},
+    "apps.users.tasks.cleanup_login_codes": {"queue": "maintenance", "priority": 9},
+    "apps.idempotency.tasks.cleanup_idempotency_records": {"queue": "maintenance", "priority": 9},
+    "apps.sync.tasks.prune_sync_changes": {"queue": "maintenance", "priority": 9},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "queue_order_strategy": "priority",
+    "priority_steps": [0, 3, 6, 9],
+    "sep": ":",
+    # A message not acknowledged within this many seconds is delivered again.
+    # Eta tasks are held unacked until they run, so NOTIFY_ETA_HORIZON_SECONDS
+    # must stay below it.
+    "visibility_timeout": 60 * 60,
+}
+# Reserve one message at a time so a higher-priority message that arrives
+# later is not stuck behind a prefetched batch.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Beat replicas elect a leader through a Redis lease; only the leader sends
+# due tasks. A dead leader's lease expires after BEAT_LEADER_LEASE_SECONDS,
+# so failover happens well within the shortest schedule interval.
+CELERY_BEAT_SCHEDULER = "nudge.beat:LeaderElectedScheduler"
+BEAT_LEADER_LEASE_SECONDS = env.int("BEAT_LEADER_LEASE_SECONDS", default=30)
 
 CELERY_BEAT_SCHEDULE = {
     "check-notifications": {
         "task": "apps.notifications.tasks.check_notifications",
         "schedule": 300,  # every 5 minutes
     },
+    "plan-notifications": {
+        "task": "apps.notifications.tasks.plan_notifications",
+        "schedule": 300,  # well inside NOTIFY_ETA_HORIZON_SECONDS
+    },
+    "drain-push-outbox": {
+        "task": "apps.notifications.tasks.drain_push_outbox",
+        "schedule": 60,  # picks up retries; each beat also triggers a drain
+    },
+    "refresh-daily-utc-minutes": {
+        "task": "apps.users.tasks.refresh_daily_utc_minutes",
+        "schedule": 15 * 60,  # follows DST changes; the heads-up catch-up covers the gap
+    },
+    "refresh-expired-stock-counters": {
+        "task": "apps.routines.tasks.refresh_expired_stock_counters",
+        "schedule": 60 * 60,  # lots expire at midnight; reads fall back to a query until then
+    },
     "cleanup-idempotency-records": {
         "task": "apps.idempotency.tasks.cleanup_idempotency_records",
         "schedule": 24 * 60 * 60,  # once a day
@@ -240,6 +352,10 @@ CELERY_BEAT_SCHEDULE = {
         "task": "apps.users.tasks.cleanup_login_codes",
         "schedule": 24 * 60 * 60,  # once a day
     },
+    "prune-sync-changes": {
+        "task": "apps.sync.tasks.prune_sync_changes",
+        "schedule": 24 * 60 * 60,  # once a day
+    },
 }
 
 # ── Email (SMTP) ──────────────────────────────────────────────────────────────
@@ -304,12 +420,33 @@ STOCK_DIRECT_CONSUMPTION_HALF_DAYS = env.int("STOCK_DIRECT_CONSUMPTION_HALF_DAYS
 # shortcut and becomes a second list.
 STOCK_MAX_PINNED_ITEMS = env.int("STOCK_MAX_PINNED_ITEMS", default=4)
 
+# ── Delta sync (GET /api/sync/) ───────────────────────────────────────────────
+# Change rows returned per call; the client pages through the rest.
+SYNC_PAGE_SIZE = env.int("SYNC_PAGE_SIZE", default=500)
+# How long change rows are kept. A client whose cursor is older gets a full
+# snapshot instead of a delta.
+SYNC_RETENTION_DAYS = env.int("SYNC_RETENTION_DAYS", default=30)
+
 # ── Web Push VAPID ────────────────────────────────────────────────────────────
 
 VAPID_PRIVATE_KEY = env("VAPID_PRIVATE_KEY", default="")
 VAPID_PUBLIC_KEY = env("VAPID_PUBLIC_KEY", default="")
 VAPID_CLAIMS_EMAIL = env("VAPID_CLAIMS_EMAIL", default="admin@example.com")
 
+# Push delivery: how many sends run in parallel (and the keep-alive pool size
+# per push-service origin), and the per-request timeout in seconds.
+PUSH_MAX_CONCURRENCY = env.int("PUSH_MAX_CONCURRENCY", default=16)
+PUSH_TIMEOUT_SECONDS = env.int("PUSH_TIMEOUT_SECONDS", default=10)
+# Delivery attempts for a queued push before its outbox row is marked dead.
+PUSH_OUTBOX_MAX_ATTEMPTS = env.int("PUSH_OUTBOX_MAX_ATTEMPTS", default=5)
+# The 5-minute notification pass fans out into this many shard tasks
+# (partitioned by user id) so it spreads over the available workers.
+NOTIFICATION_SHARDS = env.int("NOTIFICATION_SHARDS", default=4)
+# How far ahead a routine's timed notification is queued with a Celery eta.
+# Later moments are queued by the `plan-notifications` beat once they come
+# this close. Must stay below the broker's visibility timeout.
+NOTIFY_ETA_HORIZON_SECONDS = env.int("NOTIFY_ETA_HORIZON_SECONDS", default=30 * 60)
+
 # ── Logging ───────────────────────────────────────────────────────────────────
 
 _LOG_LEVEL = env("DJANGO_LOG_LEVEL", default="INFO").upper()
@@ -392,3 +529,17 @@ if "test" in sys.argv:
     # is enqueueing the right task with the right args.
     CELERY_TASK_ALWAYS_EAGER = True
     CELERY_TASK_EAGER_PROPAGATES = True
+
+    # Per-process memory cache instead of Redis: no server needed, and each
+    # test run starts empty.
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "throttle": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "throttle"},
+    }
+
+    # User ids repeat from test to test (each one rolls back) while the memory
+    # cache lives for the whole run, so a cached payload could leak into the
+    # next test. Response-cache tests turn it on with `override_settings`.
+    API_CACHE_SECONDS = 0
+    # One process: the memory cache is shared by everything that runs.
+    API_CACHE_SHARED = True
@@ -7,4 +7,5 @@ urlpatterns = [
     path("api/auth/", include("apps.users.urls")),
     path("api/push/", include("apps.notifications.urls")),
     path("api/", include("apps.routines.urls")),
+    path("api/", include("apps.sync.urls")),
 ]
@@ -48,9 +48,9 @@ describe('useEntries (infinite query)', () => {
   it('paginates via fetchNextPage', async () => {
     server.use(
       http.get(`${BASE}/entries/`, ({ request }) => {
-        const page = new URL(request.url).searchParams.get('page')
-        if (page === '1') {
-          return HttpResponse.json({ results: [{ id: 1 }], next: '/api/entries/?page=2' })
+        const cursor = new URL(request.url).searchParams.get('cursor')
+        if (!cursor) {
+          return HttpResponse.json({ results: [{ id: 1 }], next: 'http://testserver/api/entries/?cursor=cD0y' })
         }
         return HttpResponse.json({ results: [{ id: 2 }], next: null })
       }),
@@ -157,8 +157,8 @@ describe('entry/consumption/me/contact mutations', () => {
     const { result, qc } = renderWith(() => useUpdateEntry())
     const filterKey = { dateFrom: '2026-01-01' }
     qc.setQueryData(['entries', filterKey], {
-      pages: [{ items: [{ id: 1, notes: 'old' }], next: null, page: 1 }],
-      pageParams: [1],
+      pages: [{ items: [{ id: 1, notes: 'old' }], next: null, cursor: null }],
+      pageParams: [null],
     })
 
     await act(async () => {
@@ -11,14 +11,21 @@ async function getJson(path) {
   return res.json()
 }
 
-function entriesQueryString(filters, page) {
-  const params = new URLSearchParams({ page: String(page) })
+function entriesQueryString(filters, cursor) {
+  const params = new URLSearchParams()
+  if (cursor) params.set('cursor', cursor)
   if (filters?.routine) params.set('routine', filters.routine)
   if (filters?.dateFrom) params.set('date_from', filters.dateFrom)
   if (filters?.dateTo) params.set('date_to', filters.dateTo)
   return params.toString()
 }
 
+// The history endpoints paginate by keyset: `next` carries an opaque
+// `?cursor=` token instead of a page number.
+function nextCursor(next) {
+  return next ? new URL(next, window.location.origin).searchParams.get('cursor') : null
+}
+
 export function useEntries(filters = {}) {
   return useInfiniteQuery({
     queryKey: ['entries', filters],
@@ -27,11 +34,11 @@ export function useEntries(filters = {}) {
       return {
         items: data.results ?? data,
         next: data.next ?? null,
-        page: pageParam,
+        cursor: pageParam,
       }
     },
-    initialPageParam: 1,
-    getNextPageParam: (lastPage) => (lastPage.next ? lastPage.page + 1 : undefined),
+    initialPageParam: null,
+    getNextPageParam: (lastPage) => nextCursor(lastPage.next) ?? undefined,
     enabled: filters?.enabled !== false,
   })
 }
@@ -112,7 +112,7 @@ describe('HistoryPage', () => {
           results: [
             { id: 1, routine_name: 'Vitamins', created_at: '2025-02-20T09:00:00Z', notes: '', consumed_lots: [] },
           ],
-          next: '/api/entries/?page=2',
+          next: '/api/entries/?cursor=cD0y',
         }),
       ),
     )
@@ -124,13 +124,12 @@ describe('HistoryPage', () => {
     server.use(
       http.get(`${BASE}/entries/`, ({ request }) => {
         const url = new URL(request.url)
-        const p = url.searchParams.get('page') || '1'
-        if (p === '1') {
+        if (!url.searchParams.get('cursor')) {
           return HttpResponse.json({
             results: [
               { id: 1, routine_name: 'Vitamins', created_at: '2025-02-20T09:00:00Z', notes: '', consumed_lots: [] },
             ],
-            next: '/api/entries/?page=2',
+            next: '/api/entries/?cursor=cD0y',
           })
         }
         return HttpResponse.json({
@@ -157,13 +156,12 @@ describe('HistoryPage', () => {
     let resolveSecond
     server.use(
       http.get(`${BASE}/entries/`, ({ request }) => {
-        const p = new URL(request.url).searchParams.get('page') || '1'
-        if (p === '1') {
+        if (!new URL(request.url).searchParams.get('cursor')) {
           return HttpResponse.json({
             results: [
               { id: 1, routine_name: 'Vitamins', created_at: '2025-02-20T09:00:00Z', notes: '', consumed_lots: [] },
             ],
-            next: '/api/entries/?page=2',
+            next: '/api/entries/?cursor=cD0y',
           })
         }
         return new Promise((r) => {
@@ -162,7 +162,8 @@ self.addEventListener('push', (event) => {
     body: data.body ?? '',
     icon: '/icons/pwa-192x192.png',
     badge: '/icons/badge.svg',
-    tag: data.data?.routine_id ? `${data.type}-${data.data.routine_id}` : data.type,
+    // Digests carry their own tag, so one never replaces another.
+    tag: data.tag ?? (data.data?.routine_id ? `${data.type}-${data.data.routine_id}` : data.type),
     renotify: true,
     data: data.data ?? {},
     actions: data.actions ?? [],